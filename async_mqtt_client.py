@@ -8,6 +8,16 @@ import struct
 import select
 
 
+# packets are built in a send buffer this big, and publish_many() sends up to this much per write;
+# about a TCP segment
+BATCH_SIZE = 1460
+# topics are encoded once and kept, up to this many: an application publishes to a fixed set
+TOPIC_CACHE_SIZE = 64
+# incoming packets are read into a buffer this big and parsed out of it, several to a read if they've
+# arrived together; a packet that doesn't fit is read on its own
+RECV_SIZE = 512
+
+
 class MQTTException(Exception):
     pass
 
@@ -16,7 +26,7 @@ class AsyncMQTTClient:
     """Async MQTT client using asyncio streams"""
 
     def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
-                 ssl=False, ssl_params={}):
+                 ssl=False, ssl_params={}, batch_size=BATCH_SIZE, recv_size=RECV_SIZE):
         """Initialize MQTT client
 
         Args:
@@ -28,6 +38,8 @@ class AsyncMQTTClient:
             keepalive: Keepalive interval in seconds
             ssl: Enable SSL/TLS
             ssl_params: SSL parameters dict
+            batch_size: Size of the send buffer packets are built in
+            recv_size: Size of the receive buffer packets are parsed out of
         """
         if port == 0:
             port = 8883 if ssl else 1883
@@ -48,9 +60,23 @@ class AsyncMQTTClient:
         self.lw_retain = False
         self._reader = None
         self._writer = None
+        self._sbuf = bytearray(batch_size)
+        self._smv = memoryview(self._sbuf)
+        self._topics = {}  # str: the topic as packed by _topic()
+        self._rbuf = bytearray(recv_size)
+        self._rmv = memoryview(self._rbuf)
+        self._rpos = 0  # start of what's not been parsed yet
+        self._rend = 0  # end of what's been read
+        self._body = None  # memoryview of the last packet read's variable header and payload
+        self._big = 0
 
     def set_callback(self, f):
-        """Set callback for incoming messages"""
+        """Set callback for incoming messages
+
+        The callback is called as f(topic, msg), both memoryviews onto the
+        receive buffer: they're only valid during the call, so a callback
+        that keeps either must copy it, e.g. str(topic, 'utf-8') or bytes(msg).
+        """
         self.cb = f
 
     def set_last_will(self, topic, msg, retain=False, qos=0):
@@ -98,52 +124,21 @@ class AsyncMQTTClient:
             # Wrap socket with asyncio streams
             self._reader = asyncio.StreamReader(self.sock)
             self._writer = asyncio.StreamWriter(self.sock, {})
+            self._rpos = self._rend = 0
 
             # Perform MQTT CONNECT handshake
-            # Build CONNECT packet
-            premsg = bytearray(b"\x10\0\0\0\0\0")
-            msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
-            sz = 10 + 2 + len(self.client_id)
-            msg[6] = clean_session << 1
-            if self.user is not None:
-                sz += 2 + len(self.user) + 2 + len(self.pswd)
-                msg[6] |= 0xC0
-            if self.keepalive:
-                msg[7] |= self.keepalive >> 8
-                msg[8] |= self.keepalive & 0x00FF
-            if self.lw_topic:
-                sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-                msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-                msg[6] |= self.lw_retain << 5
-
-            i = 1
-            while sz > 0x7f:
-                premsg[i] = (sz & 0x7f) | 0x80
-                sz >>= 7
-                i += 1
-            premsg[i] = sz
-
-            # Send CONNECT packet
-            self._writer.write(premsg[:i + 2])
-            self._writer.write(msg)
-            self._send_str(self.client_id)
-            if self.lw_topic:
-                self._send_str(self.lw_topic)
-                self._send_str(self.lw_msg)
-            if self.user is not None:
-                self._send_str(self.user)
-                self._send_str(self.pswd)
+            self._writer.write(self._smv[:self._pack_connect(clean_session)])
             await self._writer.drain()
 
             # Wait for CONNACK
-            resp = await self._reader.readexactly(4)
-            if resp[0] != 0x20 or resp[1] != 0x02:
-                raise MQTTException(resp)
-            if resp[3] != 0:
-                raise MQTTException(resp[3])
+            op = await self._read_packet()
+            resp = self._body
+            if op != 0x20 or len(resp) != 2:
+                raise MQTTException(op)
+            if resp[1] != 0:
+                raise MQTTException(resp[1])
 
-            return resp[2] & 1
+            return resp[0] & 1
 
         except Exception as e:
             if self.sock:
@@ -156,10 +151,66 @@ class AsyncMQTTClient:
             self._writer = None
             raise
 
-    def _send_str(self, s):
-        """Helper to send a length-prefixed string"""
-        self._writer.write(struct.pack("!H", len(s)))
-        self._writer.write(s)
+    def _pack_connect(self, clean_session):
+        """Build the CONNECT packet in the send buffer, returning its length"""
+        sz = 10 + 2 + len(self.client_id)
+        flags = clean_session << 1
+        if self.user is not None:
+            sz += 2 + len(self.user) + 2 + len(self.pswd)
+            flags |= 0xC0
+        if self.lw_topic:
+            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+        if sz + 5 > len(self._sbuf):
+            raise MQTTException("CONNECT too long")
+
+        n = self._pack_header(0, 0x10, sz)
+        struct.pack_into("!H4sBBH", self._sbuf, n, 4, b"MQTT", 4, flags, self.keepalive)
+        n = self._pack_str(n + 10, self.client_id)
+        if self.lw_topic:
+            n = self._pack_str(n, self.lw_topic)
+            n = self._pack_str(n, self.lw_msg)
+        if self.user is not None:
+            n = self._pack_str(n, self.user)
+            n = self._pack_str(n, self.pswd)
+        return n
+
+    def _pack_header(self, n, op, sz):
+        """Pack a fixed header - packet type and flags, then the remaining length - into the
+        send buffer at n, returning where it ends"""
+        buf = self._sbuf
+        buf[n] = op
+        n += 1
+        if sz < 0x80:
+            # nearly everything: a one-byte length, without the loop
+            buf[n] = sz
+            return n + 1
+        while sz > 0x7f:
+            buf[n] = (sz & 0x7f) | 0x80
+            sz >>= 7
+            n += 1
+        buf[n] = sz
+        return n + 1
+
+    def _pack_str(self, n, s):
+        """Pack a length-prefixed string into the send buffer at n, returning where it ends"""
+        end = n + 2 + len(s)
+        struct.pack_into("!H", self._sbuf, n, len(s))
+        self._sbuf[n + 2:end] = s
+        return end
+
+    def _topic(self, topic):
+        """Topic as it goes in a packet - 2-byte length, then UTF-8 - packed once per str topic where possible"""
+        if not isinstance(topic, str):
+            return struct.pack("!H", len(topic)) + topic
+        packed = self._topics.get(topic)
+        if packed is None:
+            topic_bytes = topic.encode('utf-8')
+            packed = struct.pack("!H", len(topic_bytes)) + topic_bytes
+            if len(self._topics) < TOPIC_CACHE_SIZE:
+                self._topics[topic] = packed
+        return packed
 
     async def disconnect(self):
         """Async disconnect"""
@@ -182,57 +233,109 @@ class AsyncMQTTClient:
     async def publish(self, topic, msg, retain=False, qos=0):
         """Async publish
 
+        The packet is built in the send buffer and goes out in one write;
+        a payload too big for the buffer is written from where it is.
+
         Args:
-            topic: String topic (will be UTF-8 encoded)
+            topic: String topic (will be UTF-8 encoded, and the encoding kept), or bytes
             msg: Bytes payload (caller must encode strings to bytes)
         """
-        # Topics are always strings in MQTT, encode to UTF-8
-        topic_bytes = topic.encode('utf-8')
+        topic = self._topic(topic)
 
         # Payload must be bytes - caller's responsibility to encode
         if not isinstance(msg, bytes):
             raise TypeError(f"msg must be bytes, got {type(msg).__name__}")
 
-        msg_bytes = msg
-
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic_bytes) + len(msg_bytes)
+        sz = len(topic) + len(msg)
         if qos > 0:
             sz += 2
         if sz >= 2097152:
             raise MQTTException("Message too long")
-        i = 1
-        while sz > 0x7f:
-            pkt[i] = (sz & 0x7f) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        self._writer.write(pkt[:i + 1])
-        self._send_str(topic_bytes)
+        n = self._pack_header(0, 0x30 | qos << 1 | retain, sz)
+        self._sbuf[n:n + len(topic)] = topic
+        n += len(topic)
         if qos > 0:
             self.pid += 1
             pid = self.pid
-            self._writer.write(struct.pack("!H", pid))
-        self._writer.write(msg_bytes)
+            struct.pack_into("!H", self._sbuf, n, pid)
+            n += 2
+        if n + len(msg) <= len(self._sbuf):
+            self._sbuf[n:n + len(msg)] = msg
+            self._writer.write(self._smv[:n + len(msg)])
+        else:
+            self._writer.write(self._smv[:n])
+            self._writer.write(msg)
         await self._writer.drain()
 
         if qos == 1:
-            # Wait for PUBACK
+            # Wait for PUBACK, handling whatever else arrives meanwhile
             while True:
-                op = await self._wait_msg_internal()
+                op = await self._read_packet()
                 if op == 0x40:
                     # PUBACK received
-                    sz = await self._reader.readexactly(1)
-                    if sz[0] != 0x02:
-                        raise MQTTException(f"Invalid PUBACK size: {sz[0]}")
-                    rcv_pid = await self._reader.readexactly(2)
-                    rcv_pid = struct.unpack("!H", rcv_pid)[0]
-                    if pid == rcv_pid:
+                    body = self._body
+                    if len(body) != 2:
+                        raise MQTTException(f"Invalid PUBACK size: {len(body)}")
+                    if pid == (body[0] << 8) | body[1]:
                         return
+                else:
+                    await self._handle(op)
         elif qos == 2:
             raise NotImplementedError("QoS 2 not supported")
 
+    async def publish_many(self, messages, retain=False):
+        """Async publish of several messages at QoS 0, batched
+
+        The PUBLISH packets are packed into one buffer and sent with a single
+        write and drain, rather than a write per packet part and a drain per
+        message. When the buffer fills it's sent and packing carries on; a
+        message too big for the buffer goes on its own.
+
+        Args:
+            messages: Iterable of (topic, msg) pairs: topic as for publish(),
+                bytes payload
+            retain: Retain flag, for all of them
+
+        Returns:
+            The number of messages sent
+
+        Example:
+            await client.publish_many([("home/temp", b"23.5"), ("home/rh", b"40")])
+        """
+        buf = self._sbuf
+        n = 0
+        count = 0
+        for topic, msg in messages:
+            packed = self._topic(topic)
+            if not isinstance(msg, bytes):
+                raise TypeError(f"msg must be bytes, got {type(msg).__name__}")
+            sz = len(packed) + len(msg)
+            if sz >= 2097152:
+                raise MQTTException("Message too long")
+            # fixed header: type and flags, then 1-3 bytes of remaining length
+            size = 2 + (sz > 0x7f) + (sz > 0x3fff) + sz
+            if n + size > len(buf):
+                if n:
+                    self._writer.write(self._smv[:n])
+                    await self._writer.drain()
+                    n = 0
+                if size > len(buf):
+                    await self.publish(topic, msg, retain)
+                    count += 1
+                    continue
+
+            n = self._pack_header(n, 0x30 | retain, sz)
+            buf[n:n + len(packed)] = packed
+            n += len(packed)
+            buf[n:n + len(msg)] = msg
+            n += len(msg)
+            count += 1
+
+        if n:
+            self._writer.write(self._smv[:n])
+            await self._writer.drain()
+        return count
+
     async def publish_string(self, topic, msg, retain=False, qos=0, encoding='utf-8'):
         """Convenience method to publish string payloads
 
@@ -258,90 +361,146 @@ class AsyncMQTTClient:
         if not self.cb:
             raise MQTTException("Callback not set")
 
-        topic_bytes = topic.encode('utf-8')
+        topic = self._topic(topic)
 
-        pkt = bytearray(b"\x82\0\0\0")
         self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic_bytes) + 1, self.pid)
-        self._writer.write(pkt)
-        self._send_str(topic_bytes)
-        self._writer.write(qos.to_bytes(1, "little"))
+        n = self._pack_header(0, 0x82, 2 + len(topic) + 1)
+        struct.pack_into("!H", self._sbuf, n, self.pid)
+        n += 2
+        self._sbuf[n:n + len(topic)] = topic
+        n += len(topic)
+        self._sbuf[n] = qos
+        self._writer.write(self._smv[:n + 1])
         await self._writer.drain()
 
-        # Wait for SUBACK
+        # Wait for SUBACK, handling whatever else arrives meanwhile
         while True:
-            op = await self._wait_msg_internal()
+            op = await self._read_packet()
             if op == 0x90:
-                # SUBACK received
-                resp = await self._reader.readexactly(4)
                 return
+            await self._handle(op)
 
-    async def _wait_msg_internal(self):
-        """Internal method to read next packet type"""
-        res = await self._reader.readexactly(1)
-        if res == b"":
-            raise OSError(-1)
-        return res[0]
+    def _parse(self):
+        """Find the next packet in the receive buffer
 
-    async def wait_msg(self):
-        """Async wait for incoming message"""
-        res = await self._reader.readexactly(1)
-        if res == b"":
+        Returns its type byte once the whole packet has been read, with
+        self._body set to its variable header and payload and the buffer
+        moved past it. Otherwise leaves the buffer as it was and returns -1,
+        or -2 if the packet is too big for the buffer, with self._body set to
+        its length and self._big to where its body starts.
+        """
+        buf = self._rbuf
+        i = self._rpos
+        end = self._rend
+        if i == end:
+            return -1
+        op = buf[i]
+        i += 1
+        sz = 0
+        sh = 0
+        while True:
+            if i == end:
+                return -1
+            b = buf[i]
+            i += 1
+            sz |= (b & 0x7f) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+            if sh > 21:
+                raise MQTTException("Invalid remaining length")
+        if end - i < sz:
+            if i + sz - self._rpos > len(buf):
+                self._body = sz
+                self._big = i
+                return -2
+            return -1
+        self._body = self._rmv[i:i + sz]
+        self._rpos = i + sz
+        return op
+
+    async def _fill(self):
+        """Read whatever has arrived, at least a byte, onto the end of the receive buffer"""
+        start = self._rpos
+        if start:
+            # move the partial packet that's left to the front
+            n = self._rend - start
+            self._rmv[:n] = self._rmv[start:self._rend]
+            self._rpos = 0
+            self._rend = n
+        if hasattr(self._reader, "readinto"):
+            n = await self._reader.readinto(self._rmv[self._rend:])
+        else:  # CPython's StreamReader
+            data = await self._reader.read(len(self._rbuf) - self._rend)
+            n = len(data)
+            self._rbuf[self._rend:self._rend + n] = data
+        if not n:
             raise OSError(-1)
+        self._rend += n
+
+    async def _read_packet(self):
+        """Read the next packet: returns its type byte, with its body in self._body"""
+        while True:
+            op = self._parse()
+            if op >= 0:
+                return op
+            if op == -2:
+                break
+            await self._fill()
+
+        # too big for the buffer: what's been read, then the rest straight from the stream
+        op = self._rbuf[self._rpos]
+        body = bytearray(self._body)
+        have = self._rend - self._big
+        body[:have] = self._rmv[self._big:self._rend]
+        body[have:] = await self._reader.readexactly(len(body) - have)
+        self._rpos = self._rend = 0
+        self._body = memoryview(body)
+        return op
 
-        if res == b"\xd0":  # PINGRESP
-            sz = await self._reader.readexactly(1)
-            if sz[0] != 0:
-                raise MQTTException(f"Invalid PINGRESP size: {sz[0]}")
+    async def _handle(self, op):
+        """Act on a packet that's been read: PUBLISH goes to the callback"""
+        if op == 0xd0:  # PINGRESP
+            if len(self._body):
+                raise MQTTException(f"Invalid PINGRESP size: {len(self._body)}")
             return None
 
-        op = res[0]
         if op & 0xF0 != 0x30:
             return op
 
         # PUBLISH packet
-        sz = await self._recv_len()
-        topic_len_data = await self._reader.readexactly(2)
-        topic_len = (topic_len_data[0] << 8) | topic_len_data[1]
-        topic = await self._reader.readexactly(topic_len)
-        sz -= topic_len + 2
-
+        body = self._body
+        topic_len = (body[0] << 8) | body[1]
+        i = 2 + topic_len
         if op & 6:
-            pid_data = await self._reader.readexactly(2)
-            pid = (pid_data[0] << 8) | pid_data[1]
-            sz -= 2
+            pid = (body[i] << 8) | body[i + 1]
+            i += 2
 
-        msg = await self._reader.readexactly(sz)
-
-        # Call callback with decoded topic string and raw message bytes
+        # Call callback with views of the topic and message
         if self.cb:
-            self.cb(topic.decode('utf-8'), msg)
+            self.cb(body[2:2 + topic_len], body[i:])
 
         # Send PUBACK if QoS 1
         if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self._writer.write(pkt)
+            struct.pack_into("!BBH", self._sbuf, 0, 0x40, 2, pid)
+            self._writer.write(self._smv[:4])
             await self._writer.drain()
         elif op & 6 == 4:
             raise NotImplementedError("QoS 2 not supported")
 
         return op
 
-    async def _recv_len(self):
-        """Async receive variable length"""
-        n = 0
-        sh = 0
-        while True:
-            b = await self._reader.readexactly(1)
-            b = b[0]
-            n |= (b & 0x7f) << sh
-            if not b & 0x80:
-                return n
-            sh += 7
+    async def wait_msg(self):
+        """Async wait for incoming message"""
+        return await self._handle(await self._read_packet())
 
     async def check_msg(self):
         """Non-blocking check for incoming messages"""
+        # a packet that came in with the last read is already here
+        op = self._parse()
+        if op >= 0:
+            return await self._handle(op)
+
         # Use select.poll to check if data is available
         poll = select.poll()
         try:
@@ -0,0 +1,129 @@
+"""
+Micro-benchmarks for the hot paths in lib.py.
+
+Run on the host with:  python -m benchmarks.bench_lib
+Run on the Pico with:  mpremote cp lib.py : + run benchmarks/bench_lib.py
+"""
+
+import time
+from lib import manchester_encode, manchester_decode, frame_encode, frame_encode_manchester, decode_manchester_frame
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+def bitwise_manchester_encode(frame, invert=False):
+    """The original per-bit encoder, for comparison."""
+    one, zero = (1, 2) if invert else (2, 1)
+    mframe = 0
+    mask = 0x80000000
+    while mask:
+        if frame & mask:
+            mframe <<= 2
+            mframe |= one
+        else:
+            mframe <<= 2
+            mframe |= zero
+        mask >>= 1
+    return mframe
+
+
+def bitwise_manchester_decode(mframe, invert=False):
+    """The original per-bit decoder, for comparison."""
+    one, zero = (0, 1) if invert else (1, 0)
+    frame = 0
+    mask = 0x8000000000000000
+    mask2 = 0x4000000000000000
+    for i in range(32):
+        if mframe & mask:
+            if mframe & mask2:
+                raise ValueError("Manchester decoding error")
+            frame <<= 1
+            frame |= one
+        else:
+            if not (mframe & mask2):
+                raise ValueError("Manchester decoding error")
+            frame <<= 1
+            frame |= zero
+        mask >>= 2
+        mask2 >>= 2
+    return frame
+
+
+def bincount_frame_encode(msg_type, data_id, data_value):
+    """The original string-counting parity encoder, for comparison."""
+    frame = 0
+    frame |= (msg_type & 0x07) << 28
+    frame |= (data_id & 0xff) << 16
+    frame |= (data_value & 0xffff)
+    if bin(frame).count("1") & 1:
+        frame |= 0x80000000
+    return frame
+
+
+def old_tx_path(args):
+    return manchester_encode(bincount_frame_encode(*args), invert=True)
+
+
+def new_tx_path(args):
+    return frame_encode_manchester(*args, invert=True)
+
+
+def old_rx_path(words):
+    frame = bitwise_manchester_decode((words[0] << 32) | words[1])
+    if bin(frame).count("1") & 1:
+        raise ValueError("Parity bit error")
+    return (frame >> 28) & 0x07, (frame >> 16) & 0xff, frame & 0xffff
+
+
+def new_rx_path(words):
+    return decode_manchester_frame(words[0], words[1])
+
+
+FRAMES = [0x00000000, 0xffffffff, 0x12345678, 0x40190000, 0xc0bb4278, 0x8a5a5a5a, 0x10011e00, 0x70230000]
+
+
+def bench(name, fn, args, rounds=200):
+    start = ticks_us()
+    for _ in range(rounds):
+        for a in args:
+            fn(a)
+    elapsed = ticks_diff(ticks_us(), start)
+    per_call = elapsed / (rounds * len(args))
+    print(f"{name:32s} {per_call:8.2f} us/call")
+    return per_call
+
+
+def main():
+    mframes = [manchester_encode(f) for f in FRAMES]
+
+    old = bench("manchester_encode (per-bit)", bitwise_manchester_encode, FRAMES)
+    new = bench("manchester_encode (table)", manchester_encode, FRAMES)
+    print(f"  speedup x{old / new:.1f}")
+
+    old = bench("manchester_decode (per-bit)", bitwise_manchester_decode, mframes)
+    new = bench("manchester_decode (table)", manchester_decode, mframes)
+    print(f"  speedup x{old / new:.1f}")
+
+    requests = [((f >> 28) & 0x07, (f >> 16) & 0xff, f & 0xffff) for f in FRAMES]
+    old = bench("frame_encode (bin count)", lambda a: bincount_frame_encode(*a), requests)
+    new = bench("frame_encode (parity table)", lambda a: frame_encode(*a), requests)
+    print(f"  speedup x{old / new:.1f}")
+
+    responses = [frame_encode_manchester(*r) for r in requests]
+    old = bench("tx encode path (old)", old_tx_path, requests)
+    new = bench("tx encode path (combined)", new_tx_path, requests)
+    print(f"  speedup x{old / new:.1f}")
+
+    old = bench("rx decode path (old)", old_rx_path, responses)
+    new = bench("rx decode path (combined)", new_rx_path, responses)
+    print(f"  speedup x{old / new:.1f}")
+
+
+main()
@@ -0,0 +1,291 @@
+"""
+Publishing a burst of MQTT messages: publish() per message versus one
+publish_many(), in time per message, writer calls (each a socket send on
+MicroPython) and the reads it took the broker to take them in.
+
+The broker is a stand-in on localhost that reads and discards whatever it's
+sent, counting bytes and reads; no CONNECT handshake, the client's streams
+are plugged straight into the connection.
+
+Then the cost of building packets, into a writer that drops them: the
+original publish() (fresh bytearray, struct.pack, topic.encode and slices per
+message) versus the send buffer and cached topics. The bytes allocated per
+message are MicroPython's only (gc.mem_alloc(), which counts everything
+allocated since the last collection): CPython frees by reference counting as
+it goes, leaving nothing to count, so they're "n/a" on the host. There the
+send buffer is no quicker either - a small allocation is cheap and the writes
+go nowhere, while it copies each packet in - so what shows on the host is the
+writes per message, each a socket send on the Pico.
+
+Last, the receive side: a burst of commands arriving together, parsed by the
+original wait_msg() (readexactly() per header byte and field) versus the
+receive buffer (readinto() once, packets parsed out of it), in reader calls -
+each an await, and on MicroPython a socket read - per message.
+
+Run on the host with:  python -m benchmarks.bench_mqtt
+Run on the Pico with:  mpremote cp async_mqtt_client.py : + run benchmarks/bench_mqtt.py
+"""
+
+import asyncio
+import gc
+import struct
+import time
+
+from async_mqtt_client import AsyncMQTTClient
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+PORT = 18830
+# a heartbeat's worth of state topics, and the discovery configs sent on connecting
+STATES = [(f"homeassistant/sensor/boilerSensor{i}/state", b"45.5") for i in range(21)]
+CONFIGS = [(f"homeassistant/sensor/boilerSensor{i}/config", b"{" + b"x" * 260 + b"}") for i in range(21)]
+
+
+class Broker:
+    """Reads and discards, counting."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.reads = 0
+        self.closed = False
+
+    async def handle(self, reader, writer):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            self.bytes += len(data)
+            self.reads += 1
+        writer.close()
+        self.closed = True
+
+    async def received(self, n):
+        while self.bytes < n:
+            await asyncio.sleep(0.001)
+
+
+class CountingWriter:
+    """Counts the writes and drains on their way to the real StreamWriter."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.writes = 0
+        self.drains = 0
+
+    def write(self, buf):
+        self.writes += 1
+        self.writer.write(buf)
+
+    async def drain(self):
+        self.drains += 1
+        await self.writer.drain()
+
+
+def mem_alloc():
+    # None where there's no gc.mem_alloc(), rather than a made-up 0
+    return gc.mem_alloc() if hasattr(gc, "mem_alloc") else None
+
+
+def bytes_per_msg(before, n):
+    if before is None:
+        return "n/a"
+    return f"{(gc.mem_alloc() - before) / n:.1f}"
+
+
+def packet_size(topic, msg):
+    sz = 2 + len(topic) + len(msg)
+    return 2 + (sz > 0x7f) + (sz > 0x3fff) + sz
+
+
+async def original_publish(client, topic, msg, retain=False):
+    """The original QoS 0 publish(), for comparison."""
+    topic_bytes = topic.encode('utf-8')
+    pkt = bytearray(b"\x30\0\0\0")
+    pkt[0] |= retain
+    sz = 2 + len(topic_bytes) + len(msg)
+    i = 1
+    while sz > 0x7f:
+        pkt[i] = (sz & 0x7f) | 0x80
+        sz >>= 7
+        i += 1
+    pkt[i] = sz
+    client._writer.write(pkt[:i + 1])
+    client._writer.write(struct.pack("!H", len(topic_bytes)))
+    client._writer.write(topic_bytes)
+    client._writer.write(msg)
+    await client._writer.drain()
+
+
+async def one_by_one(client, messages):
+    for topic, msg in messages:
+        await client.publish(topic, msg)
+
+
+async def batched(client, messages):
+    await client.publish_many(messages)
+
+
+async def bench(name, publish, client, broker, messages, rounds=50):
+    writer = client._writer
+    writer.writes = writer.drains = 0
+    reads = broker.reads
+    target = broker.bytes + rounds * sum(packet_size(topic, msg) for topic, msg in messages)
+    gc.collect()
+    before = mem_alloc()
+    start = ticks_us()
+    for _ in range(rounds):
+        await publish(client, messages)
+    await broker.received(target)
+    elapsed = ticks_diff(ticks_us(), start)
+    n = rounds * len(messages)
+    allocated = bytes_per_msg(before, n)
+    per_msg = elapsed / n
+    print(f"{name:32s} {per_msg:8.2f} us/msg {allocated:>8s} bytes/msg "
+          f"{writer.writes / rounds:6.1f} writes {writer.drains / rounds:6.1f} drains "
+          f"{(broker.reads - reads) / rounds:6.1f} broker reads per burst")
+    return per_msg
+
+
+class CountingNullWriter:
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, buf):
+        self.writes += 1
+
+    async def drain(self):
+        pass
+
+
+class MemoryReader:
+    """Serves a burst of incoming packets from memory, counting the calls it took."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.calls = 0
+
+    def rewind(self):
+        self.pos = 0
+
+    async def readexactly(self, n):
+        self.calls += 1
+        self.pos += n
+        return bytes(self.data[self.pos - n:self.pos])
+
+    async def readinto(self, buf):
+        self.calls += 1
+        n = min(len(buf), len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+async def original_wait_msg(client):
+    """The original wait_msg(), for a QoS 0 PUBLISH, for comparison."""
+    reader = client._reader
+    res = await reader.readexactly(1)
+    sz = 0
+    sh = 0
+    while True:
+        b = (await reader.readexactly(1))[0]
+        sz |= (b & 0x7f) << sh
+        if not b & 0x80:
+            break
+        sh += 7
+    topic_len_data = await reader.readexactly(2)
+    topic_len = (topic_len_data[0] << 8) | topic_len_data[1]
+    topic = await reader.readexactly(topic_len)
+    msg = await reader.readexactly(sz - topic_len - 2)
+    client.cb(topic.decode('utf-8'), msg)
+    return res[0]
+
+
+async def buffered_wait_msg(client):
+    return await client.wait_msg()
+
+
+def command_burst(n):
+    topic = b"homeassistant/switch/boilerCHEnabled/command"
+    packet = bytes([0x30, 2 + len(topic) + 2, 0, len(topic)]) + topic + b"ON"
+    return packet * n
+
+
+async def bench_recv(name, wait_msg, burst=8, rounds=20):
+    client = AsyncMQTTClient("bench", "127.0.0.1")
+    client.set_callback(lambda topic, msg: None)
+    reader = client._reader = MemoryReader(command_burst(burst))
+    gc.collect()
+    before = mem_alloc()
+    start = ticks_us()
+    for _ in range(rounds):
+        reader.rewind()
+        for _ in range(burst):
+            await wait_msg(client)
+    elapsed = ticks_diff(ticks_us(), start)
+    n = rounds * burst
+    allocated = bytes_per_msg(before, n)
+    print(f"{name:32s} {elapsed / n:8.2f} us/msg {allocated:>8s} bytes/msg {reader.calls / n:6.1f} reads/msg")
+    return elapsed / n
+
+
+async def bench_alloc(name, publish, messages, rounds=200):
+    client = AsyncMQTTClient("bench", "127.0.0.1")
+    client._writer = CountingNullWriter()
+    await publish(client, *messages[0])  # first-time costs: the topic cache
+    client._writer.writes = 0
+    gc.collect()
+    before = mem_alloc()
+    start = ticks_us()
+    for _ in range(rounds):
+        for topic, msg in messages:
+            await publish(client, topic, msg)
+    elapsed = ticks_diff(ticks_us(), start)
+    n = rounds * len(messages)
+    allocated = bytes_per_msg(before, n)
+    print(f"{name:32s} {elapsed / n:8.2f} us/msg {allocated:>8s} bytes/msg {client._writer.writes / n:6.1f} writes/msg")
+    return elapsed / n
+
+
+async def run():
+    broker = Broker()
+    server = await asyncio.start_server(broker.handle, "127.0.0.1", PORT)
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    client = AsyncMQTTClient("bench", "127.0.0.1")
+    client._reader = reader
+    client._writer = CountingWriter(writer)
+
+    for label, messages in (("states", STATES), ("configs", CONFIGS)):
+        old = await bench(f"{label}: publish()", one_by_one, client, broker, messages)
+        new = await bench(f"{label}: publish_many()", batched, client, broker, messages)
+        print(f"  speedup x{old / new:.1f}")
+
+    for label, messages in (("states", STATES), ("configs", CONFIGS)):
+        await bench_alloc(f"{label}: original publish()", original_publish, messages)
+        # called unbound, so both sides are one coroutine per message
+        await bench_alloc(f"{label}: send buffer publish()", AsyncMQTTClient.publish, messages)
+
+    old = await bench_recv("commands: original wait_msg()", original_wait_msg)
+    new = await bench_recv("commands: buffered wait_msg()", buffered_wait_msg)
+    print(f"  speedup x{old / new:.1f}")
+
+    writer.close()
+    while not broker.closed:
+        await asyncio.sleep(0.001)
+    server.close()
+    await server.wait_closed()
+
+
+def main():
+    asyncio.run(run())
+
+
+main()
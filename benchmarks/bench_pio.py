@@ -0,0 +1,137 @@
+"""
+Cycle-level figures for the OpenTherm PIO programs in opentherm_rp2.py, run on
+the emulator in sim/pio.py, so a change to a program can be measured without a Pico.
+
+Run on the host with:  python -m benchmarks.bench_pio
+"""
+
+import time
+
+from lib import frame_encode, frame_encode_manchester, decode_manchester_frame, frame_decode
+from sim import pio
+from unittests import fake_rp2
+
+MS = 1_000_000  # ns
+
+
+def load_programs():
+    rp2 = fake_rp2.make_rp2()
+    rp2.asm_pio = pio.asm_pio
+    with fake_rp2.install(rp2):
+        import opentherm_rp2
+    return opentherm_rp2
+
+
+def make_rx(ot, gpio, done, decode=False):
+    program = ot.opentherm_rx_decode if decode else ot.opentherm_rx
+    sm = pio.StateMachine(4, program, freq=ot.PIO_RX_FREQ, in_base=1, jmp_pin=1, gpio=gpio)
+    sm.irq(lambda s: done.append(gpio.now_ns))
+    sm.put(ot.PIO_RX_FRAME_BITS - 1 if decode else ot.PIO_RX_BITS - 1)
+    return sm
+
+
+def received(rx, decode):
+    if decode:
+        return frame_decode(rx.rx[0]) if len(rx.rx) == 1 else None
+    return decode_manchester_frame(rx.rx[0], rx.rx[1]) if len(rx.rx) == 2 else None
+
+
+def bench_tx(ot):
+    gpio = pio.GPIO()
+    done = []
+    tx = pio.StateMachine(0, ot.opentherm_tx, freq=ot.PIO_TX_FREQ, set_base=0, out_base=0, gpio=gpio)
+    tx.irq(lambda s: done.append(gpio.now_ns))
+    for word in frame_encode_manchester(4, 25, 0x1234, invert=True):
+        tx.put(word)
+    tx.active(1)
+    pio.run([tx], 100 * MS, stop=lambda: done)
+    start = gpio.edges[0][1][0]
+    print(f"{'tx cycles to irq':32s} {tx.cycles:8d}")
+    print(f"{'tx frame (first edge to irq)':32s} {(done[0] - start) / 1000:8.1f} us")
+
+
+def bench_rx_timeout(ot):
+    # a start bit, then a dead line: every bit is read by the timeout
+    gpio = pio.GPIO()
+    done = []
+    rx = make_rx(ot, gpio, done)
+    rx.trace = []
+    gpio.drive(1, [(1 * MS, 1), (int(1.5 * MS), 0)])
+    rx.active(1)
+    pio.run([rx], 200 * MS, stop=lambda: done)
+    in_pc = next(i for i, ins in enumerate(ot.opentherm_rx.instructions) if ins.op == "in")
+    samples = [t for t, pc in rx.trace if pc == in_pc]
+    gaps = [b - a for a, b in zip(samples, samples[1:])]
+    print(f"{'rx bit timeout':32s} {min(gaps) / 1000:8.1f} - {max(gaps) / 1000:.1f} us")
+
+
+def bench_rx_sampling(ot):
+    # how long after each line edge the bit is actually sampled
+    gpio = pio.GPIO()
+    done = []
+    rx = make_rx(ot, gpio, done)
+    rx.trace = []
+    waveform = pio.frame_waveform(frame_encode(4, 25, 0x1234), 2 * MS)
+    gpio.drive(1, waveform)
+    rx.active(1)
+    pio.run([rx], 100 * MS, stop=lambda: done)
+    in_pc = next(i for i, ins in enumerate(ot.opentherm_rx.instructions) if ins.op == "in")
+    edges = [t for t, _ in waveform]
+    lags = []
+    for t in (t for t, pc in rx.trace if pc == in_pc):
+        previous = [e for e in edges if e <= t]
+        lags.append(t - previous[-1])
+    print(f"{'rx sample after edge':32s} {min(lags) / 1000:8.1f} - {max(lags) / 1000:.1f} us")
+
+
+def bench_rx_jitter(ot, decode=False):
+    # the largest edge offset every frame in a small sweep still decodes at
+    frame = (4, 17, 0x4d80)
+    worst_ok = 0
+    for jitter_us in range(0, 300, 20):
+        ok = True
+        for seed in range(8):
+            offsets = [((i * 7919 + seed * 104729) % (2 * jitter_us + 1)) * 1000 - jitter_us * 1000 for i in range(68)]
+            gpio = pio.GPIO()
+            done = []
+            rx = make_rx(ot, gpio, done, decode)
+            gpio.drive(1, pio.frame_waveform(frame_encode(*frame), 2 * MS, jitter=lambda i: offsets[i] if i else 0))
+            rx.active(1)
+            pio.run([rx], 100 * MS, stop=lambda: done)
+            try:
+                ok = ok and received(rx, decode) == frame
+            except ValueError:
+                ok = False
+        if not ok:
+            break
+        worst_ok = jitter_us
+    name = "rx_decode" if decode else "rx"
+    print(f"{name + ' tolerates edge jitter':32s} {worst_ok:8d} us")
+
+
+def bench_emulator(ot):
+    gpio = pio.GPIO()
+    done = []
+    rx = make_rx(ot, gpio, done)
+    gpio.drive(1, pio.frame_waveform(frame_encode(4, 25, 0x1234), 2 * MS))
+    rx.active(1)
+    start = time.perf_counter()
+    pio.run([rx], 100 * MS, stop=lambda: done)
+    elapsed = time.perf_counter() - start
+    print(f"{'emulator speed':32s} {rx.instructions_run / elapsed:8.0f} instructions/s")
+
+
+def main():
+    ot = load_programs()
+    print(f"{'opentherm_tx instructions':32s} {len(ot.opentherm_tx):8d}")
+    print(f"{'opentherm_rx instructions':32s} {len(ot.opentherm_rx):8d}")
+    print(f"{'opentherm_rx_decode instructions':32s} {len(ot.opentherm_rx_decode):8d}")
+    bench_tx(ot)
+    bench_rx_timeout(ot)
+    bench_rx_sampling(ot)
+    bench_rx_jitter(ot)
+    bench_rx_jitter(ot, decode=True)
+    bench_emulator(ot)
+
+
+main()
@@ -0,0 +1,106 @@
+"""
+CPU cost of handing a request to the PIO transmitter: put() by hand versus
+DMA from opentherm_rp2.tx_buf, per exchange and in heap allocations.
+
+The words go to a sink state machine on PIO0 (SM 1) that pulls as fast as it
+can, so neither path ever blocks on a full FIFO and nothing goes on the wire.
+The RX side of the PIO-decoded mode is compared too: two words through the
+Python Manchester decode, versus one word through frame_decode.
+
+Run on the Pico with:  mpremote cp lib.py opentherm_rp2.py : + run benchmarks/bench_tx.py
+Run on the host with:  python -m benchmarks.bench_tx  (against the fake rp2: the
+                       allocation counts are MicroPython's only, and the DMA
+                       cost there is just the Python-side call)
+"""
+
+import gc
+import time
+from array import array
+
+try:
+    import rp2
+    import opentherm_rp2
+except ImportError:
+    from unittests import fake_rp2
+    with fake_rp2.install(fake_rp2.make_rp2(dma=True)):
+        import rp2
+        import opentherm_rp2
+
+from lib import frame_encode_manchester, frame_encode_manchester_into, decode_manchester_frame, frame_decode, frame_encode
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+PIO0_TXF1 = 0x50200014  # TX FIFO of PIO0 SM 1, the sink
+DREQ_PIO0_TX1 = 1
+REQUESTS = [(0, 0, 0x0300), (1, 1, 0x3c00), (0, 25, 0), (0, 17, 0), (1, 14, 0x6400), (0, 5, 0)]
+
+
+@rp2.asm_pio()
+def sink():
+    pull()
+
+
+def mem_alloc():
+    return gc.mem_alloc() if hasattr(gc, "mem_alloc") else 0
+
+
+def bench(name, fn, args, rounds=200):
+    gc.collect()
+    before = mem_alloc()
+    start = ticks_us()
+    for _ in range(rounds):
+        for a in args:
+            fn(a)
+    elapsed = ticks_diff(ticks_us(), start)
+    allocated = mem_alloc() - before
+    n = rounds * len(args)
+    per_call = elapsed / n
+    print(f"{name:32s} {per_call:8.2f} us/call {allocated / n:8.1f} bytes/call")
+    return per_call
+
+
+def main():
+    sm = rp2.StateMachine(1, sink, freq=125_000_000)
+    sm.active(1)
+    dma = rp2.DMA() if hasattr(rp2, "DMA") else None
+    buf = array('I', (0, 0))
+
+    def fifo_tx(request):
+        m_hi, m_lo = frame_encode_manchester(*request, invert=True)
+        sm.put(m_hi)
+        sm.put(m_lo)
+
+    ctrl = dma.pack_ctrl(size=2, inc_write=False, treq_sel=DREQ_PIO0_TX1) if dma else None
+
+    def dma_tx(request):
+        frame_encode_manchester_into(buf, request[0], request[1], request[2], True)
+        dma.config(read=buf, write=PIO0_TXF1, count=2, ctrl=ctrl, trigger=True)
+        while dma.active():
+            pass
+
+    old = bench("tx by put()", fifo_tx, REQUESTS)
+    if dma is not None:
+        new = bench("tx by DMA", dma_tx, REQUESTS)
+        print(f"  speedup x{old / new:.1f}")
+        dma.close()
+    else:
+        print("no rp2.DMA in this firmware: exchanges use put()")
+    sm.active(0)
+
+    responses = [frame_encode(4, data_id, value) for _, data_id, value in REQUESTS]
+    raw = [frame_encode_manchester((f >> 28) & 0x07, (f >> 16) & 0xff, f & 0xffff) for f in responses]
+    old = bench("rx decode (RX_RAW)", lambda words: decode_manchester_frame(words[0], words[1]), raw)
+    new = bench("rx decode (RX_DECODE)", frame_decode, responses)
+    print(f"  speedup x{old / new:.1f}")
+    print(f"opentherm_rp2 TX path: {'DMA' if opentherm_rp2.tx_dma is not None else 'put()'}")
+
+
+main()
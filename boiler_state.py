@@ -0,0 +1,186 @@
+from array import array
+
+
+# field numbers: floats, then ints, then booleans; a field's dirty bit is 1 << its number
+BOILER_FLOW_TEMPERATURE = 0
+BOILER_RETURN_TEMPERATURE = 1
+BOILER_DHW_TEMPERATURE = 2
+BOILER_MODULATION_LEVEL = 3
+BOILER_CH_PRESSURE = 4
+BOILER_DHW_FLOW_RATE = 5
+BOILER_FLOW_TEMPERATURE_SETPOINT = 6
+BOILER_FLOW_TEMPERATURE_SETPOINT_RANGEMIN = 7
+BOILER_FLOW_TEMPERATURE_SETPOINT_RANGEMAX = 8
+BOILER_DHW_TEMPERATURE_SETPOINT = 9
+BOILER_DHW_TEMPERATURE_SETPOINT_RANGEMIN = 10
+BOILER_DHW_TEMPERATURE_SETPOINT_RANGEMAX = 11
+
+BOILER_EXHAUST_TEMPERATURE = 12
+BOILER_FAN_SPEED = 13
+BOILER_MAX_CAPACITY = 14
+BOILER_STATUS_FLAGS = 15  # opentherm_app.STATUS_* bits
+BOILER_FAULT_FLAGS = 16  # opentherm_app.FAULT_* bits and the OEM code
+
+BOILER_FLAME_ACTIVE = 17
+BOILER_CH_ACTIVE = 18
+BOILER_DHW_ACTIVE = 19
+BOILER_FAULT_ACTIVE = 20
+BOILER_FAULT_LOW_WATER_PRESSURE = 21
+BOILER_FAULT_FLAME = 22
+BOILER_FAULT_LOW_AIR_PRESSURE = 23
+BOILER_FAULT_HIGH_WATER_TEMPERATURE = 24
+BOILER_CH_ENABLED = 25
+BOILER_DHW_ENABLED = 26
+
+FIRST_INT = BOILER_EXHAUST_TEMPERATURE
+FIRST_FLAG = BOILER_FLAME_ACTIVE
+
+# (attribute name, default) by field number
+FIELDS = (
+    ("boiler_flow_temperature", 0.0),
+    ("boiler_return_temperature", 0.0),
+    ("boiler_dhw_temperature", 0.0),
+    ("boiler_modulation_level", 0.0),
+    ("boiler_ch_pressure", 0.0),
+    ("boiler_dhw_flow_rate", 0.0),
+    ("boiler_flow_temperature_setpoint", 65.0),
+    ("boiler_flow_temperature_setpoint_rangemin", 0.0),
+    ("boiler_flow_temperature_setpoint_rangemax", 100.0),
+    ("boiler_dhw_temperature_setpoint", 60.0),
+    ("boiler_dhw_temperature_setpoint_rangemin", 0.0),
+    ("boiler_dhw_temperature_setpoint_rangemax", 100.0),
+    ("boiler_exhaust_temperature", 0),
+    ("boiler_fan_speed", 0),
+    ("boiler_max_capacity", 0),
+    ("boiler_status_flags", 0),
+    ("boiler_fault_flags", 0),
+    ("boiler_flame_active", False),
+    ("boiler_ch_active", False),
+    ("boiler_dhw_active", False),
+    ("boiler_fault_active", False),
+    ("boiler_fault_low_water_pressure", False),
+    ("boiler_fault_flame", False),
+    ("boiler_fault_low_air_pressure", False),
+    ("boiler_fault_high_water_temperature", False),
+    ("boiler_ch_enabled", False),
+    ("boiler_dhw_enabled", True),
+)
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+# how many consumers can track changes independently
+MAX_CONSUMERS = 4
+
+
+def fields(mask: int):
+    """The field numbers whose bits are set in mask, lowest first."""
+    field = 0
+    while mask:
+        if mask & 1:
+            yield field
+        mask >>= 1
+        field += 1
+
+
+class BoilerValues:
+    """What we know about the boiler and what we've asked of it, in a compact form.
+
+    Floats live in an array('f') (single precision, as MicroPython's own
+    floats are on the RP2040), ints in an array('i') and booleans as bits of
+    one int. Each field can be read and written by its old attribute name,
+    e.g. values.boiler_flame_active, or by number with get()/set().
+
+    Writing a field that changes its value sets the field's dirty bit for
+    every consumer. A consumer - MQTT, syslog, diagnostics - registers once
+    and then picks up just the fields that changed since it last looked:
+
+        mqtt_changes = values.consumer()
+        ...
+        for field in fields(values.take(mqtt_changes)):
+            publish(FIELDS[field][0], values.get(field))
+
+    The RBP flags and the power cycle count aren't tracked; they're plain
+    attributes.
+    """
+
+    __slots__ = ("_floats", "_ints", "_flags", "_dirty", "_consumers",
+                 "rbp_dhw_setpoint", "rbp_maxch_setpoint", "last_power_cycles")
+
+    def __init__(self):
+        self._floats = array('f', [default for _, default in FIELDS[:FIRST_INT]])
+        self._ints = array('i', [default for _, default in FIELDS[FIRST_INT:FIRST_FLAG]])
+        self._flags = 0
+        for field in range(FIRST_FLAG, len(FIELDS)):
+            if FIELDS[field][1]:
+                self._flags |= 1 << (field - FIRST_FLAG)
+        self._dirty = array('i', bytes(4 * MAX_CONSUMERS))
+        self._consumers = 0
+
+        # RBP flags from boiler (None = not yet read, "rw" = read/write, "ro" = read-only)
+        self.rbp_dhw_setpoint = None
+        self.rbp_maxch_setpoint = None
+        # Power cycle counter for restart detection (None = not yet read or unsupported)
+        self.last_power_cycles = None
+
+    def get(self, field: int):
+        if field < FIRST_INT:
+            return self._floats[field]
+        if field < FIRST_FLAG:
+            return self._ints[field - FIRST_INT]
+        return ((self._flags >> (field - FIRST_FLAG)) & 1) != 0
+
+    def set(self, field: int, value) -> bool:
+        """Set a field, marking it dirty if that changed it. Returns whether it did."""
+        if field < FIRST_INT:
+            floats = self._floats
+            old = floats[field]
+            floats[field] = value
+            # compared once stored, so the rounding to single precision doesn't count as a change
+            changed = floats[field] != old
+        elif field < FIRST_FLAG:
+            ints = self._ints
+            i = field - FIRST_INT
+            changed = ints[i] != value
+            ints[i] = value
+        else:
+            bit = 1 << (field - FIRST_FLAG)
+            flags = self._flags | bit if value else self._flags & ~bit
+            changed = flags != self._flags
+            self._flags = flags
+
+        if changed:
+            bit = 1 << field
+            dirty = self._dirty
+            for consumer in range(self._consumers):
+                dirty[consumer] |= bit
+        return changed
+
+    def consumer(self) -> int:
+        """Register a consumer of changes; every field starts out dirty for it."""
+        if self._consumers >= MAX_CONSUMERS:
+            raise ValueError("Too many BoilerValues consumers")
+        consumer = self._consumers
+        self._consumers += 1
+        self._dirty[consumer] = ALL_FIELDS
+        return consumer
+
+    def changes(self, consumer: int) -> int:
+        """The consumer's dirty bits, left set."""
+        return self._dirty[consumer]
+
+    def take(self, consumer: int, mask: int = ALL_FIELDS) -> int:
+        """The consumer's dirty bits within mask, clearing them."""
+        dirty = self._dirty[consumer] & mask
+        self._dirty[consumer] &= ~mask
+        return dirty
+
+    def mark(self, consumer: int, mask: int = ALL_FIELDS):
+        """Mark fields dirty for one consumer, e.g. to send everything again after reconnecting."""
+        self._dirty[consumer] |= mask
+
+
+def _accessor(field: int):
+    return property(lambda self: self.get(field), lambda self, value: self.set(field, value))
+
+
+for _field in range(len(FIELDS)):
+    setattr(BoilerValues, FIELDS[_field][0], _accessor(_field))
@@ -1,5 +1,115 @@
+import asyncio
 import socket
 import time
+from array import array
+
+
+try:
+    import micropython
+except ImportError:
+    micropython = None
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff, ticks_add
+except ImportError:
+    # CPython equivalents so the host-side tests can run
+    def ticks_ms() -> int:
+        return time.monotonic_ns() // 1000000
+
+    def ticks_us() -> int:
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(a: int, b: int) -> int:
+        return a - b
+
+    def ticks_add(a: int, b: int) -> int:
+        return a + b
+
+
+def _build_manchester_tables():
+    # byte -> 16 manchester bits ("10" for a 1, "01" for a 0, MSB first)
+    enc = array('H', bytes(512))
+    for b in range(256):
+        w = 0
+        for bit in range(7, -1, -1):
+            w = (w << 2) | (2 if (b >> bit) & 1 else 1)
+        enc[b] = w
+
+    # 8 manchester bits -> nibble, 0xff for an invalid symbol ("00" or "11")
+    dec = bytearray(b'\xff' * 256)
+    for n in range(16):
+        dec[enc[n] & 0xff] = n
+    return enc, dec
+
+
+_MANCHESTER_ENC, _MANCHESTER_DEC = _build_manchester_tables()
+
+
+if micropython is not None:
+    @micropython.viper
+    def _manchester_encode16(x: int) -> uint:
+        t = ptr16(_MANCHESTER_ENC)
+        return uint((t[(x >> 8) & 0xff] << 16) | t[x & 0xff])
+
+    @micropython.viper
+    def _manchester_decode32(w: uint) -> int:
+        t = ptr8(_MANCHESTER_DEC)
+        a = t[(w >> 24) & 0xff]
+        b = t[(w >> 16) & 0xff]
+        c = t[(w >> 8) & 0xff]
+        d = t[w & 0xff]
+        if (a | b | c | d) & 0xf0:
+            return -1
+        return (a << 12) | (b << 8) | (c << 4) | d
+
+    @micropython.viper
+    def _manchester_encode16_into(buf, i: int, x: int):
+        # stores the 32 bit word without boxing it as a big int
+        t = ptr16(_MANCHESTER_ENC)
+        p = ptr32(buf)
+        p[i] = (t[(x >> 8) & 0xff] << 16) | t[x & 0xff]
+
+    @micropython.viper
+    def _manchester_decode32_at(buf, i: int) -> int:
+        # _manchester_decode32 on word i of buf, read without boxing it as a big int
+        w = uint(ptr32(buf)[i])
+        t = ptr8(_MANCHESTER_DEC)
+        a = t[(w >> 24) & 0xff]
+        b = t[(w >> 16) & 0xff]
+        c = t[(w >> 8) & 0xff]
+        d = t[w & 0xff]
+        if (a | b | c | d) & 0xf0:
+            return -1
+        return (a << 12) | (b << 8) | (c << 4) | d
+
+    @micropython.viper
+    def _half_at(buf, i: int) -> int:
+        # 16 bit half i of buf's (little endian) 32 bit words: 0 is the low half of word 0
+        return int(ptr16(buf)[i])
+
+else:
+    def _manchester_encode16(x: int) -> int:
+        t = _MANCHESTER_ENC
+        return (t[(x >> 8) & 0xff] << 16) | t[x & 0xff]
+
+    def _manchester_encode16_into(buf, i: int, x: int):
+        buf[i] = _manchester_encode16(x)
+
+    def _manchester_decode32(w: int) -> int:
+        t = _MANCHESTER_DEC
+        a = t[(w >> 24) & 0xff]
+        b = t[(w >> 16) & 0xff]
+        c = t[(w >> 8) & 0xff]
+        d = t[w & 0xff]
+        if (a | b | c | d) & 0xf0:
+            return -1
+        return (a << 12) | (b << 8) | (c << 4) | d
+
+    def _manchester_decode32_at(buf, i: int) -> int:
+        return _manchester_decode32(buf[i])
+
+    def _half_at(buf, i: int) -> int:
+        return (buf[i >> 1] >> (16 if i & 1 else 0)) & 0xffff
 
 
 def manchester_encode(frame: int, invert: bool = False) -> int:
@@ -7,25 +117,11 @@ def manchester_encode(frame: int, invert: bool = False) -> int:
     Manchester encodes a 32 bit frame into a 64 bit integer.
     """
 
-    if invert:
-        one = 1
-        zero = 2
-    else:
-        one = 2
-        zero = 1
-
-    mframe = 0
-    mask = 0x80000000
-    while mask:
-        if frame & mask:
-            mframe <<= 2
-            mframe |= one
-        else:
-            mframe <<= 2
-            mframe |= zero
-        mask >>= 1
-
-    return mframe
+    # inverted manchester of x is the plain manchester encoding of ~x
+    mask = 0xffff if invert else 0
+    hi = ((frame >> 16) & 0xffff) ^ mask
+    lo = (frame & 0xffff) ^ mask
+    return (_manchester_encode16(hi) << 32) | _manchester_encode16(lo)
 
 
 def manchester_decode(mframe: int, invert: bool = False) -> int:
@@ -35,34 +131,45 @@ def manchester_decode(mframe: int, invert: bool = False) -> int:
     Will raise ValueError if decoding fails.
     """
 
+    hi = _manchester_decode32((mframe >> 32) & 0xffffffff)
+    lo = _manchester_decode32(mframe & 0xffffffff)
+    if hi < 0 or lo < 0:
+        raise ValueError("Manchester decoding error")
+
     if invert:
-        one = 0
-        zero = 1
-    else:
-        one = 1
-        zero = 0
-
-    frame = 0
-    mask = 0x8000000000000000
-    mask2 = 0x4000000000000000
-    for i in range(32):
-        if mframe & mask:
-            if mframe & mask2:
-                print(f"ERROR: Manchester decoding error at bit {i}")
-                raise ValueError("Manchester decoding error")
-            frame <<= 1
-            frame |= one
-
-        else:
-            if not (mframe & mask2):
-                print(f"ERROR: Manchester decoding error at bit {i}")
-                raise ValueError("Manchester decoding error")
-            frame <<= 1
-            frame |= zero
-        mask >>= 2
-        mask2 >>= 2
-
-    return frame
+        hi ^= 0xffff
+        lo ^= 0xffff
+    return (hi << 16) | lo
+
+
+_PARITY = bytes(bin(i).count("1") & 1 for i in range(256))
+
+
+# a frame's parity is that of its two 16 bit halves xor'ed together, and so of that
+# value's two bytes xor'ed: _PARITY[(x >> 8) ^ (x & 0xff)] for x = hi ^ lo. The encoders
+# below inline it, working on the halves so MicroPython never needs a big int or a tuple.
+
+
+def frame_parity(frame: int) -> int:
+    """
+    1 if a 32 bit frame has an odd number of bits set, i.e. a parity error.
+    """
+
+    x = ((frame >> 16) ^ frame) & 0xffff
+    return _PARITY[(x >> 8) ^ (x & 0xff)]
+
+
+def _frame_decode16(hi: int, lo: int) -> tuple[int, int, int]:
+    x = hi ^ lo
+    if _PARITY[(x >> 8) ^ (x & 0xff)]:
+        send_syslog("ERROR: Parity bit error, frame: %04x%04x", hi, lo)
+        raise ValueError("Parity bit error")
+
+    # OT spec 4.2.3: spare bits (27-24) should always be 0
+    if hi & 0x0F00:
+        send_syslog("WARNING: Non-zero spare bits in frame: %04x%04x", hi, lo)
+
+    return (hi >> 12) & 0x07, hi & 0xff, lo
 
 
 def frame_encode(msg_type: int, data_id: int, data_value: int) -> int:
@@ -70,13 +177,12 @@ def frame_encode(msg_type: int, data_id: int, data_value: int) -> int:
     Encodes opentherm info into a 32 bit network ordered frame
     """
 
-    frame = 0
-    frame |= (msg_type & 0x07) << 28
-    frame |= (data_id & 0xff) << 16
-    frame |= (data_value & 0xffff)
-    if bin(frame).count("1") & 1:  # parity bit
-        frame |= 0x80000000
-    return frame
+    hi = ((msg_type & 0x07) << 12) | (data_id & 0xff)
+    lo = data_value & 0xffff
+    x = hi ^ lo
+    if _PARITY[(x >> 8) ^ (x & 0xff)]:  # parity bit
+        hi |= 0x8000
+    return (hi << 16) | lo
 
 
 def frame_decode(frame: int) -> tuple[int, int, int]:
@@ -86,19 +192,85 @@ def frame_decode(frame: int) -> tuple[int, int, int]:
     Will raise ValueError if parity bit is incorrect.
     """
 
-    parity = bin(frame).count("1")
-    if parity & 1:
-        print(f"ERROR: Parity bit error, frame: {hex(frame)}")
-        raise ValueError("Parity bit error")
+    return _frame_decode16((frame >> 16) & 0xffff, frame & 0xffff)
 
-    # OT spec 4.2.3: spare bits (27-24) should always be 0
-    if (frame >> 24) & 0x0F:
-        send_syslog(f"WARNING: Non-zero spare bits in frame: {hex(frame)}")
 
-    msg_type = (frame >> 28) & 0x07
-    data_id = (frame >> 16) & 0xff
-    data_value = frame & 0xffff
-    return msg_type, data_id, data_value
+def frame_decode_from(buf, i: int = 0) -> tuple[int, int, int]:
+    """
+    As frame_decode, on word i of buf (an array('I')), e.g. as read from the
+    PIO receiver. The word is never boxed as a big int.
+    """
+
+    return _frame_decode16(_half_at(buf, 2 * i + 1), _half_at(buf, 2 * i))
+
+
+def frame_encode_manchester(msg_type: int, data_id: int, data_value: int, invert: bool = False) -> tuple[int, int]:
+    """
+    Encodes opentherm info straight into the two 32 bit manchester words the PIO
+    transmitter expects (high word first).
+    """
+
+    hi = ((msg_type & 0x07) << 12) | (data_id & 0xff)
+    lo = data_value & 0xffff
+    x = hi ^ lo
+    if _PARITY[(x >> 8) ^ (x & 0xff)]:
+        hi |= 0x8000
+    if invert:
+        hi ^= 0xffff
+        lo ^= 0xffff
+    return _manchester_encode16(hi), _manchester_encode16(lo)
+
+
+def frame_encode_manchester_into(buf, msg_type: int, data_id: int, data_value: int, invert: bool = False):
+    """
+    As frame_encode_manchester, but stores the two words in buf (an array('I')
+    of at least 2) without allocating, e.g. for DMA to the PIO transmitter.
+    """
+
+    hi = ((msg_type & 0x07) << 12) | (data_id & 0xff)
+    lo = data_value & 0xffff
+    x = hi ^ lo
+    if _PARITY[(x >> 8) ^ (x & 0xff)]:
+        hi |= 0x8000
+    if invert:
+        hi ^= 0xffff
+        lo ^= 0xffff
+    _manchester_encode16_into(buf, 0, hi)
+    _manchester_encode16_into(buf, 1, lo)
+
+
+def decode_manchester_frame(mhi: int, mlo: int, invert: bool = False) -> tuple[int, int, int]:
+    """
+    Decodes the two 32 bit manchester words from the PIO receiver (high word
+    first) into opentherm info.
+
+    Will raise ValueError if manchester decoding fails or the parity bit is incorrect.
+    """
+
+    hi = _manchester_decode32(mhi)
+    lo = _manchester_decode32(mlo)
+    if hi < 0 or lo < 0:
+        raise ValueError("Manchester decoding error")
+    if invert:
+        hi ^= 0xffff
+        lo ^= 0xffff
+    return _frame_decode16(hi, lo)
+
+
+def decode_manchester_frame_from(buf, invert: bool = False) -> tuple[int, int, int]:
+    """
+    As decode_manchester_frame, on the first two words of buf (an array('I')),
+    e.g. as read from the PIO receiver. The words are never boxed as big ints.
+    """
+
+    hi = _manchester_decode32_at(buf, 0)
+    lo = _manchester_decode32_at(buf, 1)
+    if hi < 0 or lo < 0:
+        raise ValueError("Manchester decoding error")
+    if invert:
+        hi ^= 0xffff
+        lo ^= 0xffff
+    return _frame_decode16(hi, lo)
 
 
 def s8(x: int) -> int:
@@ -113,21 +285,116 @@ def f88(x: int) -> float:
     return s16(x) / 256
 
 
-def send_syslog(message, port=514, hostname="picotherm", appname="main", procid="-", msgid="-"):
-    print(message)
+class Syslog:
+    """Non-blocking RFC5424 syslog sender.
 
-    syslog_addr = ('255.255.255.255', port)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    pri = 13  # user.notice
-    version = 1
-
-    # Omit timestamp entirely - device doesn't know the time
-    syslog_msg = f"<{pri}>{version} {hostname} {appname} {procid} {msgid} - {message}\r\n".encode('utf-8')
-    try:
-        sock.sendto(syslog_msg, syslog_addr)
-    except Exception as ex:
-        print(f"Syslog send failed: {ex}")
-    finally:
-        sock.close()
+    Messages are queued in a bounded ring buffer and sent in batches by the
+    run() task over a single reused UDP socket, so logging never blocks or
+    creates sockets on the caller's path. Formatting is left to the run()
+    task too: a message with args is a %-format string, only formatted (and
+    printed to the console) as it goes out. When the buffer is full new
+    messages are dropped and counted in `dropped`.
+    """
 
+    def __init__(self, size: int = 32, host: str = '255.255.255.255', batch: int = 8):
+        self.size = size
+        self.host = host
+        self.batch = batch
+        self.dropped = 0
+        self._ring = [None] * size
+        self._args = [None] * size
+        self._headers = [None] * size  # (hostname, appname, procid, msgid), or None for the defaults
+        self._ports = array('H', bytes(2 * size))
+        self._head = 0
+        self._count = 0
+        self._sock = None
+        self._event = None
+
+    def pending(self) -> int:
+        return self._count
+
+    def log(self, message, *args, port=514, hostname="picotherm", appname="main", procid="-", msgid="-"):
+        if self._count >= self.size:
+            self.dropped += 1
+            return
+
+        slot = (self._head + self._count) % self.size
+        self._ring[slot] = message
+        self._args[slot] = args
+        header = None
+        if hostname != "picotherm" or appname != "main" or procid != "-" or msgid != "-":
+            header = (hostname, appname, procid, msgid)
+        self._headers[slot] = header
+        self._ports[slot] = port
+        self._count += 1
+        if self._event is not None:
+            self._event.set()
+
+    def _take(self) -> bytes:
+        # formats the oldest message and removes it from the ring
+        head = self._head
+        message = self._ring[head]
+        args = self._args[head]
+        header = self._headers[head]
+        self._ring[head] = None
+        self._args[head] = None
+        self._head = (head + 1) % self.size
+        self._count -= 1
+
+        if args:
+            message = message % args
+        print(message)
+        hostname, appname, procid, msgid = header or ("picotherm", "main", "-", "-")
+        pri = 13  # user.notice
+        version = 1
+        # Omit timestamp entirely - device doesn't know the time
+        return f"<{pri}>{version} {hostname} {appname} {procid} {msgid} - {message}\r\n".encode('utf-8')
+
+    def flush(self, limit: int = 0) -> int:
+        """Send up to limit pending messages (all of them if 0), returning how many were taken."""
+        sent = 0
+        while self._count and (not limit or sent < limit):
+            port = self._ports[self._head]
+            msg = self._take()
+            sent += 1
+
+            try:
+                if self._sock is None:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                    self._sock = sock
+                self._sock.sendto(msg, (self.host, port))
+            except Exception as ex:
+                print(f"Syslog send failed: {ex}")
+                # start afresh with a new socket next time
+                self.close()
+        return sent
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
+    async def run(self):
+        """Background task draining the buffer in batches."""
+        self._event = asyncio.Event()
+        while True:
+            self._event.clear()
+            while self.flush(self.batch):
+                await asyncio.sleep(0)
+            await self._event.wait()
+
+
+syslog = Syslog()
+
+
+def send_syslog(message, *args, port=514, hostname="picotherm", appname="main", procid="-", msgid="-"):
+    """Queue a message for syslog and the console. With args, message is a %-format string,
+    formatted by the syslog task rather than on the caller's path:
+
+        send_syslog("Detail read of data ID %d failed: %s", data_id, ex)
+    """
+    syslog.log(message, *args, port=port, hostname=hostname, appname=appname, procid=procid, msgid=msgid)
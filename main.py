@@ -7,7 +7,12 @@ import json
 import utime
 import sys
 import rp2
-from lib import send_syslog
+from lib import send_syslog, syslog
+import boiler_state
+from boiler_state import BoilerValues, BOILER_FLOW_TEMPERATURE_SETPOINT
+from state_publisher import StatePublisher
+from opentherm_poll import PollScheduler
+from opentherm_caps import CapabilityCache
 from async_mqtt_client import AsyncMQTTClient
 
 
@@ -16,53 +21,27 @@ class BoilerRestartDetected(Exception):
     pass
 
 
-class BoilerValues():
-    # readable things
-    boiler_flow_temperature: float = 0.0
-    boiler_return_temperature: float = 0.0
-    boiler_exhaust_temperature: float = 0.0
-    boiler_dhw_temperature: float = 0.0
-    boiler_fan_speed: float = 0.0
-    boiler_modulation_level: float = 0.0
-    boiler_ch_pressure: float = 0.0
-    boiler_dhw_flow_rate: float = 0.0
-    boiler_max_capacity: float = 0
-    boiler_flame_active: bool = False
-    boiler_ch_active: bool = False
-    boiler_dhw_active: bool = False
-    boiler_fault_active: bool = False
-    boiler_fault_low_water_pressure: bool = False
-    boiler_fault_flame: bool = False
-    boiler_fault_low_air_pressure: bool = False
-    boiler_fault_high_water_temperature: bool = False
-
-    # writable things
-    boiler_ch_enabled: bool = False
-    boiler_dhw_enabled: bool = True
-
-    boiler_flow_temperature_setpoint: float = 65.0
-    boiler_flow_temperature_setpoint_rangemin: float = 0.0
-    boiler_flow_temperature_setpoint_rangemax: float = 100.0
-
-    boiler_dhw_temperature_setpoint: float = 60.0
-    boiler_dhw_temperature_setpoint_rangemin: float = 0.0
-    boiler_dhw_temperature_setpoint_rangemax: float = 100.0
-
-    # RBP flags from boiler (None = not yet read, "rw" = read/write, "ro" = read-only)
-    rbp_dhw_setpoint: str = None
-    rbp_maxch_setpoint: str = None
-
-    # Power cycle counter for restart detection (None = not yet read or unsupported)
-    last_power_cycles: int = None
-
 boiler_values = BoilerValues()
+# boiler_loop() re-encodes TSet when the setpoint has changed
+_loop_changes = boiler_values.consumer()
 mqtt_client_instance = None
+# set to send the HA discovery configs on the next pass of the MQTT loop
+hass_discovery_due = True
 
 
-STATUS_LOOP_DELAY_MS = 750
-GET_DETAILED_STATS_MS = 10 * 1000
+# OT spec 5.2: status/TSet at least every second; leaves room for the exchanges themselves running late
+STATUS_LOOP_PERIOD_MS = 900
 WRITE_SETTINGS_MS = 10 * 1000
-MQTT_PUBLISH_MS = 10 * 1000
+# state topics: changes go out at most this often (faults and command acknowledgements straight away),
+# and everything at least every MQTT_HEARTBEAT_MS
+MQTT_STATE_INTERVAL_MS = 1000
+MQTT_HEARTBEAT_MS = 5 * 60 * 1000
+# exchange timing histograms and error counts (see opentherm_app.diagnostics()) and the
+# detail poller's per data ID intervals and read rates under "polls", as JSON
+DIAGNOSTICS_TOPIC = "picotherm/diagnostics"
+DIAGNOSTICS_PUBLISH_MS = 60 * 1000
+# HA's birth message: "online" when it has (re)started and wants the discovery configs and states again
+HASS_STATUS_TOPIC = "homeassistant/status"
 
 BOILER_RETURN_TEMPERATURE_HASS_CONFIG = json.dumps({"device_class": "temperature",
                                                     "state_topic": "homeassistant/sensor/boilerReturnTemperature/state",
@@ -226,92 +205,109 @@ BOILER_DHW_ACTIVE_HASS_CONFIG = json.dumps({ "device_class": "heat",
                                                })
 
 
-async def boiler_loop(last_get_detail_timestamp: int, last_write_settings_timestamp: int) -> tuple[int, int]:
+BOILER_CH_FLOW_TEMPERATURE_SETPOINT_CONFIG_TOPIC = "homeassistant/number/boilerCHFlowTemperatureSetpoint/config"
+BOILER_DHW_FLOW_TEMPERATURE_SETPOINT_CONFIG_TOPIC = "homeassistant/number/boilerDHWFlowTemperatureSetpoint/config"
+
+# discovery config topic: config JSON, encoded once here. They're published retained once per connection
+# (see mqtt_publish_config()); boiler_setup() swaps in the boiler's setpoint ranges
+HASS_CONFIGS = {
+    "homeassistant/sensor/boilerReturnTemperature/config": BOILER_RETURN_TEMPERATURE_HASS_CONFIG,
+    "homeassistant/sensor/boilerExhaustTemperature/config": BOILER_EXHAUST_TEMPERATURE_HASS_CONFIG,
+    "homeassistant/sensor/boilerFanSpeed/config": BOILER_FAN_SPEED_HASS_CONFIG,
+    "homeassistant/sensor/boilerModulationLevel/config": BOILER_MODULATION_LEVEL_HASS_CONFIG,
+    "homeassistant/sensor/boilerChPressure/config": BOILER_CH_PRESSURE_HASS_CONFIG,
+    "homeassistant/sensor/boilerDhwFlowRate/config": BOILER_DHW_FLOW_RATE_HASS_CONFIG,
+    "homeassistant/sensor/boilerMaxCapacity/config": BOILER_MAX_CAPACITY_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerFlameActive/config": BOILER_FLAME_ACTIVE_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerFaultActive/config": BOILER_FAULT_ACTIVE_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerFaultLowWaterPressure/config": BOILER_FAULT_LOW_WATER_PRESSURE_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerFaultFlame/config": BOILER_FAULT_FLAME_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerFaultLowAirPressure/config": BOILER_FAULT_LOW_AIR_PRESSURE_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerHighWaterTemperature/config": BOILER_FAULT_HIGH_WATER_TEMPERATURE_HASS_CONFIG,
+
+    "homeassistant/switch/boilerCHEnabled/config": BOILER_CH_ENABLED_HASS_CONFIG,
+    "homeassistant/sensor/boilerCHFlowTemperature/config": BOILER_CH_FLOW_TEMPERATURE_HASS_CONFIG,
+    BOILER_CH_FLOW_TEMPERATURE_SETPOINT_CONFIG_TOPIC: BOILER_CH_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerCHActive/config": BOILER_CH_ACTIVE_HASS_CONFIG,
+
+    "homeassistant/switch/boilerDHWEnabled/config": BOILER_DHW_ENABLED_HASS_CONFIG,
+    "homeassistant/sensor/boilerDHWFlowTemperature/config": BOILER_DHW_FLOW_TEMPERATURE_HASS_CONFIG,
+    BOILER_DHW_FLOW_TEMPERATURE_SETPOINT_CONFIG_TOPIC: BOILER_DHW_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG,
+    "homeassistant/binary_sensor/boilerDHWActive/config": BOILER_DHW_ACTIVE_HASS_CONFIG,
+}
+for _topic in HASS_CONFIGS:
+    HASS_CONFIGS[_topic] = HASS_CONFIGS[_topic].encode()
+
+
+# BoilerValues field: (state topic, deadband). A number is republished once it moves by its deadband;
+# a boolean (deadband 0) whenever it changes
+STATE_TOPICS = {
+    boiler_state.BOILER_RETURN_TEMPERATURE: ("homeassistant/sensor/boilerReturnTemperature/state", 0.1),
+    boiler_state.BOILER_EXHAUST_TEMPERATURE: ("homeassistant/sensor/boilerExhaustTemperature/state", 1),
+    boiler_state.BOILER_FAN_SPEED: ("homeassistant/sensor/boilerFanSpeed/state", 60),
+    boiler_state.BOILER_MODULATION_LEVEL: ("homeassistant/sensor/boilerModulationLevel/state", 1),
+    boiler_state.BOILER_CH_PRESSURE: ("homeassistant/sensor/boilerChPressure/state", 0.05),
+    boiler_state.BOILER_DHW_FLOW_RATE: ("homeassistant/sensor/boilerDhwFlowRate/state", 0.1),
+    boiler_state.BOILER_MAX_CAPACITY: ("homeassistant/sensor/boilerMaxCapacity/state", 0),
+    boiler_state.BOILER_FLAME_ACTIVE: ("homeassistant/binary_sensor/boilerFlameActive/state", 0),
+    boiler_state.BOILER_FAULT_ACTIVE: ("homeassistant/binary_sensor/boilerFaultActive/state", 0),
+    boiler_state.BOILER_FAULT_LOW_WATER_PRESSURE: ("homeassistant/binary_sensor/boilerFaultLowWaterPressure/state", 0),
+    boiler_state.BOILER_FAULT_FLAME: ("homeassistant/binary_sensor/boilerFaultFlame/state", 0),
+    boiler_state.BOILER_FAULT_LOW_AIR_PRESSURE: ("homeassistant/binary_sensor/boilerFaultLowAirPressure/state", 0),
+    boiler_state.BOILER_FAULT_HIGH_WATER_TEMPERATURE: ("homeassistant/binary_sensor/boilerHighWaterTemperature/state", 0),
+
+    boiler_state.BOILER_FLOW_TEMPERATURE: ("homeassistant/sensor/boilerCHFlowTemperature/state", 0.1),
+    boiler_state.BOILER_CH_ENABLED: ("homeassistant/switch/boilerCHEnabled/state", 0),
+    boiler_state.BOILER_FLOW_TEMPERATURE_SETPOINT: ("homeassistant/number/boilerCHFlowTemperatureSetpoint/state", 0),
+    boiler_state.BOILER_CH_ACTIVE: ("homeassistant/binary_sensor/boilerCHActive/state", 0),
+
+    boiler_state.BOILER_DHW_TEMPERATURE: ("homeassistant/sensor/boilerDHWFlowTemperature/state", 0.1),
+    boiler_state.BOILER_DHW_ENABLED: ("homeassistant/switch/boilerDHWEnabled/state", 0),
+    boiler_state.BOILER_DHW_TEMPERATURE_SETPOINT: ("homeassistant/number/boilerDHWFlowTemperatureSetpoint/state", 0),
+    boiler_state.BOILER_DHW_ACTIVE: ("homeassistant/binary_sensor/boilerDHWActive/state", 0),
+}
+# published as soon as they change: faults, and the settings HA controls (so its switches don't bounce)
+URGENT_FIELDS = ((1 << boiler_state.BOILER_FAULT_ACTIVE) | (1 << boiler_state.BOILER_FAULT_LOW_WATER_PRESSURE) |
+                 (1 << boiler_state.BOILER_FAULT_FLAME) | (1 << boiler_state.BOILER_FAULT_LOW_AIR_PRESSURE) |
+                 (1 << boiler_state.BOILER_FAULT_HIGH_WATER_TEMPERATURE) |
+                 (1 << boiler_state.BOILER_CH_ENABLED) | (1 << boiler_state.BOILER_FLOW_TEMPERATURE_SETPOINT) |
+                 (1 << boiler_state.BOILER_DHW_ENABLED) | (1 << boiler_state.BOILER_DHW_TEMPERATURE_SETPOINT))
+
+state_publisher = StatePublisher(boiler_values, STATE_TOPICS, URGENT_FIELDS, MQTT_STATE_INTERVAL_MS, MQTT_HEARTBEAT_MS)
+
+
+async def boiler_loop(cycle_start: int, last_write_settings_timestamp: int) -> int:
+    global _tset_f88
+    # runs every cycle, so in the steady state it shouldn't allocate: flags are decoded from
+    # bitfields straight into boiler_values, and logging is only done (lazily) on a change
+
     # OT spec 5.3.1: status exchange is mandatory every cycle
-    boiler_status = await opentherm_app.status_exchange(ch_enabled=boiler_values.boiler_ch_enabled,
-                                                        dhw_enabled=boiler_values.boiler_dhw_enabled)
+    status = await opentherm_app.status_flags(boiler_values.boiler_ch_enabled, boiler_values.boiler_dhw_enabled)
     # Check for fault state changes
     prev_fault = boiler_values.boiler_fault_active
-    boiler_values.boiler_flame_active = boiler_status['flame_active']
-    boiler_values.boiler_ch_active = boiler_status['ch_active']
-    boiler_values.boiler_dhw_active = boiler_status['dhw_active']
-    boiler_values.boiler_fault_active = boiler_status['fault']
-
-    if boiler_values.boiler_fault_active and not prev_fault:
-        # Read fault flags to get details about what faulted
-        try:
-            fault_flags = await opentherm_app.read_fault_flags()
-            fault_details = []
-            if fault_flags['low_water_pressure']:
-                fault_details.append("low water pressure")
-            if fault_flags['flame_fault']:
-                fault_details.append("flame fault")
-            if fault_flags['air_pressure_fault']:
-                fault_details.append("low air pressure")
-            if fault_flags['water_over_temp']:
-                fault_details.append("high water temperature")
-            if fault_flags['oem_code']:
-                fault_details.append(f"OEM code {fault_flags['oem_code']}")
-
-            if fault_details:
-                send_syslog(f"FAULT DETECTED: {', '.join(fault_details)}")
-            else:
-                send_syslog("FAULT DETECTED: boiler fault active (no specific flags set)")
-        except Exception as ex:
-            send_syslog(f"FAULT DETECTED: boiler fault active (unable to read fault details: {str(ex)})")
+    boiler_values.boiler_status_flags = status
+    boiler_values.boiler_flame_active = (status & opentherm_app.STATUS_FLAME_ACTIVE) != 0
+    boiler_values.boiler_ch_active = (status & opentherm_app.STATUS_CH_ACTIVE) != 0
+    boiler_values.boiler_dhw_active = (status & opentherm_app.STATUS_DHW_ACTIVE) != 0
+    boiler_values.boiler_fault_active = (status & opentherm_app.STATUS_FAULT) != 0
+    detail_poller.set_flame(boiler_values.boiler_flame_active)
 
     # OT spec 5.2: master MUST send ID 1 (TSet) with WRITE_DATA every cycle
-    await opentherm_app.control_ch_setpoint(boiler_values.boiler_flow_temperature_setpoint)
+    if boiler_values.changes(_loop_changes) & (1 << BOILER_FLOW_TEMPERATURE_SETPOINT):
+        _tset_f88 = opentherm_app.encode(opentherm_app.DATA_ID_TSET, boiler_values.boiler_flow_temperature_setpoint)
+        boiler_values.take(_loop_changes, 1 << BOILER_FLOW_TEMPERATURE_SETPOINT)
+    await opentherm_app.write_raw(opentherm_app.DATA_ID_TSET, _tset_f88)
 
-    # retrieve detailed stats
-    if (time.ticks_ms() - last_get_detail_timestamp) > GET_DETAILED_STATS_MS:
-        boiler_values.boiler_flow_temperature = await opentherm_app.read_boiler_flow_temperature()
-        boiler_values.boiler_return_temperature = await opentherm_app.read_boiler_return_water_temperature()
-        boiler_values.boiler_exhaust_temperature = await opentherm_app.read_exhaust_temperature()
+    mandatory_ms = time.ticks_diff(time.ticks_ms(), cycle_start)
 
-        # Fan speed: ID 35 added in OT v4.2 (not in v2.2). Some older boilers may not support it.
-        # Isolate it so UNKNOWN-DATAID doesn't crash the entire detail poll.
+    if boiler_values.boiler_fault_active and not prev_fault:
+        # Read fault flags to get details about what faulted
         try:
-            boiler_values.boiler_fan_speed = await opentherm_app.read_fan_speed()
-        except (opentherm_app.UnknownDataIdError, opentherm_app.DataInvalidError) as ex:
-            # Boiler doesn't support fan speed reading - leave at last known value
-            send_syslog(f"Fan speed read skipped: {str(ex)}")
-
-        boiler_values.boiler_modulation_level = await opentherm_app.read_relative_modulation_level()
-        boiler_values.boiler_ch_pressure = await opentherm_app.read_ch_water_pressure()
-        boiler_values.boiler_dhw_flow_rate = await opentherm_app.read_dhw_flow_rate()
-        boiler_values.boiler_dhw_temperature = await opentherm_app.read_dhw_temperature()
-
-        fault_flags = await opentherm_app.read_fault_flags()
-
-        # Log specific fault changes
-        if fault_flags['low_water_pressure'] and not boiler_values.boiler_fault_low_water_pressure:
-            send_syslog("FAULT: Low water pressure detected")
-        if fault_flags['flame_fault'] and not boiler_values.boiler_fault_flame:
-            send_syslog("FAULT: Flame fault detected")
-        if fault_flags['air_pressure_fault'] and not boiler_values.boiler_fault_low_air_pressure:
-            send_syslog("FAULT: Low air pressure detected")
-        if fault_flags['water_over_temp'] and not boiler_values.boiler_fault_high_water_temperature:
-            send_syslog("FAULT: High water temperature detected")
-
-        boiler_values.boiler_fault_low_water_pressure = fault_flags['low_water_pressure']
-        boiler_values.boiler_fault_flame = fault_flags['flame_fault']
-        boiler_values.boiler_fault_low_air_pressure = fault_flags['air_pressure_fault']
-        boiler_values.boiler_fault_high_water_temperature = fault_flags['water_over_temp']
-        last_get_detail_timestamp = time.ticks_ms()
-
-        # Check for boiler restart via power cycle counter
-        if boiler_values.last_power_cycles is not None:
-            try:
-                current_power_cycles = await opentherm_app.read_power_cycles()
-                if current_power_cycles != boiler_values.last_power_cycles:
-                    send_syslog(f"BOILER RESTART DETECTED: power cycles {boiler_values.last_power_cycles} -> {current_power_cycles}")
-                    boiler_values.last_power_cycles = current_power_cycles
-                    raise BoilerRestartDetected(f"Power cycles changed: {boiler_values.last_power_cycles} -> {current_power_cycles}")
-            except BoilerRestartDetected:
-                raise  # Re-raise to break out of inner loop
-            except Exception as ex:
-                send_syslog(f"Failed to read power cycles: {str(ex)}")
+            fault_data = await opentherm_app.read(opentherm_app.DATA_ID_ASF_FAULT)
+            update_fault_flags(fault_data)
+            send_syslog("FAULT DETECTED: %s", describe_fault(fault_data))
+        except Exception as ex:
+            send_syslog("FAULT DETECTED: boiler fault active (unable to read fault details: %s)", ex)
 
     # write settings periodically
     if (time.ticks_ms() - last_write_settings_timestamp) > WRITE_SETTINGS_MS:
@@ -322,7 +318,158 @@ async def boiler_loop(last_get_detail_timestamp: int, last_write_settings_timest
             await opentherm_app.control_dhw_setpoint(boiler_values.boiler_dhw_temperature_setpoint)
         last_write_settings_timestamp = time.ticks_ms()
 
-    return last_get_detail_timestamp, last_write_settings_timestamp
+    # keep the line clear for next cycle's status/TSet, so background polling can't push it past 1s.
+    # Only once this cycle's own exchanges are done: the writes above would otherwise step aside for it.
+    opentherm_app.bus.reserve(time.ticks_add(cycle_start, STATUS_LOOP_PERIOD_MS), mandatory_ms)
+
+    return last_write_settings_timestamp
+
+
+# detailed stats polled by boiler_details(): data_id: (min_ms, max_ms, deadband, BoilerValues attribute)
+DETAIL_IDS = {
+    opentherm_app.DATA_ID_TBOILER: (2000, 30000, 0.5, 'boiler_flow_temperature'),
+    opentherm_app.DATA_ID_TRET: (2000, 30000, 0.5, 'boiler_return_temperature'),
+    opentherm_app.DATA_ID_TEXHAUST: (5000, 60000, 1, 'boiler_exhaust_temperature'),
+    opentherm_app.DATA_ID_BOILER_FAN_SPEED: (2000, 60000, 60, 'boiler_fan_speed'),
+    opentherm_app.DATA_ID_REL_MOD_LEVEL: (2000, 30000, 2, 'boiler_modulation_level'),
+    opentherm_app.DATA_ID_CH_PRESSURE: (10000, 120000, 0.05, 'boiler_ch_pressure'),
+    opentherm_app.DATA_ID_DHW_FLOW_RATE: (2000, 60000, 0.2, 'boiler_dhw_flow_rate'),
+    opentherm_app.DATA_ID_TDHW: (2000, 30000, 0.5, 'boiler_dhw_temperature'),
+    opentherm_app.DATA_ID_ASF_FAULT: (10000, 60000, 0, None),
+}
+# power cycle counter for restart detection, polled at a fixed rate
+POWER_CYCLES_POLL_MS = 10 * 1000
+# longest boiler_details() sleeps, so it notices a flame change pulling polls in
+DETAIL_POLL_MAX_SLEEP_MS = 1000
+# how often the per-class retry/give-up counts are sent to syslog
+RETRY_STATS_LOG_MS = 10 * 60 * 1000
+
+detail_poller = PollScheduler()
+
+# data IDs the boiler rejects, remembered across reboots so they aren't re-learnt every time
+capabilities = CapabilityCache()
+
+
+def update_fault_flags(fault_data: int):
+    boiler_values.boiler_fault_flags = fault_data
+    low_water_pressure = (fault_data & opentherm_app.FAULT_LOW_WATER_PRESSURE) != 0
+    flame_fault = (fault_data & opentherm_app.FAULT_FLAME) != 0
+    air_pressure_fault = (fault_data & opentherm_app.FAULT_AIR_PRESSURE) != 0
+    water_over_temp = (fault_data & opentherm_app.FAULT_WATER_OVER_TEMP) != 0
+
+    # Log specific fault changes
+    if low_water_pressure and not boiler_values.boiler_fault_low_water_pressure:
+        send_syslog("FAULT: Low water pressure detected")
+    if flame_fault and not boiler_values.boiler_fault_flame:
+        send_syslog("FAULT: Flame fault detected")
+    if air_pressure_fault and not boiler_values.boiler_fault_low_air_pressure:
+        send_syslog("FAULT: Low air pressure detected")
+    if water_over_temp and not boiler_values.boiler_fault_high_water_temperature:
+        send_syslog("FAULT: High water temperature detected")
+
+    boiler_values.boiler_fault_low_water_pressure = low_water_pressure
+    boiler_values.boiler_fault_flame = flame_fault
+    boiler_values.boiler_fault_low_air_pressure = air_pressure_fault
+    boiler_values.boiler_fault_high_water_temperature = water_over_temp
+
+
+def describe_fault(fault_data: int) -> str:
+    fault_details = []
+    if fault_data & opentherm_app.FAULT_LOW_WATER_PRESSURE:
+        fault_details.append("low water pressure")
+    if fault_data & opentherm_app.FAULT_FLAME:
+        fault_details.append("flame fault")
+    if fault_data & opentherm_app.FAULT_AIR_PRESSURE:
+        fault_details.append("low air pressure")
+    if fault_data & opentherm_app.FAULT_WATER_OVER_TEMP:
+        fault_details.append("high water temperature")
+    if fault_data & 0xff:
+        fault_details.append(f"OEM code {fault_data & 0xff}")
+    if not fault_details:
+        return "boiler fault active (no specific flags set)"
+    return ', '.join(fault_details)
+
+
+# TSet as last sent, f8.8 encoded
+_tset_f88 = 0
+
+
+async def boiler_detail_poll(ids: list):
+    # a flaky ID, or one the boiler doesn't support (e.g. fan speed, ID 35, only added in OT v4.2),
+    # just leaves its value stale rather than losing the whole poll
+    values = await opentherm_app.read_many(ids)
+
+    for data_id, value in values.items():
+        if isinstance(value, Exception):
+            send_syslog("Detail read of data ID %d failed: %s", data_id, value)
+            detail_poller.failed(data_id)
+            continue
+        detail_poller.update(data_id, value)
+
+        if data_id == opentherm_app.DATA_ID_ASF_FAULT:
+            update_fault_flags(value)
+
+        elif data_id == opentherm_app.DATA_ID_POWER_CYCLES:
+            # Check for boiler restart via power cycle counter
+            if value != boiler_values.last_power_cycles:
+                send_syslog(f"BOILER RESTART DETECTED: power cycles {boiler_values.last_power_cycles} -> {value}")
+                boiler_values.last_power_cycles = value
+                raise BoilerRestartDetected(f"Power cycles changed: {boiler_values.last_power_cycles} -> {value}")
+
+        else:
+            setattr(boiler_values, DETAIL_IDS[data_id][3], value)
+
+
+async def boiler_details():
+    # detailed stats are background telemetry: they run alongside the status loop and
+    # only get the bus when the mandatory exchanges don't need it. Each ID is polled as
+    # often as its value is moving (see PollScheduler). Ends on a boiler restart.
+    global detail_poller
+
+    detail_poller = PollScheduler()
+    for data_id, (min_ms, max_ms, deadband, _) in DETAIL_IDS.items():
+        detail_poller.add(data_id, min_ms, max_ms, deadband)
+    if boiler_values.last_power_cycles is not None:
+        detail_poller.add(opentherm_app.DATA_ID_POWER_CYCLES, POWER_CYCLES_POLL_MS, POWER_CYCLES_POLL_MS)
+
+    last_stats_log = time.ticks_ms()
+    while True:
+        if time.ticks_diff(time.ticks_ms(), last_stats_log) >= RETRY_STATS_LOG_MS:
+            send_syslog(f"Retry stats: {opentherm_app.retry_policy.stats()}")
+            last_stats_log = time.ticks_ms()
+
+        try:
+            ids = []
+            for data_id in detail_poller.due():
+                if capabilities.lookup(data_id) == opentherm_app.MSG_TYPE_UNKNOWN_DATA_ID:
+                    # known unsupported: don't spend a conversation on it until it's due a re-probe.
+                    # A cached DATA-INVALID is read as normal: it fails without a conversation and
+                    # backs off like any failed read, so it's picked up again soon after it expires
+                    detail_poller.skip(data_id)
+                else:
+                    ids.append(data_id)
+            if ids:
+                await boiler_detail_poll(ids)
+        except BoilerRestartDetected:
+            raise
+        except Exception as ex:
+            send_syslog("%s", ex)
+            sys.print_exception(ex)
+
+        wait = detail_poller.next_due_ms()
+        if wait < 0 or wait > DETAIL_POLL_MAX_SLEEP_MS:
+            wait = DETAIL_POLL_MAX_SLEEP_MS
+        await asyncio.sleep_ms(wait)
+
+
+def set_hass_config(topic: str, config: str):
+    """Replace a discovery config, re-announcing the configs if that changed it."""
+    global hass_discovery_due
+
+    config = config.encode()
+    if HASS_CONFIGS[topic] != config:
+        HASS_CONFIGS[topic] = config
+        hass_discovery_due = True
 
 
 async def boiler_setup():
@@ -376,14 +523,17 @@ async def boiler_setup():
         BOILER_CH_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG = json.dumps(tmp)
     except Exception as ex:
         send_syslog(f"Failed to read max CH setpoint range: {str(ex)}")
+    # together, so HA gets one re-announcement if either range has changed
+    set_hass_config(BOILER_DHW_FLOW_TEMPERATURE_SETPOINT_CONFIG_TOPIC, BOILER_DHW_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG)
+    set_hass_config(BOILER_CH_FLOW_TEMPERATURE_SETPOINT_CONFIG_TOPIC, BOILER_CH_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG)
 
 
 async def boiler():
     global boiler_values
 
     while True:
+        detail_task = None
         try:
-            last_get_detail_timestamp: int = 0
             last_write_settings_timestamp: int = 0
 
             await boiler_setup()
@@ -396,51 +546,72 @@ async def boiler():
                 boiler_values.last_power_cycles = None
                 send_syslog("Boiler does not support power cycle counter (ID 97)")
 
+            detail_task = asyncio.create_task(boiler_details())
+            cycle_start = time.ticks_ms()
             while True:
                 # errors happen all the damn time, so we just ignore them as per the protocol
                 try:
-                    last_get_detail_timestamp, last_write_settings_timestamp = await boiler_loop(last_get_detail_timestamp, last_write_settings_timestamp)
+                    if detail_task.done():
+                        await detail_task  # raises BoilerRestartDetected
+                    last_write_settings_timestamp = await boiler_loop(cycle_start, last_write_settings_timestamp)
                 except BoilerRestartDetected as ex:
                     send_syslog(f"Breaking out of status loop: {str(ex)}")
                     break  # Exit inner loop, will re-run boiler_setup() at top of outer loop
                 except Exception as ex:
-                    send_syslog(str(ex))
+                    send_syslog("%s", ex)
                     sys.print_exception(ex)
 
-                # sleep and then do it all again
-                await asyncio.sleep_ms(STATUS_LOOP_DELAY_MS)
+                # sleep until the next cycle is due, so time spent on the bus doesn't stretch the period
+                cycle_start = time.ticks_add(cycle_start, STATUS_LOOP_PERIOD_MS)
+                delay = time.ticks_diff(cycle_start, time.ticks_ms())
+                if delay > 0:
+                    await asyncio.sleep_ms(delay)
+                else:
+                    cycle_start = time.ticks_ms()
 
         except Exception as ex:
             send_syslog(f"BOILERFAIL: {str(ex)}")
             sys.print_exception(ex)
             await asyncio.sleep(5)
 
+        finally:
+            if detail_task is not None:
+                detail_task.cancel()
+
 
 def mqtt_callback(topic, msg):
     """MQTT callback handler
 
     Args:
-        topic: String topic (already decoded from UTF-8)
-        msg: Bytes payload
+        topic: memoryview of the UTF-8 topic, in the client's receive buffer
+        msg: memoryview of the payload, likewise
     """
     global boiler_values
-    global mqtt_client_instance
+    global hass_discovery_due
+
+    # only valid during the call; commands are a few bytes, so copy them to compare and log
+    topic = str(topic, 'utf-8')
+    msg = bytes(msg)
 
     send_syslog(f"MQTT CALLBACK: topic={topic[:50]} msg={msg[:30]}")
 
-    if topic == 'homeassistant/switch/boilerCHEnabled/command':
+    if topic == HASS_STATUS_TOPIC:
+        if msg == b'online':
+            send_syslog("MQTT: Home Assistant online, re-announcing")
+            hass_discovery_due = True
+            state_publisher.reset()
+
+    elif topic == 'homeassistant/switch/boilerCHEnabled/command':
         if msg == b'ON':
             send_syslog("MQTT CMD: CH enabled ON")
             boiler_values.boiler_ch_enabled = True
-            # Immediately publish requested state back to avoid bouncing
-            if mqtt_client_instance:
-                asyncio.create_task(mqtt_client_instance.publish_string("homeassistant/switch/boilerCHEnabled/state", 'ON'))
+            # publish the requested state straight back, even if unchanged, to avoid bouncing
+            state_publisher.force(1 << boiler_state.BOILER_CH_ENABLED)
         elif msg == b'OFF':
             send_syslog("MQTT CMD: CH enabled OFF")
             boiler_values.boiler_ch_enabled = False
-            # Immediately publish requested state back to avoid bouncing
-            if mqtt_client_instance:
-                asyncio.create_task(mqtt_client_instance.publish_string("homeassistant/switch/boilerCHEnabled/state", 'OFF'))
+            # publish the requested state straight back, even if unchanged, to avoid bouncing
+            state_publisher.force(1 << boiler_state.BOILER_CH_ENABLED)
 
     elif topic == 'homeassistant/number/boilerCHFlowTemperatureSetpoint/command':
         try:
@@ -449,9 +620,8 @@ def mqtt_callback(topic, msg):
                 v = boiler_values.boiler_flow_temperature_setpoint_rangemax
             send_syslog(f"MQTT CMD: CH setpoint -> {v}")
             boiler_values.boiler_flow_temperature_setpoint = v
-            # Immediately publish requested state back to avoid bouncing
-            if mqtt_client_instance:
-                asyncio.create_task(mqtt_client_instance.publish_string("homeassistant/number/boilerCHFlowTemperatureSetpoint/state", str(round(v, 2))))
+            # publish the requested state straight back, even if unchanged, to avoid bouncing
+            state_publisher.force(1 << boiler_state.BOILER_FLOW_TEMPERATURE_SETPOINT)
         except ValueError:
             send_syslog(f"MQTT CMD: Invalid CH setpoint: {msg}")
 
@@ -459,15 +629,13 @@ def mqtt_callback(topic, msg):
         if msg == b'ON':
             send_syslog("MQTT CMD: DHW enabled ON")
             boiler_values.boiler_dhw_enabled = True
-            # Immediately publish requested state back to avoid bouncing
-            if mqtt_client_instance:
-                asyncio.create_task(mqtt_client_instance.publish_string("homeassistant/switch/boilerDHWEnabled/state", 'ON'))
+            # publish the requested state straight back, even if unchanged, to avoid bouncing
+            state_publisher.force(1 << boiler_state.BOILER_DHW_ENABLED)
         elif msg == b'OFF':
             send_syslog("MQTT CMD: DHW enabled OFF")
             boiler_values.boiler_dhw_enabled = False
-            # Immediately publish requested state back to avoid bouncing
-            if mqtt_client_instance:
-                asyncio.create_task(mqtt_client_instance.publish_string("homeassistant/switch/boilerDHWEnabled/state", 'OFF'))
+            # publish the requested state straight back, even if unchanged, to avoid bouncing
+            state_publisher.force(1 << boiler_state.BOILER_DHW_ENABLED)
 
     elif topic == 'homeassistant/number/boilerDHWFlowTemperatureSetpoint/command':
         try:
@@ -476,69 +644,20 @@ def mqtt_callback(topic, msg):
                 v = boiler_values.boiler_dhw_temperature_setpoint_rangemax
             send_syslog(f"MQTT CMD: DHW setpoint -> {v}")
             boiler_values.boiler_dhw_temperature_setpoint = v
-            # Immediately publish requested state back to avoid bouncing
-            if mqtt_client_instance:
-                asyncio.create_task(mqtt_client_instance.publish_string("homeassistant/number/boilerDHWFlowTemperatureSetpoint/state", str(round(v, 2))))
+            # publish the requested state straight back, even if unchanged, to avoid bouncing
+            state_publisher.force(1 << boiler_state.BOILER_DHW_TEMPERATURE_SETPOINT)
         except ValueError:
             send_syslog(f"MQTT CMD: Invalid DHW setpoint: {msg}")
 
-async def mqtt_publish(mqc):
-    global boiler_values
-
-    # publish all the config jsons
-    await mqc.publish_string("homeassistant/sensor/boilerReturnTemperature/config", BOILER_RETURN_TEMPERATURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerExhaustTemperature/config", BOILER_EXHAUST_TEMPERATURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerFanSpeed/config", BOILER_FAN_SPEED_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerModulationLevel/config", BOILER_MODULATION_LEVEL_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerChPressure/config", BOILER_CH_PRESSURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerDhwFlowRate/config", BOILER_DHW_FLOW_RATE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerMaxCapacity/config", BOILER_MAX_CAPACITY_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFlameActive/config", BOILER_FLAME_ACTIVE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultActive/config", BOILER_FAULT_ACTIVE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultLowWaterPressure/config", BOILER_FAULT_LOW_WATER_PRESSURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultFlame/config", BOILER_FAULT_FLAME_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultLowAirPressure/config", BOILER_FAULT_LOW_AIR_PRESSURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerHighWaterTemperature/config", BOILER_FAULT_HIGH_WATER_TEMPERATURE_HASS_CONFIG)
-
-    await mqc.publish_string("homeassistant/switch/boilerCHEnabled/config", BOILER_CH_ENABLED_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerCHFlowTemperature/config", BOILER_CH_FLOW_TEMPERATURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/number/boilerCHFlowTemperatureSetpoint/config", BOILER_CH_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerCHActive/config", BOILER_CH_ACTIVE_HASS_CONFIG)
-
-    await mqc.publish_string("homeassistant/switch/boilerDHWEnabled/config", BOILER_DHW_ENABLED_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/sensor/boilerDHWFlowTemperature/config", BOILER_DHW_FLOW_TEMPERATURE_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/number/boilerDHWFlowTemperatureSetpoint/config", BOILER_DHW_FLOW_TEMPERATURE_SETPOINT_HASS_CONFIG)
-    await mqc.publish_string("homeassistant/binary_sensor/boilerDHWActive/config", BOILER_DHW_ACTIVE_HASS_CONFIG)
-
-    # publish all the states
-    await mqc.publish_string("homeassistant/sensor/boilerReturnTemperature/state", str(round(boiler_values.boiler_return_temperature, 2)))
-    await mqc.publish_string("homeassistant/sensor/boilerExhaustTemperature/state", str(round(boiler_values.boiler_exhaust_temperature, 2)))
-    await mqc.publish_string("homeassistant/sensor/boilerFanSpeed/state", str(round(boiler_values.boiler_fan_speed, 2)))
-    await mqc.publish_string("homeassistant/sensor/boilerModulationLevel/state", str(round(boiler_values.boiler_modulation_level, 2)))
-    await mqc.publish_string("homeassistant/sensor/boilerChPressure/state", str(round(boiler_values.boiler_ch_pressure, 2)))
-    await mqc.publish_string("homeassistant/sensor/boilerDhwFlowRate/state", str(round(boiler_values.boiler_dhw_flow_rate, 2)))
-    await mqc.publish_string("homeassistant/sensor/boilerMaxCapacity/state", str(boiler_values.boiler_max_capacity))
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFlameActive/state", 'ON' if boiler_values.boiler_flame_active else 'OFF')
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultActive/state", 'ON' if boiler_values.boiler_fault_active else 'OFF')
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultLowWaterPressure/state", 'ON' if boiler_values.boiler_fault_low_water_pressure else 'OFF')
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultFlame/state", 'ON' if boiler_values.boiler_fault_flame else 'OFF')
-    await mqc.publish_string("homeassistant/binary_sensor/boilerFaultLowAirPressure/state", 'ON' if boiler_values.boiler_fault_low_air_pressure else 'OFF')
-    await mqc.publish_string("homeassistant/binary_sensor/boilerHighWaterTemperature/state", 'ON' if boiler_values.boiler_fault_high_water_temperature else 'OFF')
-
-    await mqc.publish_string("homeassistant/sensor/boilerCHFlowTemperature/state", str(round(boiler_values.boiler_flow_temperature, 2)))
-    await mqc.publish_string("homeassistant/switch/boilerCHEnabled/state", 'ON' if boiler_values.boiler_ch_enabled else 'OFF')
-    await mqc.publish_string("homeassistant/number/boilerCHFlowTemperatureSetpoint/state", str(round(boiler_values.boiler_flow_temperature_setpoint, 2)))
-    await mqc.publish_string("homeassistant/binary_sensor/boilerCHActive/state", 'ON' if boiler_values.boiler_ch_active else 'OFF')
-
-    await mqc.publish_string("homeassistant/sensor/boilerDHWFlowTemperature/state", str(round(boiler_values.boiler_dhw_temperature, 2)))
-    await mqc.publish_string("homeassistant/switch/boilerDHWEnabled/state", 'ON' if boiler_values.boiler_dhw_enabled else 'OFF')
-    await mqc.publish_string("homeassistant/number/boilerDHWFlowTemperatureSetpoint/state", str(round(boiler_values.boiler_dhw_temperature_setpoint, 2)))
-    await mqc.publish_string("homeassistant/binary_sensor/boilerDHWActive/state", 'ON' if boiler_values.boiler_dhw_active else 'OFF')
+async def mqtt_publish_config(mqc):
+    # publish all the config jsons, retained so HA picks them up whenever it starts
+    await mqc.publish_many(HASS_CONFIGS.items(), retain=True)
 
 
 async def mqtt():
     global boiler_values
     global mqtt_client_instance
+    global hass_discovery_due
 
     mqc = None
     while True:
@@ -552,14 +671,23 @@ async def mqtt():
             await mqc.subscribe('homeassistant/number/boilerCHFlowTemperatureSetpoint/command')
             await mqc.subscribe('homeassistant/switch/boilerDHWEnabled/command')
             await mqc.subscribe('homeassistant/number/boilerDHWFlowTemperatureSetpoint/command')
+            await mqc.subscribe(HASS_STATUS_TOPIC)
             send_syslog("MQTT connected")
+            hass_discovery_due = True
+            state_publisher.reset()
 
-            last_publish_stamp = time.ticks_ms()
+            last_diagnostics_stamp = time.ticks_ms()
             while True:
-                if time.ticks_ms() - last_publish_stamp >= MQTT_PUBLISH_MS:
-                    print('MQTT PING')
-                    await mqtt_publish(mqc)
-                    last_publish_stamp = time.ticks_ms()
+                if hass_discovery_due:
+                    # cleared first, so a request arriving while these go out isn't lost
+                    hass_discovery_due = False
+                    await mqtt_publish_config(mqc)
+                await state_publisher.publish(mqc)
+                if time.ticks_diff(time.ticks_ms(), last_diagnostics_stamp) >= DIAGNOSTICS_PUBLISH_MS:
+                    diagnostics = opentherm_app.diagnostics()
+                    diagnostics["polls"] = detail_poller.stats()
+                    await mqc.publish_string(DIAGNOSTICS_TOPIC, json.dumps(diagnostics))
+                    last_diagnostics_stamp = time.ticks_ms()
 
                 await asyncio.sleep_ms(10)
                 try:
@@ -582,15 +710,18 @@ async def mqtt():
 
 async def main():
     send_syslog("picotherm starting")
+    capabilities.load()
+    opentherm_app.capabilities = capabilities
+    if capabilities.inspect():
+        send_syslog(f"Known unsupported data IDs: {capabilities.inspect()}")
     what = [
+        syslog.run(),
         boiler(),
         mqtt()
     ]
     await asyncio.gather(*what)
 
 
-time.sleep(5)
-
 def do_connect():
     rp2.country('GB')
 
@@ -604,8 +735,13 @@ def do_connect():
             utime.sleep(1)
     print('Connected! Network config:', sta_if.ifconfig())
 
-print("Connecting to your wifi...")
-do_connect()
 
-time.sleep(5)
-asyncio.run(main())
+# MicroPython runs main.py as __main__; importing it (e.g. from sim.host) doesn't start anything
+if __name__ == "__main__":
+    time.sleep(5)
+
+    print("Connecting to your wifi...")
+    do_connect()
+
+    time.sleep(5)
+    asyncio.run(main())
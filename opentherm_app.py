@@ -1,14 +1,20 @@
 import asyncio
-from lib import s8, s16, f88, send_syslog
+from lib import s8, s16, f88, send_syslog, ticks_ms, ticks_diff
+from opentherm_bus import OpenThermBus, PRIORITY_MANDATORY, PRIORITY_COMMAND, PRIORITY_BACKGROUND
+from opentherm_retry import RetryPolicy, FAIL_PROTOCOL, DEFAULT_DEADLINE_MS
+from opentherm_stats import ExchangeStats, BUCKETS_MS
 
 try:
-    from opentherm_rp2 import opentherm_exchange
+    from opentherm_rp2 import opentherm_exchange, timing as exchange_timing, TIMING_TX, TIMING_LATENCY
 
 except ImportError:
     # dummy implementation so it loads on non-pico for unit tests
     async def opentherm_exchange(msg_type: int, data_id: int, data_value: int, timeout_ms: int = 1000) -> tuple[int, int, int]:
         raise NotImplementedError("await opentherm_exchange not implemented on this platform")  # pragma: nocover
 
+    # no per-phase timings from anything but the PIO implementation
+    exchange_timing = None
+
 
 MSG_TYPE_READ_DATA = 0
 MSG_TYPE_WRITE_DATA = 1
@@ -83,6 +89,122 @@ DATA_ID_SECONDARY_VERSION = 127
 REMOTE_COMAND_BLOR = 1  # boiler lock out reset command
 REMOTE_COMAND_CHWF = 2  # CH water filling command
 
+# which way a data ID may be exchanged
+DIR_R = 1
+DIR_W = 2
+DIR_RW = DIR_R | DIR_W
+
+# how a data value is converted to/from python (OT spec 4.2.1 data types)
+CODEC_RAW = 0  # u16 / flag8+flag8 as-is
+CODEC_F88 = 1  # f8.8 signed fixed point
+CODEC_S16 = 2
+CODEC_HB = 3  # u8 in the high byte
+CODEC_LB = 4  # u8 in the low byte
+CODEC_U8_U8 = 5  # (high byte, low byte)
+CODEC_S8_S8 = 6  # (low byte, high byte) as s8 - i.e. (min, max) for the bounds IDs
+CODEC_FAN_HZ = 7  # low byte in Hz, as RPM
+
+# data_id: (direction, codec, min, max, name)
+# min/max bound the values write() accepts (None = unchecked); name is used in error messages
+DATA_IDS = {
+    DATA_ID_STATUS: (DIR_R, CODEC_RAW, None, None, "status"),
+    DATA_ID_TSET: (DIR_RW, CODEC_F88, 0, 100, "CH setpoint"),
+    DATA_ID_PRIMARY_CONFIG: (DIR_W, CODEC_LB, None, None, "master configuration"),
+    DATA_ID_SECONDARY_CONFIG: (DIR_R, CODEC_RAW, None, None, "slave configuration"),
+    DATA_ID_COMMAND: (DIR_W, CODEC_U8_U8, None, None, "remote command"),
+    DATA_ID_ASF_FAULT: (DIR_R, CODEC_RAW, None, None, "fault flags"),
+    DATA_ID_RBP_FLAGS: (DIR_R, CODEC_RAW, None, None, "remote parameter flags"),
+    DATA_ID_COOLING_CONTROL: (DIR_W, CODEC_F88, 0, 100, "cooling signal"),
+    DATA_ID_TSETCH2: (DIR_W, CODEC_F88, 0, 100, "CH2 setpoint"),
+    DATA_ID_TROVERRIDE: (DIR_R, CODEC_F88, None, None, "remote override room setpoint"),
+    DATA_ID_TSP_COUNT: (DIR_R, CODEC_HB, None, None, "TSP count"),
+    DATA_ID_TSP_DATA: (DIR_R, CODEC_U8_U8, None, None, "TSP"),
+    DATA_ID_FHB_COUNT: (DIR_R, CODEC_HB, None, None, "FHB count"),
+    DATA_ID_FHB_DATA: (DIR_R, CODEC_U8_U8, None, None, "FHB"),
+    DATA_ID_MAX_REL_MODULATION: (DIR_RW, CODEC_F88, None, None, "max relative modulation level"),
+    DATA_ID_MAX_CAPACITY_MIN_MODULATION: (DIR_R, CODEC_U8_U8, None, None, "capacity and min modulation"),
+    DATA_ID_TRSET: (DIR_RW, CODEC_F88, -40, 127, "room setpoint"),
+    DATA_ID_REL_MOD_LEVEL: (DIR_R, CODEC_F88, None, None, "relative modulation level"),
+    DATA_ID_CH_PRESSURE: (DIR_R, CODEC_F88, None, None, "CH water pressure"),
+    DATA_ID_DHW_FLOW_RATE: (DIR_R, CODEC_F88, None, None, "DHW flow rate"),
+    DATA_ID_TRSETCH2: (DIR_W, CODEC_F88, -40, 127, "room setpoint CH2"),
+    DATA_ID_TR: (DIR_RW, CODEC_F88, -40, 127, "room temperature"),
+    DATA_ID_TBOILER: (DIR_R, CODEC_F88, None, None, "boiler flow temperature"),
+    DATA_ID_TDHW: (DIR_R, CODEC_F88, None, None, "DHW temperature"),
+    DATA_ID_TOUTSIDE: (DIR_R, CODEC_F88, None, None, "outside temperature"),
+    DATA_ID_TRET: (DIR_R, CODEC_F88, None, None, "return water temperature"),
+    DATA_ID_TFLOWCH2: (DIR_R, CODEC_F88, None, None, "boiler flow temperature CH2"),
+    DATA_ID_TDHW2: (DIR_R, CODEC_F88, None, None, "DHW2 temperature"),
+    DATA_ID_TEXHAUST: (DIR_R, CODEC_S16, None, None, "exhaust temperature"),
+    DATA_ID_BOILER_FAN_SPEED: (DIR_R, CODEC_FAN_HZ, None, None, "fan speed"),
+    DATA_ID_TDHWSET_BOUNDS: (DIR_R, CODEC_S8_S8, None, None, "DHW setpoint range"),
+    DATA_ID_MAXTSET_BOUNDS: (DIR_R, CODEC_S8_S8, None, None, "max CH setpoint range"),
+    DATA_ID_TDHWSET: (DIR_RW, CODEC_F88, 0, 100, "DHW setpoint"),
+    DATA_ID_MAXTSET: (DIR_RW, CODEC_F88, 0, 100, "max CH setpoint"),
+    DATA_ID_REMOTE_OVERRIDE_FUNCTION: (DIR_R, CODEC_RAW, None, None, "remote override function"),
+    DATA_ID_OEM_DIAGNOSTIC_CODE: (DIR_R, CODEC_RAW, None, None, "OEM diagnostic code"),
+    DATA_ID_POWER_CYCLES: (DIR_R, CODEC_RAW, None, None, "power cycles"),
+    DATA_ID_BURNER_STARTS: (DIR_R, CODEC_RAW, None, None, "burner starts"),
+    DATA_ID_CH_PUMP_STARTS: (DIR_R, CODEC_RAW, None, None, "CH pump starts"),
+    DATA_ID_DHW_PUMP_STARTS: (DIR_R, CODEC_RAW, None, None, "DHW pump starts"),
+    DATA_ID_DHW_BURNER_STARTS: (DIR_R, CODEC_RAW, None, None, "DHW burner starts"),
+    DATA_ID_BURNER_OPERATION_HOURS: (DIR_R, CODEC_RAW, None, None, "burner operation hours"),
+    DATA_ID_CH_PUMP_OPERATION_HOURS: (DIR_R, CODEC_RAW, None, None, "CH pump operation hours"),
+    DATA_ID_DHW_PUMP_OPERATION_HOURS: (DIR_R, CODEC_RAW, None, None, "DHW pump operation hours"),
+    DATA_ID_DHW_BURNER_OPERATION_HOURS: (DIR_R, CODEC_RAW, None, None, "DHW burner operation hours"),
+    DATA_ID_OPENTHERM_VERSION_PRIMARY: (DIR_W, CODEC_F88, None, None, "master OpenTherm version"),
+    DATA_ID_OPENTHERM_VERSION_SECONDARY: (DIR_R, CODEC_F88, None, None, "slave OpenTherm version"),
+    DATA_ID_PRIMARY_VERSION: (DIR_W, CODEC_U8_U8, None, None, "master product version"),
+    DATA_ID_SECONDARY_VERSION: (DIR_R, CODEC_U8_U8, None, None, "slave product version"),
+}
+
+# master status flags (high byte of the ID 0 request)
+MASTER_CH_ENABLE = 0x0100
+MASTER_DHW_ENABLE = 0x0200
+MASTER_COOLING_ENABLE = 0x0400
+MASTER_OTC_ACTIVE = 0x0800
+MASTER_CH2_ENABLE = 0x1000
+
+# slave status flags (low byte of the ID 0 response), as returned by status_flags()
+STATUS_FAULT = 0x01
+STATUS_CH_ACTIVE = 0x02
+STATUS_DHW_ACTIVE = 0x04
+STATUS_FLAME_ACTIVE = 0x08
+STATUS_COOLING_ACTIVE = 0x10
+STATUS_CH2_ACTIVE = 0x20
+STATUS_DIAGNOSTIC_EVENT = 0x40
+
+# ASF flags (high byte of ID 5); the low byte is the OEM fault code
+FAULT_SERVICE_REQUIRED = 0x0100
+FAULT_BLOR_ENABLED = 0x0200
+FAULT_LOW_WATER_PRESSURE = 0x0400
+FAULT_FLAME = 0x0800
+FAULT_AIR_PRESSURE = 0x1000
+FAULT_WATER_OVER_TEMP = 0x2000
+
+# flag bits decoded by decode_flags(): (key, mask)
+STATUS_FLAGS = (
+    ("fault", STATUS_FAULT),
+    ("ch_active", STATUS_CH_ACTIVE),
+    ("dhw_active", STATUS_DHW_ACTIVE),
+    ("flame_active", STATUS_FLAME_ACTIVE),
+    ("cooling_active", STATUS_COOLING_ACTIVE),
+    ("ch2_active", STATUS_CH2_ACTIVE),
+    ("diagnostic_event", STATUS_DIAGNOSTIC_EVENT),
+)
+FAULT_FLAGS = (
+    ("service_required", FAULT_SERVICE_REQUIRED),
+    ("blor_enabled", FAULT_BLOR_ENABLED),
+    ("low_water_pressure", FAULT_LOW_WATER_PRESSURE),
+    ("flame_fault", FAULT_FLAME),
+    ("air_pressure_fault", FAULT_AIR_PRESSURE),
+    ("water_over_temp", FAULT_WATER_OVER_TEMP),
+)
+REMOTE_OVERRIDE_FLAGS = (
+    ("manual_change_priority", 0x01),
+    ("program_change_priority", 0x02),
+)
+
 
 # Custom exceptions for OpenTherm protocol responses
 class DataInvalidError(Exception):
@@ -97,29 +219,131 @@ class UnknownDataIdError(Exception):
     pass
 
 
-async def opentherm_exchange_retry(msg_type: int, data_id: int, data_value: int, timeout_ms: int = 1000, max_retries: int = 10):
+async def _exchange(msg_type: int, data_id: int, data_value: int, timeout_ms: int) -> tuple[int, int, int]:
+    # looked up at call time so the exchange implementation can be swapped out
+    start = ticks_ms()
+    try:
+        response = await opentherm_exchange(msg_type, data_id, data_value, timeout_ms)
+    except Exception as ex:
+        exchange_stats.failed(data_id, retry_policy.classify(ex))
+        raise
+    total_ms = ticks_diff(ticks_ms(), start)
+    if exchange_timing is not None:
+        exchange_stats.record(data_id, exchange_timing[TIMING_TX], exchange_timing[TIMING_LATENCY], total_ms)
+    else:
+        exchange_stats.record(data_id, -1, -1, total_ms)
+    return response
+
+
+# every conversation goes through here so the inter-message gap is honoured
+bus = OpenThermBus(_exchange)
+
+# decides which failed exchanges are retried, and keeps per-class retry stats
+retry_policy = RetryPolicy()
+
+# per data ID timing histograms and error counts, for diagnostics()
+exchange_stats = ExchangeStats()
+
+# optional opentherm_caps.CapabilityCache: read()/write() skip data IDs it knows the boiler rejects
+capabilities = None
+
+# status and TSet must go out every cycle whatever the boiler made of them last time (OT spec 5.2)
+_UNCACHED_IDS = (DATA_ID_STATUS, DATA_ID_TSET)
+
+
+def _default_priority(msg_type: int, data_id: int) -> int:
+    # OT spec 5.2: status (ID 0) and TSet (ID 1) must be exchanged every second
+    if data_id == DATA_ID_STATUS or data_id == DATA_ID_TSET:
+        return PRIORITY_MANDATORY
+    if msg_type == MSG_TYPE_WRITE_DATA:
+        return PRIORITY_COMMAND
+    return PRIORITY_BACKGROUND
+
+
+async def opentherm_exchange_retry(msg_type: int, data_id: int, data_value: int, timeout_ms: int = 1000, max_retries: int = 10,
+                                   priority: int = None, deadline_ms: int = None):
     """Attempt an OpenTherm exchange with retry logic.
 
     OT spec 4.3.1: master must wait 100ms minimum between conversations.
-    The inter-message delay is applied after each exchange completes.
+    The bus enforces that gap before each exchange starts, so the caller
+    gets its result as soon as the conversation completes.
+
+    Each attempt is queued on the bus separately, so more urgent requests can
+    go in between retries. If priority isn't given, status/TSet are mandatory,
+    other writes are commands and reads are background telemetry.
+
+    Failures are retried as retry_policy allows for their class, up to
+    max_retries in all, as long as the retry - going by how long the last
+    attempt took - would finish within deadline_ms of the call starting (by
+    default DEFAULT_DEADLINE_MS for the priority). Less urgent requests also
+    give up rather than retry into the bus's reserved mandatory slot. A
+    response that doesn't match the request is retried as a protocol failure;
+    if that persists, the last one is returned for the caller to reject.
     """
+    if priority is None:
+        priority = _default_priority(msg_type, data_id)
+    if deadline_ms is None:
+        deadline_ms = DEFAULT_DEADLINE_MS[priority]
+    policy = retry_policy
+
+    start = ticks_ms()
+    class_retries = None  # retries so far per failure class, allocated on the first failure
     retry_count = 0
     while True:
+        attempt_start = ticks_ms()
+        error = None
         try:
-            result = await opentherm_exchange(msg_type, data_id, data_value, timeout_ms)
-            # OT spec 4.3.1: 100ms minimum gap after conversation ends
-            await asyncio.sleep_ms(100)
-            return result
+            response = await bus.exchange(msg_type, data_id, data_value, timeout_ms, priority)
+            r_msg_type, r_data_id, _ = response
+            if r_data_id == data_id and (r_msg_type == msg_type + 4 or r_msg_type == MSG_TYPE_DATA_INVALID
+                                         or r_msg_type == MSG_TYPE_UNKNOWN_DATA_ID):
+                return response
+            # the conversation completed, so _exchange() only timed it: count the mismatch here
+            failure = FAIL_PROTOCOL
+            exchange_stats.failed(data_id, failure)
         except (DataInvalidError, UnknownDataIdError):
             # Valid protocol responses per OT spec 4.4.1/4.4.2 - do not retry
-            await asyncio.sleep_ms(100)
             raise
-        except Exception:
-            # OT spec 4.3.1: 100ms gap even after failed conversation
-            await asyncio.sleep_ms(100)
-            if retry_count >= max_retries:
-                raise
-            retry_count += 1
+        except Exception as ex:
+            error = ex
+            failure = policy.classify(ex)
+
+        if class_retries is None:
+            class_retries = bytearray(len(policy.budgets))
+        delay = -1
+        if retry_count < max_retries:
+            delay = policy.delay_ms(failure, class_retries[failure])
+        if delay >= 0:
+            now = ticks_ms()
+            remaining = deadline_ms - ticks_diff(now, start)
+            if priority != PRIORITY_MANDATORY:
+                reserved_in = bus.reserved_in_ms()
+                if reserved_in >= 0:
+                    remaining = min(remaining, reserved_in)
+            if delay + ticks_diff(now, attempt_start) > remaining:
+                delay = -1
+
+        if delay < 0:
+            policy.gave_up(failure)
+            if error is None:
+                return response
+            raise error
+
+        policy.retried(failure)
+        exchange_stats.retried(data_id)
+        class_retries[failure] += 1
+        retry_count += 1
+        if delay:
+            await asyncio.sleep_ms(delay)
+
+
+def diagnostics() -> dict:
+    """Exchange timing histograms and error counts per data ID, and retry stats per failure class.
+
+    Histograms are bucket counts, with bucket upper bounds (ms) in "buckets_ms"
+    and a last bucket for anything over.
+    """
+    return dict(buckets_ms=BUCKETS_MS, ids=exchange_stats.snapshot(), retries=retry_policy.stats())
 
 
 def _check_response_type(r_msg_type: int, expected_type: int, r_data_id: int, expected_data_id: int):
@@ -150,251 +374,204 @@ def _check_response_type(r_msg_type: int, expected_type: int, r_data_id: int, ex
         raise ValueError(msg)
 
 
-async def status_exchange(
-    ch_enabled=False,
-    dhw_enabled=False,
-    cooling_enabled=False,
-    otc_enabled=False,
-    ch2_enabled=False,
-) -> dict:
-    data = 0
-    data |= 0x0100 if ch_enabled else 0
-    data |= 0x0200 if dhw_enabled else 0
-    data |= 0x0400 if cooling_enabled else 0
-    data |= 0x0800 if otc_enabled else 0
-    data |= 0x1000 if ch2_enabled else 0
-
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_STATUS, data
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_STATUS)
-
-    result = dict(
-        fault=True if r_data & 0x01 else False,
-        ch_active=True if r_data & 0x02 else False,
-        dhw_active=True if r_data & 0x04 else False,
-        flame_active=True if r_data & 0x08 else False,
-        cooling_active=True if r_data & 0x10 else False,
-        ch2_active=True if r_data & 0x20 else False,
-        diagnostic_event=True if r_data & 0x40 else False,
-    )
+def decode_flags(flags: tuple, data: int) -> dict:
+    """Decode the bits in data into a dict of booleans, using a table of (key, mask)."""
+    result = {}
+    for key, mask in flags:
+        result[key] = True if data & mask else False
     return result
 
 
-async def send_primary_configuration(memberid_code: int):
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_PRIMARY_CONFIG, memberid_code & 0xFF
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_PRIMARY_CONFIG)
-
-
-async def send_primary_opentherm_version(version: float):
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_OPENTHERM_VERSION_PRIMARY, int(version * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_OPENTHERM_VERSION_PRIMARY)
-
-
-async def send_primary_product_version(type: int, version: int):
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_PRIMARY_VERSION, ((type & 0xff) << 8) | (version & 0xff)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_PRIMARY_VERSION)
-
-
-async def read_secondary_configuration() -> dict:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_SECONDARY_CONFIG, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_SECONDARY_CONFIG)
-
-    result = dict(
-        dhw_present=True if r_data & 0x0100 else False,
-        control_type="onoff" if r_data & 0x0200 else "modulating",
-        cooling_config=True if r_data & 0x0400 else False,
-        dhw_config="storage" if r_data & 0x0800 else "instantaneous",
-        low_off_and_pump_control=True if not (r_data & 0x1000) else False,
-        ch2_supported=True if r_data & 0x2000 else False,
-        memberid_code=r_data & 0xFF,
-    )
-    return result
-
-
-async def read_secondary_opentherm_version() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_OPENTHERM_VERSION_SECONDARY, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_OPENTHERM_VERSION_SECONDARY)
-    return f88(r_data)
-
-
-async def read_secondary_product_version() -> tuple[int, int]:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_SECONDARY_VERSION, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_SECONDARY_VERSION)
-    return r_data >> 8, r_data & 0xff
-
-
-async def control_ch_setpoint(setpoint: float):
-    if not (setpoint >= 0 and setpoint <= 100):
-        msg = f"Invalid CH setpoint {setpoint}, must be 0-100"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
-
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_TSET, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_TSET)
-
-
-async def read_ch_setpoint() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TSET, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TSET)
-    return f88(r_data)
-
-
-async def control_ch2_setpoint(setpoint: float):
-    if not (setpoint >= 0 and setpoint <= 100):
-        msg = f"Invalid CH2 setpoint {setpoint}, must be 0-100"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
-
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_TSETCH2, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_TSETCH2)
+def _lookup(data_id: int, direction: int) -> tuple:
+    entry = DATA_IDS.get(data_id)
+    if entry is None:
+        raise ValueError(f"Unknown data ID {data_id}")
+    if not (entry[0] & direction):
+        raise ValueError(f"Data ID {data_id} ({entry[4]}) is not {'readable' if direction == DIR_R else 'writable'}")
+    return entry
+
+
+def _decode(codec: int, data: int):
+    if codec == CODEC_F88:
+        return f88(data)
+    if codec == CODEC_RAW:
+        return data
+    if codec == CODEC_S16:
+        return s16(data)
+    if codec == CODEC_HB:
+        return data >> 8
+    if codec == CODEC_LB:
+        return data & 0xff
+    if codec == CODEC_U8_U8:
+        return data >> 8, data & 0xff
+    if codec == CODEC_S8_S8:
+        return s8(data & 0xff), s8(data >> 8)
+    if codec == CODEC_FAN_HZ:
+        return (data & 0xff) * 60
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def _encode(codec: int, value) -> int:
+    if codec == CODEC_F88:
+        return int(value * 256)
+    if codec == CODEC_RAW or codec == CODEC_S16:
+        return int(value)
+    if codec == CODEC_HB:
+        return (value & 0xff) << 8
+    if codec == CODEC_LB:
+        return value & 0xff
+    if codec == CODEC_U8_U8:
+        return ((value[0] & 0xff) << 8) | (value[1] & 0xff)
+    if codec == CODEC_S8_S8:
+        return ((value[1] & 0xff) << 8) | (value[0] & 0xff)
+    if codec == CODEC_FAN_HZ:
+        return (value // 60) & 0xff
+    raise ValueError(f"Unknown codec {codec}")
+
+
+async def _request(msg_type: int, expected_type: int, data_id: int, data_value: int) -> int:
+    # one checked exchange, skipping data IDs the capability cache knows the boiler rejects
+    caps = capabilities
+    if caps is not None and data_id not in _UNCACHED_IDS:
+        rejected = caps.lookup(data_id)
+        if rejected == MSG_TYPE_UNKNOWN_DATA_ID:
+            raise UnknownDataIdError(f"Boiler does not support data ID {data_id} (cached)")
+        elif rejected == MSG_TYPE_DATA_INVALID:
+            raise DataInvalidError(f"Boiler returned DATA-INVALID for data ID {data_id} (cached)")
+
+    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
+        msg_type, data_id, data_value
+    )
+    try:
+        _check_response_type(r_msg_type, expected_type, r_data_id, data_id)
+    except (DataInvalidError, UnknownDataIdError):
+        # DATA-INVALID in reply to a write is about the value written, not the data ID
+        if caps is not None and data_id not in _UNCACHED_IDS and (msg_type == MSG_TYPE_READ_DATA or r_msg_type == MSG_TYPE_UNKNOWN_DATA_ID):
+            caps.record(data_id, r_msg_type)
+        raise
+
+    if caps is not None:
+        caps.supported(data_id)
+    return r_data
 
 
-async def read_dhw_setpoint_range() -> tuple[int, int]:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TDHWSET_BOUNDS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TDHWSET_BOUNDS)
+async def read(data_id: int, data_value: int = 0):
+    """Read a data ID from the boiler, decoded according to its entry in DATA_IDS.
 
-    return s8(r_data & 0xFF), s8(r_data >> 8)
+    Args:
+        data_id: Data ID to read
+        data_value: Value sent with the READ_DATA request (e.g. the master status flags, or an index)
+    """
+    entry = _lookup(data_id, DIR_R)
+    r_data = await _request(MSG_TYPE_READ_DATA, MSG_TYPE_READ_ACK, data_id, data_value)
+    return _decode(entry[1], r_data)
 
 
-async def control_dhw_setpoint(setpoint: float):
-    if not (setpoint >= 0 and setpoint <= 100):
-        msg = f"Invalid DHW setpoint {setpoint}, must be 0-100"
+def encode(data_id: int, value) -> int:
+    """Range-check and encode a value for writing to a data ID, according to its entry in DATA_IDS."""
+    direction, codec, minimum, maximum, name = _lookup(data_id, DIR_W)
+    if minimum is not None and not (value >= minimum and value <= maximum):
+        msg = f"Invalid {name} {value}, must be {minimum} to {maximum}"
         send_syslog(f"ERROR: {msg}")
         raise ValueError(msg)
-
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_TDHWSET, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_TDHWSET)
-
-
-async def read_dhw_setpoint() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TDHWSET, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TDHWSET)
-    return f88(r_data)
+    return _encode(codec, value)
 
 
-async def control_room_setpoint(setpoint: float):
-    if not (setpoint >= -40 and setpoint <= 127):
-        msg = f"Invalid room setpoint {setpoint}, must be -40 to 127"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
-
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_TRSET, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_TRSET)
+async def write(data_id: int, value):
+    """Write a value to a data ID, range-checked and encoded according to its entry in DATA_IDS.
 
+    Returns the value the boiler acknowledged, decoded the same way.
+    """
+    codec = _lookup(data_id, DIR_W)[1]
+    r_data = await _request(MSG_TYPE_WRITE_DATA, MSG_TYPE_WRITE_ACK, data_id, encode(data_id, value))
+    return _decode(codec, r_data)
 
-async def read_room_setpoint() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TRSET, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TRSET)
-    return f88(r_data)
 
+async def write_raw(data_id: int, data_value: int) -> int:
+    """Write an already encoded (see encode()) data value, returning the raw value the boiler acknowledged.
 
-async def control_room_setpoint_ch2(setpoint: float):
-    if not (setpoint >= -40 and setpoint <= 127):
-        msg = f"Invalid room setpoint CH2 {setpoint}, must be -40 to 127"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
+    For the per-cycle writes: on MicroPython a float is a heap object, so
+    write()'s conversions would allocate every time.
+    """
+    _lookup(data_id, DIR_W)
+    return await _request(MSG_TYPE_WRITE_DATA, MSG_TYPE_WRITE_ACK, data_id, data_value)
 
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_TRSETCH2, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_TRSETCH2)
 
+async def read_many(ids) -> dict:
+    """Read a batch of data IDs, back to back at the rate the bus allows.
 
-async def control_room_temperature(setpoint: float):
-    if not (setpoint >= -40 and setpoint <= 127):
-        msg = f"Invalid room temperature {setpoint}, must be -40 to 127"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
-
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_TR, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_TR)
+    A failing ID doesn't stop the batch: it maps to the exception it raised
+    instead of a value, so callers keep whatever was read successfully.
 
+    Returns:
+        dict of data_id: decoded value, or the Exception for IDs that failed
+    """
+    result = {}
+    for data_id in ids:
+        try:
+            result[data_id] = await read(data_id)
+        except Exception as ex:
+            result[data_id] = ex
+    return result
 
-async def read_room_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TR, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TR)
-    return f88(r_data)
 
+def _reader(data_id: int):
+    async def reader():
+        return await read(data_id)
+    return reader
 
-async def control_cooling(signal: float):
-    if not (signal >= 0 and signal <= 100):
-        msg = f"Invalid cooling signal {signal}, must be 0-100"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
 
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_COOLING_CONTROL, int(signal * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_COOLING_CONTROL)
+def _writer(data_id: int):
+    async def writer(value):
+        return await write(data_id, value)
+    return writer
 
 
-async def read_maxch_setpoint_range() -> tuple[int, int]:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_MAXTSET_BOUNDS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_MAXTSET_BOUNDS)
+async def status_exchange(
+    ch_enabled=False,
+    dhw_enabled=False,
+    cooling_enabled=False,
+    otc_enabled=False,
+    ch2_enabled=False,
+) -> dict:
+    return decode_flags(STATUS_FLAGS, await status_flags(ch_enabled, dhw_enabled, cooling_enabled, otc_enabled, ch2_enabled))
 
-    return s8(r_data & 0xFF), s8(r_data >> 8)
 
+async def status_flags(
+    ch_enabled=False,
+    dhw_enabled=False,
+    cooling_enabled=False,
+    otc_enabled=False,
+    ch2_enabled=False,
+) -> int:
+    """The status exchange, returning the slave status flags as a bitfield of STATUS_* masks rather than a dict."""
+    data = 0
+    data |= MASTER_CH_ENABLE if ch_enabled else 0
+    data |= MASTER_DHW_ENABLE if dhw_enabled else 0
+    data |= MASTER_COOLING_ENABLE if cooling_enabled else 0
+    data |= MASTER_OTC_ACTIVE if otc_enabled else 0
+    data |= MASTER_CH2_ENABLE if ch2_enabled else 0
 
-async def control_maxch_setpoint(setpoint: float):
-    if not (setpoint >= 0 and setpoint <= 100):
-        msg = f"Invalid max CH setpoint {setpoint}, must be 0-100"
-        send_syslog(f"ERROR: {msg}")
-        raise ValueError(msg)
+    return await read(DATA_ID_STATUS, data) & 0xff
 
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_MAXTSET, int(setpoint * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_MAXTSET)
 
+async def read_secondary_configuration() -> dict:
+    r_data = await read(DATA_ID_SECONDARY_CONFIG)
 
-async def read_maxch_setpoint() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_MAXTSET, 0
+    result = dict(
+        dhw_present=True if r_data & 0x0100 else False,
+        control_type="onoff" if r_data & 0x0200 else "modulating",
+        cooling_config=True if r_data & 0x0400 else False,
+        dhw_config="storage" if r_data & 0x0800 else "instantaneous",
+        low_off_and_pump_control=True if not (r_data & 0x1000) else False,
+        ch2_supported=True if r_data & 0x2000 else False,
+        memberid_code=r_data & 0xFF,
     )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_MAXTSET)
-    return f88(r_data)
+    return result
 
 
 async def read_extra_boiler_params_support() -> dict:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_RBP_FLAGS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_RBP_FLAGS)
+    r_data = await read(DATA_ID_RBP_FLAGS)
 
     dhw_setpoint = None
     if r_data & 0x0100:
@@ -414,282 +591,101 @@ async def read_extra_boiler_params_support() -> dict:
     return result
 
 
-async def read_fault_flags() -> dict:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_ASF_FAULT, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_ASF_FAULT)
-
-    result = dict(
-        service_required=True if r_data & 0x0100 else False,
-        blor_enabled=True if r_data & 0x0200 else False,
-        low_water_pressure=True if r_data & 0x0400 else False,
-        flame_fault=True if r_data & 0x0800 else False,
-        air_pressure_fault=True if r_data & 0x1000 else False,
-        water_over_temp=True if r_data & 0x2000 else False,
-        oem_code=r_data & 0xFF,
-    )
+def decode_fault_flags(data: int) -> dict:
+    result = decode_flags(FAULT_FLAGS, data)
+    result['oem_code'] = data & 0xFF
     return result
 
 
-async def read_oem_long_code() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_OEM_DIAGNOSTIC_CODE, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_OEM_DIAGNOSTIC_CODE)
-    return r_data
-
-
-async def read_relative_modulation_level() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_REL_MOD_LEVEL, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_REL_MOD_LEVEL)
-    return f88(r_data)
-
-
-async def read_ch_water_pressure() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_CH_PRESSURE, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_CH_PRESSURE)
-    return f88(r_data)
-
-
-async def read_dhw_flow_rate() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_DHW_FLOW_RATE, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_DHW_FLOW_RATE)
-    return f88(r_data)
-
-
-async def read_boiler_flow_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TBOILER, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TBOILER)
-    return f88(r_data)
-
-
-async def read_boiler_flow_temperature_ch2() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TFLOWCH2, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TFLOWCH2)
-    return f88(r_data)
-
-
-async def read_dhw_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TDHW, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TDHW)
-    return f88(r_data)
-
-
-async def read_dhw2_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TDHW2, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TDHW2)
-    return f88(r_data)
-
-
-async def read_exhaust_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TEXHAUST, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TEXHAUST)
-    return s16(r_data)
-
-
-async def read_fan_speed() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_BOILER_FAN_SPEED, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_BOILER_FAN_SPEED)
-    return (r_data & 0xff) * 60
-
-
-async def read_outside_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TOUTSIDE, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TOUTSIDE)
-    return f88(r_data)
-
-
-async def read_boiler_return_water_temperature() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TRET, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TRET)
-    return f88(r_data)
-
-
-async def read_power_cycles() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_POWER_CYCLES, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_POWER_CYCLES)
-    return r_data
-
-
-async def read_burner_starts() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_BURNER_STARTS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_BURNER_STARTS)
-    return r_data
-
-
-async def read_ch_pump_starts() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_CH_PUMP_STARTS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_CH_PUMP_STARTS)
-    return r_data
-
-
-async def read_dhw_pump_starts() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_DHW_PUMP_STARTS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_DHW_PUMP_STARTS)
-    return r_data
-
-
-async def read_dhw_burner_starts() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_DHW_BURNER_STARTS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_DHW_BURNER_STARTS)
-    return r_data
-
-
-async def read_burner_operation_hours() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_BURNER_OPERATION_HOURS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_BURNER_OPERATION_HOURS)
-    return r_data
-
-
-async def read_ch_pump_operation_hours() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_CH_PUMP_OPERATION_HOURS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_CH_PUMP_OPERATION_HOURS)
-    return r_data
-
-
-async def read_dhw_pump_operation_hours() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_DHW_PUMP_OPERATION_HOURS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_DHW_PUMP_OPERATION_HOURS)
-    return r_data
-
-
-async def read_dhw_burner_operation_hours() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_DHW_BURNER_OPERATION_HOURS, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_DHW_BURNER_OPERATION_HOURS)
-    return r_data
+async def read_fault_flags() -> dict:
+    return decode_fault_flags(await read(DATA_ID_ASF_FAULT))
 
 
-async def read_tsp_count() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TSP_COUNT, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TSP_COUNT)
-    return r_data >> 8
+async def read_remote_override_function() -> dict:
+    return decode_flags(REMOTE_OVERRIDE_FLAGS, await read(DATA_ID_REMOTE_OVERRIDE_FUNCTION))
 
 
 async def read_tsp(index: int) -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TSP_DATA, (index << 8)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TSP_DATA)
-    if r_data >> 8 != index:
-        msg = f"TSP index mismatch: expected {index}, got {r_data >> 8}"
+    r_index, value = await read(DATA_ID_TSP_DATA, index << 8)
+    if r_index != index:
+        msg = f"TSP index mismatch: expected {index}, got {r_index}"
         send_syslog(f"ERROR: {msg}")
         raise ValueError(msg)
-    return r_data & 0xff
-
-
-async def read_fhb_count() -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_FHB_COUNT, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_FHB_COUNT)
-    return r_data >> 8
+    return value
 
 
 async def read_fhb(index: int) -> int:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_FHB_DATA, (index << 8)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_FHB_DATA)
-    if r_data >> 8 != index:
-        msg = f"FHB index mismatch: expected {index}, got {r_data >> 8}"
+    r_index, value = await read(DATA_ID_FHB_DATA, index << 8)
+    if r_index != index:
+        msg = f"FHB index mismatch: expected {index}, got {r_index}"
         send_syslog(f"ERROR: {msg}")
         raise ValueError(msg)
-    return r_data & 0xff
+    return value
 
 
-async def control_remote_command(command: int):
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_COMMAND, command << 8
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_COMMAND)
-    if r_data >> 8 != command:
-        msg = f"Remote command mismatch: expected {command}, got {r_data >> 8}"
+async def control_remote_command(command: int) -> int:
+    r_command, response = await write(DATA_ID_COMMAND, (command, 0))
+    if r_command != command:
+        msg = f"Remote command mismatch: expected {command}, got {r_command}"
         send_syslog(f"ERROR: {msg}")
         raise ValueError(msg)
-    return r_data & 0xff
+    return response
 
 
-async def read_remote_override_room_setpoint():
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_TROVERRIDE, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_TROVERRIDE)
-    return f88(r_data)
-
-
-async def read_remote_override_function():
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_REMOTE_OVERRIDE_FUNCTION, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_REMOTE_OVERRIDE_FUNCTION)
-
-    result = dict(manual_change_priority=True if r_data & 0x01 else False,
-                  program_change_priority=True if r_data & 0x02 else False)
-    return result
-
-
-async def read_capacity_and_min_modulation():
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_MAX_CAPACITY_MIN_MODULATION, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_MAX_CAPACITY_MIN_MODULATION)
-
-    return r_data >> 8, r_data & 0xff
-
-
-async def control_max_relative_modulation_level(l: float):
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_WRITE_DATA, DATA_ID_MAX_REL_MODULATION, int(l * 256)
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_WRITE_ACK, r_data_id, DATA_ID_MAX_REL_MODULATION)
-
-
-async def read_max_relative_modulation_level() -> float:
-    r_msg_type, r_data_id, r_data = await opentherm_exchange_retry(
-        MSG_TYPE_READ_DATA, DATA_ID_MAX_REL_MODULATION, 0
-    )
-    _check_response_type(r_msg_type, MSG_TYPE_READ_ACK, r_data_id, DATA_ID_MAX_REL_MODULATION)
-    return f88(r_data)
+async def send_primary_product_version(type: int, version: int):
+    await write(DATA_ID_PRIMARY_VERSION, (type, version))
+
+
+# the original per-ID API, name: (data_id, whether it writes), generated below as thin
+# aliases over read()/write() so callers and tests keep working
+_ALIASES = {
+    "send_primary_configuration": (DATA_ID_PRIMARY_CONFIG, True),
+    "send_primary_opentherm_version": (DATA_ID_OPENTHERM_VERSION_PRIMARY, True),
+    "read_secondary_opentherm_version": (DATA_ID_OPENTHERM_VERSION_SECONDARY, False),
+    "read_secondary_product_version": (DATA_ID_SECONDARY_VERSION, False),
+    "control_ch_setpoint": (DATA_ID_TSET, True),
+    "read_ch_setpoint": (DATA_ID_TSET, False),
+    "control_ch2_setpoint": (DATA_ID_TSETCH2, True),
+    "read_dhw_setpoint_range": (DATA_ID_TDHWSET_BOUNDS, False),
+    "control_dhw_setpoint": (DATA_ID_TDHWSET, True),
+    "read_dhw_setpoint": (DATA_ID_TDHWSET, False),
+    "control_room_setpoint": (DATA_ID_TRSET, True),
+    "read_room_setpoint": (DATA_ID_TRSET, False),
+    "control_room_setpoint_ch2": (DATA_ID_TRSETCH2, True),
+    "control_room_temperature": (DATA_ID_TR, True),
+    "read_room_temperature": (DATA_ID_TR, False),
+    "control_cooling": (DATA_ID_COOLING_CONTROL, True),
+    "read_maxch_setpoint_range": (DATA_ID_MAXTSET_BOUNDS, False),
+    "control_maxch_setpoint": (DATA_ID_MAXTSET, True),
+    "read_maxch_setpoint": (DATA_ID_MAXTSET, False),
+    "read_oem_long_code": (DATA_ID_OEM_DIAGNOSTIC_CODE, False),
+    "read_relative_modulation_level": (DATA_ID_REL_MOD_LEVEL, False),
+    "read_ch_water_pressure": (DATA_ID_CH_PRESSURE, False),
+    "read_dhw_flow_rate": (DATA_ID_DHW_FLOW_RATE, False),
+    "read_boiler_flow_temperature": (DATA_ID_TBOILER, False),
+    "read_boiler_flow_temperature_ch2": (DATA_ID_TFLOWCH2, False),
+    "read_dhw_temperature": (DATA_ID_TDHW, False),
+    "read_dhw2_temperature": (DATA_ID_TDHW2, False),
+    "read_exhaust_temperature": (DATA_ID_TEXHAUST, False),
+    "read_fan_speed": (DATA_ID_BOILER_FAN_SPEED, False),
+    "read_outside_temperature": (DATA_ID_TOUTSIDE, False),
+    "read_boiler_return_water_temperature": (DATA_ID_TRET, False),
+    "read_power_cycles": (DATA_ID_POWER_CYCLES, False),
+    "read_burner_starts": (DATA_ID_BURNER_STARTS, False),
+    "read_ch_pump_starts": (DATA_ID_CH_PUMP_STARTS, False),
+    "read_dhw_pump_starts": (DATA_ID_DHW_PUMP_STARTS, False),
+    "read_dhw_burner_starts": (DATA_ID_DHW_BURNER_STARTS, False),
+    "read_burner_operation_hours": (DATA_ID_BURNER_OPERATION_HOURS, False),
+    "read_ch_pump_operation_hours": (DATA_ID_CH_PUMP_OPERATION_HOURS, False),
+    "read_dhw_pump_operation_hours": (DATA_ID_DHW_PUMP_OPERATION_HOURS, False),
+    "read_dhw_burner_operation_hours": (DATA_ID_DHW_BURNER_OPERATION_HOURS, False),
+    "read_tsp_count": (DATA_ID_TSP_COUNT, False),
+    "read_fhb_count": (DATA_ID_FHB_COUNT, False),
+    "read_remote_override_room_setpoint": (DATA_ID_TROVERRIDE, False),
+    "read_capacity_and_min_modulation": (DATA_ID_MAX_CAPACITY_MIN_MODULATION, False),
+    "control_max_relative_modulation_level": (DATA_ID_MAX_REL_MODULATION, True),
+    "read_max_relative_modulation_level": (DATA_ID_MAX_REL_MODULATION, False),
+}
+for _name, (_data_id, _write) in _ALIASES.items():
+    globals()[_name] = _writer(_data_id) if _write else _reader(_data_id)
+del _ALIASES, _name, _data_id, _write
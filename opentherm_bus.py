@@ -0,0 +1,175 @@
+import asyncio
+from lib import ticks_ms, ticks_diff
+
+
+# OT spec 4.3.1: master must wait 100ms minimum between conversations
+INTER_MESSAGE_GAP_MS = 100
+
+# request classes, most urgent first
+PRIORITY_MANDATORY = 0  # cyclic status/TSet exchanges (OT spec 5.2)
+PRIORITY_COMMAND = 1  # user commands, e.g. from MQTT
+PRIORITY_BACKGROUND = 2  # telemetry reads
+
+# assumed length of a conversation for a data ID we haven't seen yet:
+# ~34ms request + up to 400ms slave response time (OT spec 4.3.1) + ~34ms response
+DEFAULT_CONVERSATION_MS = 500
+
+
+class _Request:
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.event = asyncio.Event()
+
+
+class OpenThermBus:
+    """Owns the OpenTherm line and runs one conversation on it at a time.
+
+    Callers queue up and are handed the line in turn, most urgent priority
+    class first and in arrival order within a class, each running its own
+    exchange. Since the line is handed over between every frame, background
+    reads can never hold up a mandatory exchange by more than one conversation.
+
+    The inter-message gap is enforced by timestamp, counted from the end of the
+    previous conversation, just before the next one starts - so nobody sleeps
+    after their own exchange and back-to-back requests go out at the maximum
+    rate the spec allows.
+
+    The mandatory cycle can also reserve() the line for its next slot. Less
+    urgent requests that wouldn't finish (going by how long that data ID took
+    last time) before the slot starts step aside until it is over, so the
+    status/TSet cadence doesn't depend on what else is being polled. The first
+    conversation after a mandatory one is always let through, since the window
+    won't get any longer - otherwise slow or not-yet-seen data IDs would starve.
+    """
+
+    def __init__(self, exchange, gap_ms: int = INTER_MESSAGE_GAP_MS, conversation_ms: int = DEFAULT_CONVERSATION_MS):
+        """
+        Args:
+            exchange: async function with the signature of opentherm_rp2.opentherm_exchange
+            gap_ms: minimum time between the end of one conversation and the start of the next
+            conversation_ms: assumed duration of a conversation with a data ID not seen before
+        """
+        self.exchange_fn = exchange
+        self.gap_ms = gap_ms
+        self.conversation_ms = conversation_ms
+        self._queue = []
+        self._busy = False
+        self._last_end = None
+        self._reserved_at = None
+        self._reserved_ms = 0
+        self._durations = {}
+        self._after_mandatory = False
+
+    def reserve(self, at_ms: int, duration_ms: int):
+        """Keep the line free for mandatory exchanges from ticks_ms() value at_ms for duration_ms."""
+        self._reserved_at = at_ms
+        self._reserved_ms = duration_ms
+
+    def reserved_in_ms(self) -> int:
+        """ms until the reserved slot starts (0 if it's in progress), or -1 if nothing is reserved."""
+        if self._reserved_at is None:
+            return -1
+        until = ticks_diff(self._reserved_at, ticks_ms())
+        if until + self._reserved_ms <= 0:
+            return -1
+        return max(until, 0)
+
+    def pending(self) -> int:
+        """Number of requests waiting for the line."""
+        return len(self._queue)
+
+    async def exchange(self, msg_type: int, data_id: int, data_value: int, timeout_ms: int = 1000,
+                       priority: int = PRIORITY_BACKGROUND) -> tuple[int, int, int]:
+        await self._acquire(priority)
+        holding = True
+        try:
+            while True:
+                delay = 0
+                if self._last_end is not None:
+                    delay = self.gap_ms - ticks_diff(ticks_ms(), self._last_end)
+
+                if priority != PRIORITY_MANDATORY:
+                    wait = self._reservation_wait(data_id, delay)
+                    if wait > 0:
+                        # we'd overrun into the reserved slot: get out of the way until it's over
+                        self._release()
+                        holding = False
+                        await asyncio.sleep_ms(wait)
+                        await self._acquire(priority, first=True)
+                        holding = True
+                        continue
+
+                if delay <= 0:
+                    break
+                await asyncio.sleep_ms(delay)
+
+                # something more urgent turned up while we waited out the gap: let it go first
+                nxt = self._next()
+                if nxt >= 0 and self._queue[nxt].priority < priority:
+                    self._release()
+                    holding = False
+                    await self._acquire(priority, first=True)
+                    holding = True
+
+            start = ticks_ms()
+            try:
+                return await self.exchange_fn(msg_type, data_id, data_value, timeout_ms)
+            finally:
+                self._last_end = ticks_ms()
+                self._durations[data_id] = ticks_diff(self._last_end, start)
+                self._after_mandatory = priority == PRIORITY_MANDATORY
+        finally:
+            if holding:
+                self._release()
+
+    def _reservation_wait(self, data_id: int, delay: int) -> int:
+        # how long a non-mandatory conversation starting after delay ms must wait to stay clear of the reservation
+        if self._reserved_at is None:
+            return 0
+        until = ticks_diff(self._reserved_at, ticks_ms())
+        end = until + self._reserved_ms
+        if end <= 0:
+            # reservation is over (or the mandatory cycle has stopped renewing it)
+            self._reserved_at = None
+            return 0
+
+        needed = max(delay, 0) + self._durations.get(data_id, self.conversation_ms) + self.gap_ms
+        if needed <= until or (until > 0 and self._after_mandatory):
+            return 0
+        return end
+
+    async def _acquire(self, priority: int, first: bool = False):
+        if not self._busy and not self._queue:
+            self._busy = True
+            return
+
+        req = _Request(priority)
+        if first:
+            self._queue.insert(0, req)
+        else:
+            self._queue.append(req)
+        try:
+            await req.event.wait()
+        except asyncio.CancelledError:
+            if req in self._queue:
+                self._queue.remove(req)
+            else:
+                # the line was handed to us just as we were cancelled
+                self._release()
+            raise
+
+    def _next(self) -> int:
+        # index of the first waiter in the most urgent class, or -1
+        best = -1
+        for i, req in enumerate(self._queue):
+            if best < 0 or req.priority < self._queue[best].priority:
+                best = i
+        return best
+
+    def _release(self):
+        # hand the line straight to the next waiter, if any
+        nxt = self._next()
+        if nxt >= 0:
+            self._queue.pop(nxt).event.set()
+        else:
+            self._busy = False
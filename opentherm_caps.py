@@ -0,0 +1,105 @@
+import json
+import time
+
+
+# how long a data ID the boiler rejected is skipped before it's probed again, by the msg_type it answered with
+REJECT_TTL_S = {
+    7: 24 * 3600,  # UNKNOWN-DATAID: the boiler doesn't implement it at all
+    6: 300,  # DATA-INVALID: recognised, but the value isn't available right now (sensor fault, boiler starting up)
+}
+# each failed re-probe of an UNKNOWN-DATAID doubles its TTL, up to this
+MAX_TTL_S = 7 * 24 * 3600
+# only this msg_type is saved: it's a fixed property of the boiler, where DATA-INVALID can be transient
+PERSISTED_MSG_TYPE = 7
+
+CAPABILITIES_PATH = "otcaps.json"
+
+
+class CapabilityCache:
+    """Remembers which data IDs the boiler rejected, so they aren't asked for again.
+
+    Entries are keyed by data ID and hold the msg_type the boiler answered with
+    (MSG_TYPE_UNKNOWN_DATA_ID or MSG_TYPE_DATA_INVALID). Once an entry's TTL runs
+    out the ID is probed again: success forgets it, another UNKNOWN-DATAID keeps
+    it with twice the TTL. DATA-INVALID entries always get the short TTL, so a
+    single transient reply only hides a value for a few minutes.
+
+    UNKNOWN-DATAID entries are saved to a small JSON file whenever they change,
+    so a reboot or boiler restart doesn't have to re-learn them. DATA-INVALID
+    entries are kept in memory only. Time remaining is saved rather than an
+    absolute time, since the Pico's clock restarts on boot.
+    """
+
+    def __init__(self, path: str = CAPABILITIES_PATH):
+        self.path = path
+        self._entries = {}  # data_id: [msg_type, expires (time.time()), ttl_s]
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            # no cache yet (or it's corrupt): start from scratch
+            return
+
+        now = time.time()
+        self._entries = {}
+        for data_id, (msg_type, remaining_s, ttl_s) in saved.items():
+            if msg_type != PERSISTED_MSG_TYPE:
+                # written by an older version, which saved DATA-INVALID too
+                continue
+            self._entries[int(data_id)] = [msg_type, now + remaining_s, ttl_s]
+
+    def save(self):
+        now = time.time()
+        saved = {}
+        for data_id, (msg_type, expires, ttl_s) in self._entries.items():
+            if msg_type != PERSISTED_MSG_TYPE:
+                continue
+            saved[str(data_id)] = [msg_type, max(int(expires - now), 0), ttl_s]
+        try:
+            with open(self.path, "w") as f:
+                json.dump(saved, f)
+        except OSError as ex:
+            print(f"Failed to save {self.path}: {str(ex)}")
+
+    def lookup(self, data_id: int) -> int:
+        """The msg_type data_id was rejected with, or 0 if it should be exchanged (including re-probes)."""
+        entry = self._entries.get(data_id)
+        if entry is None or time.time() >= entry[1]:
+            return 0
+        return entry[0]
+
+    def record(self, data_id: int, msg_type: int):
+        """The boiler rejected data_id with msg_type."""
+        entry = self._entries.get(data_id)
+        if msg_type == PERSISTED_MSG_TYPE and entry is not None and entry[0] == msg_type:
+            # a failed re-probe: leave it longer next time
+            ttl_s = min(entry[2] * 2, MAX_TTL_S)
+        else:
+            ttl_s = REJECT_TTL_S[msg_type]
+        self._entries[data_id] = [msg_type, time.time() + ttl_s, ttl_s]
+        if msg_type == PERSISTED_MSG_TYPE or (entry is not None and entry[0] == PERSISTED_MSG_TYPE):
+            self.save()
+
+    def supported(self, data_id: int):
+        """The boiler answered data_id normally."""
+        entry = self._entries.pop(data_id, None)
+        if entry is not None and entry[0] == PERSISTED_MSG_TYPE:
+            self.save()
+
+    def inspect(self) -> dict:
+        """Per data ID: the msg_type it was rejected with, seconds until it's probed again and the current TTL."""
+        now = time.time()
+        result = {}
+        for data_id, (msg_type, expires, ttl_s) in self._entries.items():
+            result[data_id] = dict(msg_type=msg_type, probe_in_s=max(int(expires - now), 0), ttl_s=ttl_s)
+        return result
+
+    def clear(self, data_id: int = None):
+        """Forget data_id, or everything if not given."""
+        if data_id is None:
+            self._entries = {}
+        else:
+            self._entries.pop(data_id, None)
+        self.save()
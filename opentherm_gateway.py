@@ -0,0 +1,156 @@
+import asyncio
+
+from lib import ticks_ms, ticks_diff, send_syslog
+
+
+MSG_TYPE_READ_DATA = 0
+MSG_TYPE_READ_ACK = 4
+MSG_TYPE_WRITE_ACK = 5
+DATA_ID_STATUS = 0
+
+# OT spec 4.3.1: the slave must answer within this of the end of the master's request.
+# The boiler gets the same window from us, so a forwarded request only fits if it's quicker.
+RESPONSE_WINDOW_MS = 400
+# sending the request on to the boiler (opentherm_exchange waits 20ms after it before listening)
+# and getting our reply started once the boiler's is in
+FORWARD_OVERHEAD_MS = 34 + 20 + 10
+
+# a slow ID's cached reply is refreshed from the boiler at most this often
+REFRESH_MS = 30 * 1000
+# how long a refresh may take: the boiler's full window (OT v2.2 allowed 800ms)
+REFRESH_TIMEOUT_MS = 800
+# a cached reply older than this isn't used as a fallback
+CACHE_MAX_AGE_MS = 5 * 60 * 1000
+
+
+class Gateway:
+    """Sits between a room thermostat and the boiler, passing the thermostat's requests through.
+
+    The thermostat port is the slave side: receive() returns the next request
+    as (ticks_ms at its end, msg_type, data_id, data_value), raising ValueError
+    for a frame that didn't decode, and reply() answers it. exchange has the
+    signature of opentherm_rp2.opentherm_exchange and talks to the boiler.
+
+    Each request is forwarded with whatever time is left of the thermostat's
+    response window as the boiler timeout, so the thermostat is answered in
+    time or not at all (it will ask again). Data IDs in `overrides` have their
+    value replaced on the way to the boiler - e.g. a different TSet or DHW
+    setpoint - and the thermostat sees its own value acknowledged.
+
+    The boiler's last read reply for each ID is cached. When the boiler is too
+    slow on an ID to answer within the window, the ID is marked slow: it's
+    answered from the cache straight away and the cache is refreshed from the
+    boiler (with its full window) at most every refresh_ms. The refresh runs as
+    a task of its own, so the thermostat's next request is served meanwhile:
+    the boiler side is one bus, so a request forwarded during a refresh waits
+    for it, and falls back on the cache if that leaves no time.
+    """
+
+    def __init__(self, thermostat, exchange, window_ms: int = RESPONSE_WINDOW_MS, refresh_ms: int = REFRESH_MS,
+                 cache_max_age_ms: int = CACHE_MAX_AGE_MS):
+        self.thermostat = thermostat
+        self.exchange = exchange
+        self.window_ms = window_ms
+        self.refresh_ms = refresh_ms
+        self.cache_max_age_ms = cache_max_age_ms
+        self.overrides = {}  # data_id: value sent to the boiler in place of the thermostat's
+        self.slow = set()  # data IDs answered from the cache
+        self._cache = {}  # data_id: (ticks_ms, msg_type, data_value) of the boiler's last read reply
+        self.stats = dict(forwarded=0, overridden=0, from_cache=0, no_reply=0, bad_frames=0, refreshes=0)
+        self._bus = asyncio.Lock()  # one conversation with the boiler at a time
+        self._refreshing = None  # the refresh task, while there is one
+
+    def cached(self, data_id: int):
+        """The cached (msg_type, data_value) for data_id, or None if there isn't a usable one."""
+        entry = self._cache.get(data_id)
+        if entry is None or ticks_diff(ticks_ms(), entry[0]) > self.cache_max_age_ms:
+            return None
+        return entry[1], entry[2]
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    received_ms, msg_type, data_id, data_value = await self.thermostat.receive()
+                except ValueError:
+                    # a slave doesn't answer a frame it couldn't decode; the thermostat will try again
+                    self.stats['bad_frames'] += 1
+                    continue
+                await self.handle(received_ms, msg_type, data_id, data_value)
+        finally:
+            if self._refreshing is not None:
+                self._refreshing.cancel()
+
+    async def handle(self, received_ms: int, msg_type: int, data_id: int, data_value: int):
+        boiler_value = self.overrides.get(data_id, data_value)
+        if boiler_value != data_value:
+            self.stats['overridden'] += 1
+        read = msg_type == MSG_TYPE_READ_DATA
+
+        if read and data_id in self.slow:
+            cached = self.cached(data_id)
+            if cached is not None:
+                await self._reply(msg_type, data_id, data_value, cached[0], cached[1])
+                self.stats['from_cache'] += 1
+                if ticks_diff(ticks_ms(), self._cache[data_id][0]) >= self.refresh_ms:
+                    self._start_refresh(data_id, boiler_value)
+                return
+
+        response = None
+        async with self._bus:
+            # what's left of the window once the bus is ours
+            timeout_ms = self.window_ms - ticks_diff(ticks_ms(), received_ms) - FORWARD_OVERHEAD_MS
+            if timeout_ms > 0:
+                try:
+                    response = await self.exchange(msg_type, data_id, boiler_value, timeout_ms)
+                except Exception as ex:
+                    if read and "Timeout" in str(ex):
+                        self.slow.add(data_id)
+                        send_syslog(f"Gateway: boiler too slow on data ID {data_id}, answering it from cache")
+
+        if response is not None:
+            r_msg_type, _, r_value = response
+            if read and r_msg_type == MSG_TYPE_READ_ACK:
+                self._cache[data_id] = (ticks_ms(), r_msg_type, r_value)
+            await self._reply(msg_type, data_id, data_value, r_msg_type, r_value)
+            self.stats['forwarded'] += 1
+            return
+
+        cached = self.cached(data_id) if read else None
+        if cached is not None:
+            await self._reply(msg_type, data_id, data_value, cached[0], cached[1])
+            self.stats['from_cache'] += 1
+        else:
+            self.stats['no_reply'] += 1
+        if read and data_id in self.slow:
+            self._start_refresh(data_id, boiler_value)
+
+    async def _reply(self, msg_type: int, data_id: int, data_value: int, r_msg_type: int, r_value: int):
+        # where the reply echoes the request, the thermostat gets its own value back rather than an override
+        if r_msg_type == MSG_TYPE_WRITE_ACK:
+            r_value = data_value
+        elif data_id == DATA_ID_STATUS and r_msg_type == MSG_TYPE_READ_ACK:
+            r_value = (data_value & 0xff00) | (r_value & 0xff)
+        await self.thermostat.reply(r_msg_type, data_id, r_value)
+
+    def _start_refresh(self, data_id: int, boiler_value: int):
+        # one at a time: a slow ID asked for again before its refresh is done gets the cache
+        if self._refreshing is None:
+            self._refreshing = asyncio.create_task(self._refresh(data_id, boiler_value))
+
+    async def _refresh(self, data_id: int, boiler_value: int):
+        # ask the boiler with its full window, alongside the thermostat's next requests
+        self.stats['refreshes'] += 1
+        try:
+            async with self._bus:
+                start = ticks_ms()
+                r_msg_type, _, r_value = await self.exchange(MSG_TYPE_READ_DATA, data_id, boiler_value, REFRESH_TIMEOUT_MS)
+        except Exception:
+            return
+        finally:
+            self._refreshing = None
+        if r_msg_type == MSG_TYPE_READ_ACK:
+            self._cache[data_id] = (ticks_ms(), r_msg_type, r_value)
+        if ticks_diff(ticks_ms(), start) + FORWARD_OVERHEAD_MS < self.window_ms:
+            # quick enough to forward again
+            self.slow.discard(data_id)
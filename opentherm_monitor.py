@@ -0,0 +1,82 @@
+import asyncio
+from array import array
+
+
+# error flags recorded with each frame
+FLAG_DECODE = 0x01  # Manchester violation: the frame word is whatever was decoded before it
+FLAG_PARITY = 0x02  # decoded, but the parity bit was wrong
+FLAG_OVERRUN = 0x04  # the ring was full and frames before this one were dropped
+
+
+class FrameRing:
+    """Fixed-size ring of captured frames, fed from the RX IRQ and consumed by async for.
+
+    Each entry is (ticks_us, raw 32 bit frame, flags), stored in arrays so
+    capturing doesn't allocate per frame. When the ring is full new frames
+    are dropped and counted in `dropped`, and the next one that fits is
+    flagged FLAG_OVERRUN, so a consumer can tell there's a gap.
+
+        ring = FrameRing(64)
+        opentherm_rp2.monitor_start(ring)
+        async for ticks_us, frame, flags in ring:
+            ...
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.dropped = 0
+        self._ticks = array('I', bytes(4 * size))
+        self._frames = array('I', bytes(4 * size))
+        self._flags = bytearray(size)
+        self._head = 0
+        self._count = 0
+        self._overrun = False
+        self._flag = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, ticks_us: int, frame: int, flags: int = 0):
+        """Record a frame: safe to call from an IRQ handler."""
+        if self._count >= self.size:
+            self.dropped += 1
+            self._overrun = True
+            return
+
+        if self._overrun:
+            flags |= FLAG_OVERRUN
+            self._overrun = False
+        slot = (self._head + self._count) % self.size
+        # MicroPython's ticks_us() wraps at 30 bits; so does the timestamp here, on any host
+        self._ticks[slot] = ticks_us & 0x3fffffff
+        self._frames[slot] = frame
+        self._flags[slot] = flags
+        self._count += 1
+        if self._flag is not None:
+            self._flag.set()
+
+    def pop(self):
+        """The oldest (ticks_us, frame, flags), or None if the ring is empty."""
+        if not self._count:
+            return None
+        head = self._head
+        self._head = (head + 1) % self.size
+        self._count -= 1
+        return self._ticks[head], self._frames[head], self._flags[head]
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self._overrun = False
+
+    def __aiter__(self):
+        if self._flag is None:
+            # set from the IRQ handler; CPython has no ThreadSafeFlag
+            self._flag = getattr(asyncio, "ThreadSafeFlag", asyncio.Event)()
+        return self
+
+    async def __anext__(self):
+        while not self._count:
+            await self._flag.wait()
+            self._flag.clear()
+        return self.pop()
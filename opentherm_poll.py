@@ -0,0 +1,127 @@
+from lib import ticks_ms, ticks_diff, ticks_add
+
+
+# while the flame is on values move quickly, so no ID waits longer than max_ms / FLAME_MAX_DIVISOR
+FLAME_MAX_DIVISOR = 4
+
+# interval growth factor when a value is steady
+BACKOFF_NUM = 3
+BACKOFF_DEN = 2
+
+
+class _PollState:
+    def __init__(self, min_ms: int, max_ms: int, deadband, now: int):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.deadband = deadband
+        self.interval_ms = min_ms
+        self.next_due = now
+        self.last_value = None
+        self.reads = 0
+        self.errors = 0
+        self.added = now
+
+
+class PollScheduler:
+    """Decides which data IDs are due to be read, adapting each ID's interval to its signal.
+
+    Each ID is polled somewhere between its min_ms and max_ms. After a read, an
+    ID whose value moved by more than its deadband is polled sooner - in
+    proportion, aiming for about one deadband of change per poll - while a steady
+    one backs off towards max_ms. Failed reads back off too. While the flame is
+    on, intervals are capped lower, and a flame change resets everything to its
+    minimum interval since that's when values are about to move.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._flame = False
+
+    def add(self, data_id: int, min_ms: int, max_ms: int, deadband=0):
+        """Poll data_id every min_ms to max_ms, treating changes bigger than deadband as significant."""
+        self._ids[data_id] = _PollState(min_ms, max_ms, deadband, ticks_ms())
+
+    def remove(self, data_id: int):
+        self._ids.pop(data_id, None)
+
+    def set_flame(self, active: bool):
+        if active == self._flame:
+            return
+        self._flame = active
+
+        now = ticks_ms()
+        for state in self._ids.values():
+            state.interval_ms = state.min_ms
+            if ticks_diff(state.next_due, now) > state.min_ms:
+                state.next_due = ticks_add(now, state.min_ms)
+
+    def due(self) -> list:
+        """Data IDs whose poll is due now, most overdue first."""
+        now = ticks_ms()
+        due = []
+        for data_id, state in self._ids.items():
+            if ticks_diff(now, state.next_due) >= 0:
+                due.append((ticks_diff(state.next_due, now), data_id))
+        due.sort()
+        return [data_id for _, data_id in due]
+
+    def next_due_ms(self) -> int:
+        """ms until the next ID is due (0 if one is already), or -1 if nothing is scheduled."""
+        now = ticks_ms()
+        wait = -1
+        for state in self._ids.values():
+            until = max(ticks_diff(state.next_due, now), 0)
+            if wait < 0 or until < wait:
+                wait = until
+        return wait
+
+    def update(self, data_id: int, value):
+        """Record a successful read of data_id and schedule the next one."""
+        state = self._ids[data_id]
+        state.reads += 1
+
+        if state.last_value is not None:
+            delta = abs(value - state.last_value)
+            if delta > state.deadband:
+                if state.deadband:
+                    state.interval_ms = int(state.interval_ms * state.deadband / delta)
+                else:
+                    state.interval_ms = state.min_ms
+            else:
+                state.interval_ms = state.interval_ms * BACKOFF_NUM // BACKOFF_DEN
+        state.last_value = value
+        self._schedule(state)
+
+    def skip(self, data_id: int):
+        """Reschedule data_id at its max interval without reading it, e.g. while it's known unsupported."""
+        state = self._ids[data_id]
+        state.interval_ms = state.max_ms
+        self._schedule(state)
+
+    def failed(self, data_id: int):
+        """Record a failed read of data_id: back off, so a bad ID doesn't hog the bus."""
+        state = self._ids[data_id]
+        state.errors += 1
+        state.interval_ms = state.interval_ms * BACKOFF_NUM // BACKOFF_DEN
+        self._schedule(state)
+
+    def stats(self) -> dict:
+        """Per data ID: current interval, reads, errors and the achieved read rate per minute."""
+        now = ticks_ms()
+        result = {}
+        for data_id, state in self._ids.items():
+            elapsed = ticks_diff(now, state.added)
+            result[data_id] = dict(
+                interval_ms=state.interval_ms,
+                reads=state.reads,
+                errors=state.errors,
+                per_minute=state.reads * 60000 / elapsed if elapsed > 0 else 0,
+            )
+        return result
+
+    def _schedule(self, state: _PollState):
+        max_ms = state.max_ms
+        if self._flame:
+            max_ms = max(max_ms // FLAME_MAX_DIVISOR, state.min_ms)
+        state.interval_ms = min(max(state.interval_ms, state.min_ms), max_ms)
+        state.next_due = ticks_add(ticks_ms(), state.interval_ms)
@@ -0,0 +1,89 @@
+import random
+from array import array
+
+
+# failure classes
+FAIL_TIMEOUT = 0  # no (complete) frame from the boiler
+FAIL_DECODE = 1  # frame arrived but wasn't valid Manchester
+FAIL_PARITY = 2  # frame decoded but the parity bit was wrong
+FAIL_PROTOCOL = 3  # well-formed frame, but not a reply to what we asked
+FAIL_OTHER = 4
+FAIL_NAMES = ("timeout", "decode", "parity", "protocol", "other")
+
+# retries allowed per class within one call, regardless of max_retries. A
+# timeout already cost the whole response window and usually means the boiler
+# is busy or gone; line noise (decode/parity) tends to clear up on the next frame.
+DEFAULT_BUDGETS = (2, 3, 3, 2, 10)
+
+# backoff before the first retry of each class, doubling for each further retry of that class
+DEFAULT_BACKOFF_MS = (50, 20, 20, 20, 50)
+MAX_BACKOFF_MS = 400
+
+# how long a call may spend retrying by default, by bus priority. Mandatory
+# exchanges have to fit in the 1s status cycle; the others stay off the line
+# well before that's at risk.
+DEFAULT_DEADLINE_MS = (900, 3000, 2000)
+
+# exception messages raised by opentherm_rp2/lib, by failure class
+_MESSAGES = (
+    ("Timeout", FAIL_TIMEOUT),
+    ("Manchester", FAIL_DECODE),
+    ("Parity", FAIL_PARITY),
+    ("Expected", FAIL_PROTOCOL),
+)
+
+
+class RetryPolicy:
+    """Decides whether, and after how long, a failed OpenTherm exchange is retried.
+
+    Failures are classified by class (timeout, decode, parity, protocol or
+    other), each with its own retry budget and exponential backoff, jittered
+    by up to the base backoff so that retries from several tasks don't line up.
+    Retry and give-up counts are kept per class for stats().
+
+    Subclass and override classify() or delay_ms() to change the policy, and
+    install an instance as opentherm_app.retry_policy.
+    """
+
+    def __init__(self, budgets=DEFAULT_BUDGETS, backoff_ms=DEFAULT_BACKOFF_MS, max_backoff_ms: int = MAX_BACKOFF_MS):
+        self.budgets = budgets
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.retries = array('I', [0] * len(FAIL_NAMES))
+        self.give_ups = array('I', [0] * len(FAIL_NAMES))
+
+    def classify(self, ex: Exception) -> int:
+        """The failure class of an exception raised by an exchange."""
+        msg = str(ex)
+        for text, failure in _MESSAGES:
+            if text in msg:
+                return failure
+        return FAIL_OTHER
+
+    def delay_ms(self, failure: int, attempt: int) -> int:
+        """ms to back off before retry number attempt (from 0) of this class, or -1 once its budget is spent."""
+        if attempt >= self.budgets[failure]:
+            return -1
+        base = self.backoff_ms[failure]
+        if not base:
+            return 0
+        delay = min(base << attempt, self.max_backoff_ms)
+        return delay + random.getrandbits(8) * base // 256
+
+    def retried(self, failure: int):
+        self.retries[failure] += 1
+
+    def gave_up(self, failure: int):
+        self.give_ups[failure] += 1
+
+    def stats(self) -> dict:
+        """Per failure class: retries made and calls given up on."""
+        result = {}
+        for failure, name in enumerate(FAIL_NAMES):
+            result[name] = dict(retries=self.retries[failure], give_ups=self.give_ups[failure])
+        return result
+
+    def reset(self):
+        for failure in range(len(FAIL_NAMES)):
+            self.retries[failure] = 0
+            self.give_ups[failure] = 0
@@ -1,8 +1,9 @@
 import machine
 import rp2
-import time
-from lib import manchester_encode, frame_encode, manchester_decode, frame_decode
+from array import array
+from lib import frame_encode_manchester, frame_encode_manchester_into, decode_manchester_frame_from, frame_decode, frame_decode_from, frame_parity, ticks_us, ticks_ms, ticks_diff, ticks_add
 import asyncio
+from opentherm_monitor import FrameRing, FLAG_DECODE, FLAG_PARITY
 
 
 # PIO Program Configuration
@@ -10,6 +11,16 @@ import asyncio
 PIO_TX_FREQ = 4000  # 4kHz -> 250µs per tick -> 500µs per Manchester bit
 PIO_RX_FREQ = 60000  # 60kHz -> 16.67µs per tick -> ~700µs timeout
 PIO_RX_TIMEOUT_LOOPS = 14  # Number of loops before timeout
+PIO_RX_BITS = 64  # Manchester half-bits per frame (start/stop bits excluded)
+PIO_RX_FRAME_BITS = 32  # data bits per frame, for opentherm_rx_decode
+PIO_RX_VIOLATION = 0xffffffff  # pushed by opentherm_rx_decode after a Manchester violation
+TX_TIMEOUT_MS = 100  # a frame takes ~34ms to transmit
+GATEWAY_TX_PIN = 2  # gateway mode: the slave-side interface, facing the thermostat
+GATEWAY_RX_PIN = 3
+TX_DMA = True  # feed the TX state machine by DMA where the firmware has rp2.DMA
+PIO0_TXF0 = 0x50200010  # PIO0 base + TXF0: sm_opentherm_tx's TX FIFO
+DREQ_PIO0_TX0 = 0  # DMA pacing by sm_opentherm_tx's TX FIFO
+FRAME_MS = 34  # start, 32 data and stop bits at 1ms a bit
 
 
 # opentherm tx - transmit pre-manchester-encoded-bits. Automatically sends start and stop bits.
@@ -21,6 +32,7 @@ PIO_RX_TIMEOUT_LOOPS = 14  # Number of loops before timeout
 # - autopull=True: Automatically pull from FIFO to OSR when empty
 # - out_shiftdir=SHIFT_LEFT: Shift OSR left (MSB first)
 # - freq=4000: 250µs per tick, 500µs per Manchester bit
+# - raises its relative IRQ once the stop bit has been sent
 @rp2.asm_pio(autopush=True, set_init=rp2.PIO.OUT_HIGH, out_init=rp2.PIO.OUT_HIGH, autopull=True, out_shiftdir=rp2.PIO.SHIFT_LEFT)
 def opentherm_tx():
     # counter for bit writing loop
@@ -46,7 +58,7 @@ def opentherm_tx():
     nop()
 
     # indicate that we're done!
-    in_(x, 32)
+    irq(rel(0))
     label("loop")
     jmp("loop")
 
@@ -57,8 +69,14 @@ def opentherm_tx():
 # - autopush=True: Automatically push ISR to FIFO when full
 # - in_shiftdir=SHIFT_LEFT: Shift ISR left (MSB first)
 # - freq=60000: 16.67µs per tick for fine-grained sampling
+# - the number of bits to receive (minus one) is pulled from the TX FIFO at start,
+#   and the relative IRQ is raised once they have all been pushed
 @rp2.asm_pio(autopush=True, in_shiftdir=rp2.PIO.SHIFT_LEFT)
 def opentherm_rx():
+    # bit counter
+    pull()
+    mov(y, osr)
+
     # wait for start bit
     wait(1, pin, 0)
     wait(0, pin, 0)
@@ -70,6 +88,14 @@ def opentherm_rx():
     # read the current bit from the GPIO
     label("read_next_bit")
     in_(pins, 1)
+    jmp(y_dec, "more_bits")
+
+    # indicate that we're done!
+    irq(rel(0))
+    label("done")
+    jmp("done")
+
+    label("more_bits")
     set(x, 14)  # 14 loops, ~3 ticks per loop, 60kHz == ~700µs timeout
     jmp(pin, "wait_for_bit_currently_1")
 
@@ -89,9 +115,197 @@ def opentherm_rx():
     jmp("read_next_bit")
 
 
+# opentherm rx, decoding - Manchester-decodes in the state machine and pushes the 32 bit frame
+#
+# Every bit has a transition in the middle, which the program resyncs on. 3/4 of a bit after
+# one, it samples the first half of the next bit (that's the data bit: 1 is high-then-low on
+# the line), then waits up to half a bit for the mid-bit transition to the opposite level.
+#
+# PIO Configuration:
+# - autopush=True: the frame is pushed once its 32 bits have been shifted in
+# - in_shiftdir=SHIFT_LEFT: Shift ISR left (MSB first)
+# - freq=60000: 16.67µs per tick
+# - the number of bits to receive (minus one) is pulled from the TX FIFO at start
+# - on success, one word is pushed and the relative IRQ raised; after the stop bit it pulls
+#   the next bit count, so it can run continuously
+# - on a missing mid-bit transition (a Manchester violation), whatever had been decoded is
+#   pushed followed by PIO_RX_VIOLATION, and the IRQ raised: so two or more words mean an
+#   error. It then stops until restarted
+@rp2.asm_pio(autopush=True, in_shiftdir=rp2.PIO.SHIFT_LEFT)
+def opentherm_rx_decode():
+    # bit counter
+    label("start")
+    pull()
+    mov(y, osr)
+    # all ones: a 1 bit is shifted in from here
+    mov(osr, invert(null))
+
+    # wait for start bit, synced on its mid-bit transition
+    wait(1, pin, 0)
+    wait(0, pin, 0)
+
+    # sample 44 ticks (~730µs) after seeing the mid-bit transition
+    label("next_bit")
+    set(x, 15) [9]
+    label("sample_delay")
+    jmp(x_dec, "sample_delay") [1]
+    jmp(pin, "one")
+
+    # a 0: wait for the line to rise, for up to 2 * 16 ticks
+    in_(null, 1)
+    set(x, 15)
+    label("wait_rise")
+    jmp(pin, "got_edge")
+    jmp(x_dec, "wait_rise")
+    jmp("violation")
+
+    # a 1: wait for the line to fall
+    label("one")
+    in_(osr, 1)
+    set(x, 15)
+    label("wait_fall")
+    jmp(pin, "still_high")
+    jmp("got_edge")
+    label("still_high")
+    jmp(x_dec, "wait_fall")
+    jmp("violation")
+
+    label("got_edge")
+    jmp(y_dec, "next_bit")
+
+    # indicate that we're done! then let the stop bit go by, so it isn't taken for
+    # the next frame's start bit, and start over with the next bit count
+    irq(rel(0))
+    wait(1, pin, 0)
+    wait(0, pin, 0)
+    jmp("start")
+
+    label("violation")
+    push()
+    mov(isr, invert(null))
+    push()
+    irq(rel(0))
+    label("done")
+    jmp("done")
+
+
 # Initialize state machines
+# RX lives on the second PIO block: both programs together no longer fit in one block's 32 instructions
 sm_opentherm_tx = rp2.StateMachine(0, opentherm_tx, freq=PIO_TX_FREQ, set_base=machine.Pin(0), out_base=machine.Pin(0))
-sm_opentherm_rx = rp2.StateMachine(1, opentherm_rx, freq=PIO_RX_FREQ, in_base=machine.Pin(1), jmp_pin=machine.Pin(1))
+sm_opentherm_rx = rp2.StateMachine(4, opentherm_rx, freq=PIO_RX_FREQ, in_base=machine.Pin(1), jmp_pin=machine.Pin(1))
+
+# the encoded request, DMAed to the TX FIFO so the CPU doesn't touch it
+tx_buf = array('I', (0, 0))
+# the response words, read straight out of the RX FIFO; rx_word is the one word of RX_DECODE mode
+rx_buf = array('I', (0, 0))
+rx_word = memoryview(rx_buf)[:1]
+
+# how the last exchange went (ms, -1 where it didn't get that far): sending the
+# request, and the slave's response latency - from the end of the request to
+# the end of the response, less the response frame itself
+TIMING_TX = 0
+TIMING_LATENCY = 1
+timing = array('i', (-1, -1))
+
+
+def _init_tx_dma():
+    if not TX_DMA:
+        return None
+    try:
+        return rp2.DMA()
+    except (AttributeError, OSError):
+        # no rp2.DMA in this firmware (pre 1.22), or no free channel: put() by hand instead
+        return None
+
+
+tx_dma = _init_tx_dma()
+tx_dma_ctrl = tx_dma.pack_ctrl(size=2, inc_write=False, treq_sel=DREQ_PIO0_TX0) if tx_dma else None
+
+# RX modes: raw Manchester half-bits decoded by the CPU, or frames decoded in the PIO
+RX_RAW = 0
+RX_DECODE = 1
+RX_PROGRAMS = (opentherm_rx, opentherm_rx_decode)
+rx_mode = RX_RAW
+# the open ThermostatPort, if any: its SM 5 runs RX_DECODE in PIO1 too, so that program has to stay
+thermostat_port = None
+
+# completion is signalled by the PIO programs raising IRQs
+tx_done = asyncio.ThreadSafeFlag()
+rx_done = asyncio.ThreadSafeFlag()
+sm_opentherm_tx.irq(lambda sm: tx_done.set())
+sm_opentherm_rx.irq(lambda sm: rx_done.set())
+
+
+def init_rx(mode: int):
+    """(Re)initialise the RX state machine with the program for mode (RX_RAW or RX_DECODE).
+
+    The two programs don't fit in the PIO block together, so switching removes
+    the current one first. That would pull RX_DECODE out from under an open
+    ThermostatPort, so switching away from it raises RuntimeError until the
+    port is closed.
+    """
+    global rx_mode
+    if mode != rx_mode and thermostat_port is not None:
+        raise RuntimeError("RX mode can't change while a ThermostatPort is open")
+    sm_opentherm_rx.active(0)
+    if mode != rx_mode:
+        rp2.PIO(1).remove_program(RX_PROGRAMS[rx_mode])
+    sm_opentherm_rx.init(RX_PROGRAMS[mode], freq=PIO_RX_FREQ, in_base=machine.Pin(1), jmp_pin=machine.Pin(1))
+    sm_opentherm_rx.irq(lambda sm: rx_done.set())
+    rx_mode = mode
+
+
+def _capture(sm, ring):
+    # the frame is complete (or broke off): record it and give the PIO the next bit count
+    words = sm.rx_fifo()
+    flags = 0
+    if words:
+        ticks = ticks_us()
+        frame = sm.get()
+        if words > 1:
+            # the rest ends in PIO_RX_VIOLATION
+            while sm.rx_fifo():
+                sm.get()
+            flags = FLAG_DECODE
+        elif frame_parity(frame):
+            flags = FLAG_PARITY
+        ring.append(ticks, frame, flags)
+    if flags & FLAG_DECODE:
+        # it stops after a violation
+        sm.restart()
+    sm.put(PIO_RX_FRAME_BITS - 1)
+
+
+def _monitor_irq(sm):
+    _capture(sm, monitor_ring)
+
+
+monitor_ring = None
+
+
+def monitor_start(ring):
+    """Passive monitor mode: the RX state machine runs continuously, every frame going into ring.
+
+    Frames are timestamped with ticks_us() when the PIO signals their end. RX
+    is left in RX_DECODE mode. Don't call opentherm_exchange() while monitoring.
+    """
+    global monitor_ring
+    monitor_ring = ring
+    init_rx(RX_DECODE)
+    while sm_opentherm_rx.rx_fifo():
+        sm_opentherm_rx.get()
+    sm_opentherm_rx.irq(_monitor_irq)
+    sm_opentherm_rx.restart()
+    sm_opentherm_rx.put(PIO_RX_FRAME_BITS - 1)
+    sm_opentherm_rx.active(1)
+
+
+def monitor_stop():
+    """Leave monitor mode, so opentherm_exchange() can be used again."""
+    global monitor_ring
+    sm_opentherm_rx.active(0)
+    sm_opentherm_rx.irq(lambda sm: rx_done.set())
+    monitor_ring = None
 
 
 async def opentherm_exchange(msg_type: int, data_id: int, data_value: int, timeout_ms: int = 1000, debug: bool=False) -> tuple[int, int, int]:
@@ -103,53 +317,145 @@ async def opentherm_exchange(msg_type: int, data_id: int, data_value: int, timeo
     - RX does NOT invert because it reads the raw pin state directly
     - This asymmetry is intentional and matches the OpenTherm electrical interface
     """
-    f = frame_encode(msg_type, data_id, data_value)
-    m = manchester_encode(f, invert=True)  # Invert for TX hardware
+    if tx_dma is not None:
+        frame_encode_manchester_into(tx_buf, msg_type, data_id, data_value, invert=True)  # Invert for TX hardware
+        if debug:
+            m_hi, m_lo = tx_buf
+    else:
+        m_hi, m_lo = frame_encode_manchester(msg_type, data_id, data_value, invert=True)  # Invert for TX hardware
     if debug:
-        print(f"> {f:08x} {(m >> 48) & 0xffff:016b} {(m >> 32) & 0xffff:016b} {(m >> 16) & 0xffff:016b} {m & 0xffff:016b}")
+        print(f"> {m_hi >> 16:016b} {m_hi & 0xffff:016b} {m_lo >> 16:016b} {m_lo & 0xffff:016b}")
+
+    timing[TIMING_TX] = -1
+    timing[TIMING_LATENCY] = -1
 
     # setup pio
     sm_opentherm_tx.active(0)
     sm_opentherm_rx.active(0)
     while sm_opentherm_rx.rx_fifo():
         sm_opentherm_rx.get()
-    while sm_opentherm_tx.rx_fifo():
-        sm_opentherm_tx.get()
+    tx_done.clear()
+    rx_done.clear()
 
     # send the data using the transmitter pio
-    sm_opentherm_tx.put(int(m) >> 32)
-    sm_opentherm_tx.put(int(m))
+    if tx_dma is not None:
+        tx_dma.config(read=tx_buf, write=PIO0_TXF0, count=2, ctrl=tx_dma_ctrl, trigger=True)
+    else:
+        sm_opentherm_tx.put(m_hi)
+        sm_opentherm_tx.put(m_lo)
     sm_opentherm_tx.restart()
+    tx_start = ticks_ms()
     sm_opentherm_tx.active(1)
-    # wait for the pio to finish - don't care about value
-    while not sm_opentherm_tx.rx_fifo():
-        await asyncio.sleep_ms(1)
-    sm_opentherm_tx.get()
-    sm_opentherm_tx.active(0)
+    # wait for the pio to finish
+    try:
+        await asyncio.wait_for_ms(tx_done.wait(), TX_TIMEOUT_MS)
+    except asyncio.TimeoutError:
+        if tx_dma is not None:
+            tx_dma.active(0)
+        raise Exception("Timeout waiting for transmit")
+    finally:
+        sm_opentherm_tx.active(0)
+    tx_end = ticks_ms()
+    timing[TIMING_TX] = ticks_diff(tx_end, tx_start)
 
     # OT spec 4.3.1: slave response must arrive between 20ms and 400ms after request (v4.2; was 800ms in v2.2)
     await asyncio.sleep_ms(20)
 
     # wait for response
+    decode = rx_mode == RX_DECODE
     sm_opentherm_rx.restart()
+    sm_opentherm_rx.put(PIO_RX_FRAME_BITS - 1 if decode else PIO_RX_BITS - 1)
     sm_opentherm_rx.active(1)
-    timeout = time.ticks_ms() + timeout_ms
-    while sm_opentherm_rx.rx_fifo() < 2 and time.ticks_ms() < timeout:
-        await asyncio.sleep_ms(10)
+    try:
+        await asyncio.wait_for_ms(rx_done.wait(), timeout_ms)
+        timing[TIMING_LATENCY] = ticks_diff(ticks_ms(), tx_end) - FRAME_MS
+    except asyncio.TimeoutError:
+        pass
     sm_opentherm_rx.active(0)
 
+    if decode:
+        # one word is the frame; anything more ends in PIO_RX_VIOLATION
+        words = sm_opentherm_rx.rx_fifo()
+        if not words:
+            raise Exception("Timeout waiting for response")
+        sm_opentherm_rx.get(rx_word)
+        if debug:
+            print(f"< {rx_buf[0] >> 16:016b} {rx_buf[0] & 0xffff:016b}")
+        if words > 1:
+            raise ValueError("Manchester decoding error")
+        return frame_decode_from(rx_buf)
+
     # check we didn't time out
     if sm_opentherm_rx.rx_fifo() < 2:
         raise Exception("Timeout waiting for response")
 
     # decode it (no inversion needed - RX reads raw pin state)
-    a = sm_opentherm_rx.get()
-    b = sm_opentherm_rx.get()
-    m2 = (a << 32) | b
-    f2 = 0
-    try:
-        f2 = manchester_decode(m2)  # No inversion for RX
-    finally:
-        if debug:
-            print(f"< {f2:08x} {(m2 >> 48) & 0xffff:016b} {(m2 >> 32) & 0xffff:016b} {(m2 >> 16) & 0xffff:016b} {m2 & 0xffff:016b}")
-    return frame_decode(f2)
+    sm_opentherm_rx.get(rx_buf)
+    if debug:
+        a, b = rx_buf
+        print(f"< {a >> 16:016b} {a & 0xffff:016b} {b >> 16:016b} {b & 0xffff:016b}")
+    return decode_manchester_frame_from(rx_buf)  # No inversion for RX
+
+
+class ThermostatPort:
+    """The slave side for opentherm_gateway.Gateway: receives a thermostat's requests and replies to them.
+
+    It uses a second pair of state machines running the same programs, so no
+    more instruction memory: SM 1 (opentherm_tx, in PIO0 alongside
+    sm_opentherm_tx) and SM 5 (opentherm_rx_decode, in PIO1 alongside
+    sm_opentherm_rx, which is switched to RX_DECODE for it). RX runs
+    continuously into a FrameRing, as in monitor mode, so a request arriving
+    while the gateway is still busy with the boiler isn't lost. sm_opentherm_rx
+    stays in RX_DECODE until the port is closed.
+    """
+
+    def __init__(self, tx_pin: int = GATEWAY_TX_PIN, rx_pin: int = GATEWAY_RX_PIN, ring_size: int = 4):
+        global thermostat_port
+        if thermostat_port is not None:
+            raise RuntimeError("ThermostatPort already open")
+        init_rx(RX_DECODE)
+        self.ring = FrameRing(ring_size)
+        self.tx_done = asyncio.ThreadSafeFlag()
+        self.sm_tx = rp2.StateMachine(1, opentherm_tx, freq=PIO_TX_FREQ, set_base=machine.Pin(tx_pin), out_base=machine.Pin(tx_pin))
+        self.sm_tx.irq(lambda sm: self.tx_done.set())
+        self.sm_rx = rp2.StateMachine(5, opentherm_rx_decode, freq=PIO_RX_FREQ, in_base=machine.Pin(rx_pin), jmp_pin=machine.Pin(rx_pin))
+        self.sm_rx.irq(lambda sm: _capture(sm, self.ring))
+        self.sm_rx.put(PIO_RX_FRAME_BITS - 1)
+        self.sm_rx.active(1)
+        thermostat_port = self
+
+    def close(self):
+        """Stop both state machines, so init_rx() may switch sm_opentherm_rx back to RX_RAW."""
+        global thermostat_port
+        self.sm_tx.active(0)
+        self.sm_rx.active(0)
+        self.sm_rx.irq(None)
+        if thermostat_port is self:
+            thermostat_port = None
+
+    async def receive(self) -> tuple[int, int, int, int]:
+        """The next request as (ticks_ms at its end, msg_type, data_id, data_value).
+
+        Will raise ValueError if it didn't decode.
+        """
+        async for t_us, frame, flags in self.ring:
+            # when it ended, going by ticks_ms
+            received_ms = ticks_add(ticks_ms(), -(ticks_diff(ticks_us(), t_us) // 1000))
+            if flags & FLAG_DECODE:
+                raise ValueError("Manchester decoding error")
+            return (received_ms,) + frame_decode(frame)
+
+    async def reply(self, msg_type: int, data_id: int, data_value: int):
+        m_hi, m_lo = frame_encode_manchester(msg_type, data_id, data_value, invert=True)  # Invert for TX hardware
+        self.sm_tx.active(0)
+        self.tx_done.clear()
+        self.sm_tx.put(m_hi)
+        self.sm_tx.put(m_lo)
+        self.sm_tx.restart()
+        self.sm_tx.active(1)
+        try:
+            await asyncio.wait_for_ms(self.tx_done.wait(), TX_TIMEOUT_MS)
+        except asyncio.TimeoutError:
+            raise Exception("Timeout waiting for transmit")
+        finally:
+            self.sm_tx.active(0)
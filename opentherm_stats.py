@@ -0,0 +1,117 @@
+from array import array
+from opentherm_retry import FAIL_NAMES
+
+
+# histogram bucket upper bounds (ms), shared by all three timings; one more bucket catches anything over.
+# TX is ~34ms; OT spec 4.3.1 gives the slave 20-400ms to answer (800ms in v2.2).
+BUCKETS_MS = (30, 40, 50, 75, 100, 150, 200, 250, 300, 350, 400, 600, 800)
+N_BUCKETS = len(BUCKETS_MS) + 1
+
+# the histograms kept per data ID
+HIST_TX = 0  # sending the request
+HIST_LATENCY = 1  # end of the request to the end of the slave's response, less the response frame itself
+HIST_TOTAL = 2  # the whole exchange, as the caller saw it
+HIST_NAMES = ("tx", "latency", "total")
+
+# counters kept per data ID: one per opentherm_retry failure class, then retries
+COUNT_RETRIES = len(FAIL_NAMES)
+COUNTER_NAMES = FAIL_NAMES + ("retries",)
+
+# data IDs tracked separately; any beyond this share the last slot
+MAX_IDS = 40
+
+
+def bucket(ms: int) -> int:
+    """The index of the histogram bucket ms falls in."""
+    i = 0
+    for limit in BUCKETS_MS:
+        if ms <= limit:
+            return i
+        i += 1
+    return i
+
+
+class ExchangeStats:
+    """Per data ID timing histograms and error counters for OpenTherm exchanges.
+
+    Everything lives in arrays allocated up front: recording a sample is a
+    few index increments, and a data ID is given its slot the first time it's
+    seen. IDs past max_ids are lumped together under "other".
+
+        stats = ExchangeStats()
+        stats.record(0, tx_ms=34, latency_ms=85, total_ms=160)
+        stats.failed(0, FAIL_TIMEOUT)
+        stats.snapshot()  # {"0": {"tx": [...], ..., "timeout": 1, ...}, ...}
+    """
+
+    def __init__(self, max_ids: int = MAX_IDS):
+        self.max_ids = max_ids
+        self._ids = bytearray(max_ids)  # data ID in each slot
+        self._slots = bytearray(256)  # data ID: slot + 1, or 0 if it hasn't got one
+        self._used = 0
+        self._hist = array('I', bytes(4 * (max_ids + 1) * len(HIST_NAMES) * N_BUCKETS))
+        self._counts = array('I', bytes(4 * (max_ids + 1) * len(COUNTER_NAMES)))
+
+    def _slot(self, data_id: int) -> int:
+        slot = self._slots[data_id]
+        if slot:
+            return slot - 1
+        if self._used >= self.max_ids:
+            return self.max_ids
+        slot = self._used
+        self._used += 1
+        self._ids[slot] = data_id
+        self._slots[data_id] = slot + 1
+        return slot
+
+    def record(self, data_id: int, tx_ms: int, latency_ms: int, total_ms: int):
+        """Record a completed exchange; a timing that wasn't measured is passed as -1."""
+        base = self._slot(data_id) * len(HIST_NAMES) * N_BUCKETS
+        if tx_ms >= 0:
+            self._hist[base + HIST_TX * N_BUCKETS + bucket(tx_ms)] += 1
+        if latency_ms >= 0:
+            self._hist[base + HIST_LATENCY * N_BUCKETS + bucket(latency_ms)] += 1
+        if total_ms >= 0:
+            self._hist[base + HIST_TOTAL * N_BUCKETS + bucket(total_ms)] += 1
+
+    def failed(self, data_id: int, failure: int):
+        """Count a failed exchange, by opentherm_retry failure class."""
+        self._counts[self._slot(data_id) * len(COUNTER_NAMES) + failure] += 1
+
+    def retried(self, data_id: int):
+        self._counts[self._slot(data_id) * len(COUNTER_NAMES) + COUNT_RETRIES] += 1
+
+    def histogram(self, data_id: int, hist: int) -> list:
+        """The bucket counts of one of data_id's histograms (HIST_TX, HIST_LATENCY or HIST_TOTAL)."""
+        base = (self._slot(data_id) * len(HIST_NAMES) + hist) * N_BUCKETS
+        return list(self._hist[base:base + N_BUCKETS])
+
+    def count(self, data_id: int, counter: int) -> int:
+        """One of data_id's counters: a failure class, or COUNT_RETRIES."""
+        return self._counts[self._slot(data_id) * len(COUNTER_NAMES) + counter]
+
+    def _slot_dict(self, slot: int) -> dict:
+        result = {}
+        base = slot * len(HIST_NAMES) * N_BUCKETS
+        for hist, name in enumerate(HIST_NAMES):
+            start = base + hist * N_BUCKETS
+            result[name] = list(self._hist[start:start + N_BUCKETS])
+        base = slot * len(COUNTER_NAMES)
+        for counter, name in enumerate(COUNTER_NAMES):
+            result[name] = self._counts[base + counter]
+        return result
+
+    def snapshot(self) -> dict:
+        """Everything recorded, keyed by data ID as a string, ready for json.dumps."""
+        result = {}
+        for slot in range(self._used):
+            result[str(self._ids[slot])] = self._slot_dict(slot)
+        if self._used >= self.max_ids:
+            result["other"] = self._slot_dict(self.max_ids)
+        return result
+
+    def reset(self):
+        for i in range(len(self._hist)):
+            self._hist[i] = 0
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
@@ -0,0 +1,265 @@
+"""
+Software OpenTherm boiler (slave) for running the controller on the host.
+
+BoilerSim.opentherm_exchange has the signature of opentherm_rp2.opentherm_exchange,
+so it can stand in for the PIO driver anywhere above the wire:
+
+    sim = BoilerSim(timeout_rate=0.02, parity_rate=0.01)
+    opentherm_app.opentherm_exchange = sim.opentherm_exchange
+
+Replies go through the same frame/Manchester code as on the Pico, so injected
+parity and decode errors surface exactly as the driver would raise them. Time
+is taken from lib.ticks_ms() and asyncio sleeps, so the simulator runs in real
+time or, under sim.host's virtual clock, as fast as the CPU allows.
+
+Host only: not deployed to the Pico.
+"""
+
+import asyncio
+import random
+
+from lib import ticks_ms, ticks_diff, frame_encode, manchester_encode, decode_manchester_frame
+
+
+MSG_TYPE_READ_DATA = 0
+MSG_TYPE_WRITE_DATA = 1
+MSG_TYPE_READ_ACK = 4
+MSG_TYPE_WRITE_ACK = 5
+MSG_TYPE_DATA_INVALID = 6
+MSG_TYPE_UNKNOWN_DATA_ID = 7
+
+# a frame is 34 bits (start, 32 data, stop) at 1ms a bit
+FRAME_MS = 34
+# OT spec 4.3.1: the slave answers 20-400ms after the end of the request
+LATENCY_MS = (20, 400)
+
+# data IDs an OT v2.2 boiler typically doesn't implement
+DEFAULT_UNSUPPORTED = (35,)
+
+
+def _f88(value: float) -> int:
+    return int(round(value * 256)) & 0xffff
+
+
+def _u8_u8(hb: int, lb: int) -> int:
+    return ((hb & 0xff) << 8) | (lb & 0xff)
+
+
+class BoilerModel:
+    """A combi boiler heating a radiator circuit, with a simple lumped thermal model.
+
+    The flame comes on when CH is enabled and the flow is below TSet, modulating
+    in proportion to the shortfall; DHW demand (a tap running) takes priority.
+    Water loses heat to the room in proportion to the temperature difference.
+    """
+
+    ROOM_C = 18.0
+    CAPACITY_KW = 24
+    MIN_MODULATION = 20
+    WATER_KJ_PER_C = 200.0  # ~50l of water in the circuit
+    LOSS_KW_PER_C = 0.25
+    HYSTERESIS_C = 5.0
+
+    def __init__(self):
+        self.flow_c = self.ROOM_C
+        self.return_c = self.ROOM_C
+        self.exhaust_c = self.ROOM_C
+        self.dhw_c = 45.0
+        self.pressure_bar = 1.5
+        self.dhw_flow_lpm = 0.0
+        self.modulation = 0.0
+        self.flame = False
+        self.ch_enabled = False
+        self.dhw_enabled = True
+        self.tset_c = 10.0
+        self.dhw_setpoint_c = 55.0
+        self.max_modulation = 100.0
+        self.fault_flags = 0  # high byte of ID 5, e.g. 0x04 for low water pressure
+        self.oem_fault_code = 0
+        self.power_cycles = 7
+        self.burner_starts = 1200
+
+    @property
+    def dhw_active(self) -> bool:
+        return self.dhw_enabled and self.dhw_flow_lpm > 0
+
+    @property
+    def ch_active(self) -> bool:
+        return self.ch_enabled and not self.dhw_active
+
+    def step(self, dt_s: float):
+        if self.fault_flags:
+            demand = 0.0
+        elif self.dhw_active:
+            demand = max(self.dhw_setpoint_c - self.dhw_c, 0.0) * 10
+        elif self.ch_enabled:
+            shortfall = self.tset_c - self.flow_c
+            if self.flame:
+                demand = shortfall * 10 if shortfall > -self.HYSTERESIS_C / 2 else 0.0
+            else:
+                demand = shortfall * 10 if shortfall > self.HYSTERESIS_C else 0.0
+        else:
+            demand = 0.0
+
+        flame = demand > 0
+        if flame and not self.flame:
+            self.burner_starts += 1
+        self.flame = flame
+        if flame:
+            self.modulation = min(max(demand, self.MIN_MODULATION), self.max_modulation)
+        else:
+            self.modulation = 0.0
+
+        power_kw = self.CAPACITY_KW * self.modulation / 100
+        if self.dhw_active:
+            # heat goes to the tap water, coming in cold at 10C
+            tap_c = 10 + power_kw / (4.2 * self.dhw_flow_lpm / 60)
+            self.dhw_c += (tap_c - self.dhw_c) * min(dt_s / 10, 1.0)
+            power_kw = 0
+        else:
+            self.dhw_c += (self.ROOM_C - self.dhw_c) * 0.0005 * dt_s
+
+        loss_kw = self.LOSS_KW_PER_C * (self.flow_c - self.ROOM_C)
+        self.flow_c += (power_kw - loss_kw) * dt_s / self.WATER_KJ_PER_C
+        drop = 4.0 + power_kw / 2 if self.ch_active else 0.0
+        self.return_c = max(self.flow_c - drop, self.ROOM_C)
+        target_exhaust = self.return_c + 15 if flame else self.ROOM_C
+        self.exhaust_c += (target_exhaust - self.exhaust_c) * min(dt_s / 30, 1.0)
+
+    def fan_hz(self) -> float:
+        return 25 + self.modulation * 0.5 if self.flame else 0
+
+    def status_flags(self) -> int:
+        flags = 0
+        if self.fault_flags:
+            flags |= 0x01
+        if self.ch_active:
+            flags |= 0x02
+        if self.dhw_active:
+            flags |= 0x04
+        if self.flame:
+            flags |= 0x08
+        return flags
+
+
+class BoilerSim:
+    """A software boiler answering OpenTherm requests from a BoilerModel.
+
+    Args:
+        latency_ms: (min, max) response latency, picked uniformly per conversation
+        timeout_rate: fraction of requests that go unanswered
+        parity_rate: fraction of replies with a bit flipped on the wire
+        decode_rate: fraction of replies with a Manchester violation
+        unsupported: data IDs answered with UNKNOWN-DATAID
+        seed: for a repeatable run
+    """
+
+    def __init__(self, latency_ms=LATENCY_MS, timeout_rate: float = 0.0, parity_rate: float = 0.0,
+                 decode_rate: float = 0.0, unsupported=DEFAULT_UNSUPPORTED, seed=None):
+        self.latency_ms = latency_ms
+        self.timeout_rate = timeout_rate
+        self.parity_rate = parity_rate
+        self.decode_rate = decode_rate
+        self.unsupported = set(unsupported)
+        self.model = BoilerModel()
+        self.random = random.Random(seed)
+        self.requests = {}  # data_id: count
+        self.injected = dict(timeout=0, parity=0, decode=0)
+        self._last_step = None
+
+        m = self.model
+        # data_id: (read, write) - read returns the 16 bit reply, write applies the request's value.
+        # Writable IDs echo what was written; anything not in here is UNKNOWN-DATAID.
+        self.table = {
+            0: (lambda v: (v & 0xff00) | m.status_flags(), self._set_master_status),
+            1: (lambda v: _f88(m.tset_c), lambda v: setattr(m, 'tset_c', v / 256)),
+            2: (None, lambda v: None),
+            3: (lambda v: 0x0100, None),  # DHW present, modulating, member ID 0
+            5: (lambda v: (m.fault_flags << 8) | m.oem_fault_code, None),
+            6: (lambda v: 0x0303, None),  # DHW and max CH setpoints transferable and read/write
+            14: (lambda v: _f88(m.max_modulation), lambda v: setattr(m, 'max_modulation', v / 256)),
+            15: (lambda v: _u8_u8(m.CAPACITY_KW, m.MIN_MODULATION), None),
+            17: (lambda v: _f88(m.modulation), None),
+            18: (lambda v: _f88(m.pressure_bar), None),
+            19: (lambda v: _f88(m.dhw_flow_lpm), None),
+            25: (lambda v: _f88(m.flow_c), None),
+            26: (lambda v: _f88(m.dhw_c), None),
+            28: (lambda v: _f88(m.return_c), None),
+            33: (lambda v: int(round(m.exhaust_c)) & 0xffff, None),
+            35: (lambda v: int(m.fan_hz()) & 0xff, None),
+            48: (lambda v: _u8_u8(65, 35), None),  # DHW setpoint bounds: upper, lower
+            49: (lambda v: _u8_u8(80, 20), None),  # max CH setpoint bounds
+            56: (lambda v: _f88(m.dhw_setpoint_c), lambda v: setattr(m, 'dhw_setpoint_c', v / 256)),
+            57: (lambda v: _f88(80), lambda v: None),
+            97: (lambda v: m.power_cycles, None),
+            116: (lambda v: m.burner_starts & 0xffff, None),
+            125: (lambda v: _f88(2.2), None),
+            126: (None, lambda v: None),
+            127: (lambda v: _u8_u8(1, 3), None),
+        }
+
+    def _set_master_status(self, value: int):
+        self.model.ch_enabled = bool(value & 0x0100)
+        self.model.dhw_enabled = bool(value & 0x0200)
+
+    def advance(self):
+        """Run the thermal model up to now."""
+        now = ticks_ms()
+        if self._last_step is not None:
+            dt_ms = ticks_diff(now, self._last_step)
+            while dt_ms > 0:
+                # small steps keep the explicit integration stable
+                step_ms = min(dt_ms, 1000)
+                self.model.step(step_ms / 1000)
+                dt_ms -= step_ms
+        self._last_step = now
+
+    def respond(self, msg_type: int, data_id: int, data_value: int) -> tuple[int, int, int]:
+        """The reply to a request, without any timing or line errors."""
+        self.advance()
+        entry = self.table.get(data_id)
+        if entry is None or data_id in self.unsupported:
+            return MSG_TYPE_UNKNOWN_DATA_ID, data_id, data_value
+
+        read, write = entry
+        if msg_type == MSG_TYPE_READ_DATA:
+            if read is None:
+                return MSG_TYPE_UNKNOWN_DATA_ID, data_id, data_value
+            # ID 0 is a read that carries the master status
+            if data_id == 0:
+                write(data_value)
+            return MSG_TYPE_READ_ACK, data_id, read(data_value) & 0xffff
+
+        if msg_type == MSG_TYPE_WRITE_DATA:
+            if write is None:
+                return MSG_TYPE_UNKNOWN_DATA_ID, data_id, data_value
+            write(data_value)
+            return MSG_TYPE_WRITE_ACK, data_id, data_value
+
+        return MSG_TYPE_DATA_INVALID, data_id, data_value
+
+    async def opentherm_exchange(self, msg_type: int, data_id: int, data_value: int, timeout_ms: int = 1000) -> tuple[int, int, int]:
+        self.requests[data_id] = self.requests.get(data_id, 0) + 1
+
+        # the request going out
+        await asyncio.sleep(FRAME_MS / 1000)
+
+        rnd = self.random
+        latency = rnd.randint(self.latency_ms[0], self.latency_ms[1])
+        if rnd.random() < self.timeout_rate or latency + FRAME_MS > timeout_ms:
+            self.injected['timeout'] += 1
+            await asyncio.sleep((20 + timeout_ms) / 1000)
+            raise Exception("Timeout waiting for response")
+        await asyncio.sleep((latency + FRAME_MS) / 1000)
+
+        frame = frame_encode(*self.respond(msg_type, data_id, data_value))
+        if rnd.random() < self.parity_rate:
+            self.injected['parity'] += 1
+            frame ^= 1 << rnd.randint(0, 30)
+        mframe = manchester_encode(frame)
+        if rnd.random() < self.decode_rate:
+            self.injected['decode'] += 1
+            # both halves of one bit the same
+            bit = rnd.randint(0, 31) * 2
+            mframe = (mframe & ~(3 << bit)) | (3 << bit)
+        return decode_manchester_frame(mframe >> 32, mframe & 0xffffffff)
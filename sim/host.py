@@ -0,0 +1,327 @@
+"""
+Runs main.py end-to-end on the host against a BoilerSim, in virtual time.
+
+The event loop's clock (and lib.ticks_ms(), via time.monotonic_ns) is virtual:
+whenever every task is waiting, time jumps straight to the next timer instead
+of sleeping. An hour of boiler control runs in seconds, and runs with the same
+seed are repeatable. CPU time is free in this world, so it measures protocol
+behaviour - cadence, bus throughput, retries - not Pico performance.
+
+The MicroPython-only modules main.py imports (network, rp2, utime, cfgsecrets)
+are replaced by stand-ins, and MQTT goes to a FakeMQTTClient that records what
+was published and can deliver commands.
+
+Run with:  python -m sim.host --minutes 60 --timeout-rate 0.02 --parity-rate 0.01
+"""
+
+import asyncio
+import contextlib
+import math
+import selectors
+import sys
+import tempfile
+import time
+import traceback
+import types
+
+from sim.boiler_sim import BoilerSim
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now_ns = 0
+
+    def monotonic(self) -> float:
+        return self.now_ns / 1e9
+
+    def monotonic_ns(self) -> int:
+        return self.now_ns
+
+    def advance(self, seconds: float):
+        # round up, or a timer a fraction of a ns away would never come due
+        self.now_ns += max(math.ceil(seconds * 1e9), 0)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events:
+            if timeout is None:
+                raise RuntimeError("Deadlock: every task is waiting and no timer is pending")
+            self.clock.advance(timeout)
+        return events
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """An event loop that never sleeps: idle time is skipped on its VirtualClock."""
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self) -> float:
+        return self.clock.monotonic()
+
+
+class FakeMQTTClient:
+    """Records publishes in place of AsyncMQTTClient; deliver() plays a command to the callback."""
+
+    instances = []
+
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0, **kwargs):
+        self.client_id = client_id
+        self.published = []  # (ticks_ms, topic, payload)
+        self.retained = {}  # topic: payload, as the broker would keep them
+        self.subscriptions = []
+        self.inbox = []
+        self.cb = None
+        FakeMQTTClient.instances.append(self)
+
+    async def connect(self, clean_session=True):
+        return 0
+
+    async def disconnect(self):
+        pass
+
+    def set_callback(self, f):
+        self.cb = f
+
+    async def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        self.published.append((time.ticks_ms(), topic, msg))
+        if retain:
+            self.retained[topic] = msg
+
+    async def publish_many(self, messages, retain=False):
+        count = 0
+        for topic, msg in messages:
+            await self.publish(topic, msg, retain)
+            count += 1
+        return count
+
+    async def publish_string(self, topic, msg, retain=False, qos=0, encoding='utf-8'):
+        await self.publish(topic, msg.encode(encoding), retain, qos)
+
+    def deliver(self, topic: str, msg: bytes):
+        self.inbox.append((topic, msg))
+
+    async def check_msg(self):
+        if self.inbox and self.cb:
+            topic, msg = self.inbox.pop(0)
+            # views, as AsyncMQTTClient hands over its receive buffer
+            self.cb(memoryview(topic.encode()), memoryview(msg))
+
+
+async def _sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+def _fake_modules() -> dict:
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.WLAN = lambda interface: None
+    rp2 = types.ModuleType("rp2")
+    rp2.country = lambda code: None
+    cfgsecrets = types.ModuleType("cfgsecrets")
+    cfgsecrets.WIFI_SSID = cfgsecrets.WIFI_PASSWORD = cfgsecrets.MQTT_HOST = "sim"
+    return dict(network=network, rp2=rp2, utime=time, cfgsecrets=cfgsecrets)
+
+
+@contextlib.contextmanager
+def install(clock: VirtualClock):
+    """Patch in virtual time and the MicroPython stand-ins; yields a freshly imported main."""
+    import lib
+
+    saved_modules = {name: sys.modules.get(name) for name in list(_fake_modules()) + ["main"]}
+    saved_time = {name: getattr(time, name, None) for name in ("monotonic_ns", "ticks_ms", "ticks_diff", "ticks_add")}
+    saved_sleep_ms = getattr(asyncio, "sleep_ms", None)
+    saved_print_exception = getattr(sys, "print_exception", None)
+    try:
+        sys.modules.update(_fake_modules())
+        sys.modules.pop("main", None)
+        time.monotonic_ns = clock.monotonic_ns
+        time.ticks_ms = lib.ticks_ms
+        time.ticks_diff = lib.ticks_diff
+        time.ticks_add = lib.ticks_add
+        asyncio.sleep_ms = _sleep_ms
+        # like MicroPython's, defaults to stdout
+        sys.print_exception = lambda ex, file=None: traceback.print_exception(ex, file=file or sys.stdout)
+
+        import main
+        yield main
+
+    finally:
+        for name, module in saved_modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        for name, value in saved_time.items():
+            if value is None:
+                delattr(time, name)
+            else:
+                setattr(time, name, value)
+        if saved_sleep_ms is None:
+            del asyncio.sleep_ms
+        else:
+            asyncio.sleep_ms = saved_sleep_ms
+        if saved_print_exception is None:
+            del sys.print_exception
+        else:
+            sys.print_exception = saved_print_exception
+
+
+class Run:
+    """The outcome of run(): what went over the wire and out over MQTT."""
+
+    def __init__(self, sim, main, mqtt, retry_policy, log, duration_s):
+        self.sim = sim
+        self.main = main
+        self.mqtt = mqtt
+        self.retry_policy = retry_policy
+        self.log = log  # (start_ms, end_ms, msg_type, data_id, result or exception)
+        self.duration_s = duration_s
+
+    def status_intervals(self) -> list:
+        starts = [start for start, _, _, data_id, _ in self.log if data_id == 0]
+        return [b - a for a, b in zip(starts, starts[1:])]
+
+    def report(self) -> dict:
+        intervals = self.status_intervals()
+        latencies = sorted(end - start for start, end, _, _, _ in self.log)
+        failures = sum(1 for entry in self.log if isinstance(entry[4], Exception))
+        return dict(
+            duration_s=self.duration_s,
+            conversations=len(self.log),
+            conversations_per_s=len(self.log) / self.duration_s,
+            failures=failures,
+            status_interval_max_ms=max(intervals) if intervals else None,
+            status_interval_mean_ms=sum(intervals) / len(intervals) if intervals else None,
+            latency_p50_ms=latencies[len(latencies) // 2] if latencies else None,
+            latency_max_ms=latencies[-1] if latencies else None,
+            requests=dict(sorted(self.sim.requests.items())),
+            injected=self.sim.injected,
+            retries=self.retry_policy.stats(),
+            mqtt_publishes=len(self.mqtt.published) if self.mqtt else 0,
+        )
+
+
+def run(sim: BoilerSim, duration_s: float, setup=None, quiet: bool = True) -> Run:
+    """Run main.main() against sim for duration_s of virtual time.
+
+    setup, if given, is called as setup(main, sim) on the running loop once
+    everything is patched in, e.g. to turn on CH or start a task that injects
+    a fault or an MQTT command later on.
+    """
+    import lib
+    import opentherm_app
+    from opentherm_bus import OpenThermBus
+    from opentherm_retry import RetryPolicy
+
+    clock = VirtualClock()
+    log = []
+    retry_policy = RetryPolicy()
+
+    async def exchange(msg_type, data_id, data_value, timeout_ms=1000):
+        start = lib.ticks_ms()
+        try:
+            result = await sim.opentherm_exchange(msg_type, data_id, data_value, timeout_ms)
+        except Exception as ex:
+            log.append((start, lib.ticks_ms(), msg_type, data_id, ex))
+            raise
+        log.append((start, lib.ticks_ms(), msg_type, data_id, result))
+        return result
+
+    saved = dict(opentherm_exchange=opentherm_app.opentherm_exchange, bus=opentherm_app.bus,
+                 retry_policy=opentherm_app.retry_policy, capabilities=opentherm_app.capabilities)
+    saved_syslog = lib.syslog.flush
+    FakeMQTTClient.instances = []
+    with tempfile.TemporaryDirectory() as tmp, install(clock) as main:
+        try:
+            opentherm_app.opentherm_exchange = exchange
+            opentherm_app.bus = OpenThermBus(opentherm_app._exchange)
+            opentherm_app.retry_policy = retry_policy
+            main.AsyncMQTTClient = FakeMQTTClient
+            main.capabilities.path = f"{tmp}/otcaps.json"
+            # syslog goes to stdout only
+            lib.syslog.flush = lambda limit=0: _discard(lib.syslog, limit)
+
+            async def runner():
+                if setup is not None:
+                    setup(main, sim)
+                task = asyncio.create_task(main.main())
+                await asyncio.sleep(duration_s)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+            loop = VirtualTimeLoop(clock)
+            try:
+                out = contextlib.redirect_stdout(_NullWriter()) if quiet else contextlib.nullcontext()
+                with out:
+                    loop.run_until_complete(runner())
+            finally:
+                loop.close()
+
+        finally:
+            for name, value in saved.items():
+                setattr(opentherm_app, name, value)
+            lib.syslog.flush = saved_syslog
+
+    mqtt = FakeMQTTClient.instances[-1] if FakeMQTTClient.instances else None
+    return Run(sim, main, mqtt, retry_policy, log, duration_s)
+
+
+def _discard(syslog, limit):
+    # formatted and printed as usual, just not sent
+    sent = 0
+    while syslog._count and (not limit or sent < limit):
+        syslog._take()
+        sent += 1
+    return sent
+
+
+class _NullWriter:
+    def write(self, s):
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def _main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Run picotherm against a simulated boiler in virtual time")
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--parity-rate", type=float, default=0.0)
+    parser.add_argument("--decode-rate", type=float, default=0.0)
+    parser.add_argument("--latency", type=int, nargs=2, default=[20, 400], metavar=("MIN_MS", "MAX_MS"))
+    parser.add_argument("--ch-setpoint", type=float, default=65.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    sim = BoilerSim(latency_ms=tuple(args.latency), timeout_rate=args.timeout_rate, parity_rate=args.parity_rate,
+                    decode_rate=args.decode_rate, seed=args.seed)
+
+    def setup(main, sim):
+        main.boiler_values.boiler_ch_enabled = True
+        main.boiler_values.boiler_flow_temperature_setpoint = args.ch_setpoint
+
+    started = time.perf_counter()
+    result = run(sim, args.minutes * 60, setup=setup, quiet=not args.verbose)
+    report = result.report()
+    report["wall_s"] = round(time.perf_counter() - started, 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
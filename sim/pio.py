@@ -0,0 +1,635 @@
+"""
+Cycle-level emulator for RP2040 PIO programs, for checking opentherm_rp2's
+programs on the host.
+
+asm_pio() assembles a program the way MicroPython's rp2.asm_pio does: the
+decorated function is run with the PIO instructions as its globals. It can be
+installed as rp2.asm_pio before importing opentherm_rp2:
+
+    rp2 = fake_rp2.make_rp2()
+    rp2.asm_pio = pio.asm_pio
+    with fake_rp2.install(rp2):
+        import opentherm_rp2          # opentherm_tx/opentherm_rx are now Programs
+
+StateMachine runs a Program one clock cycle at a time at its own frequency,
+honouring delays, stalls (wait, blocking pull, autopull/autopush against the
+4-deep FIFOs) and IRQ flags. State machines share a GPIO, which records every
+edge with its time and can be driven by an external waveform, so several
+machines on different clocks (e.g. TX at 4kHz into RX at 60kHz) are run
+together in time order by run().
+
+Only the instructions and options the OpenTherm programs need are implemented:
+jmp, wait, in, out, push, pull, mov, irq, set and nop, with delays, wrap and
+side-set (on pins, as MicroPython's asm_pio has it: not optional, so an
+instruction without .side() drives the side-set pins to 0).
+
+Host only: not deployed to the Pico.
+"""
+
+import bisect
+
+from lib import manchester_encode
+
+
+FIFO_DEPTH = 4
+SHIFT_LEFT = 0
+SHIFT_RIGHT = 1
+OUT_LOW = 0
+OUT_HIGH = 1
+
+_MASK32 = 0xffffffff
+
+
+# instruction operands, as named in MicroPython's asm_pio
+class _Operand:
+    def __init__(self, name: str, value=None):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return self.name
+
+
+x = _Operand("x")
+y = _Operand("y")
+pins = _Operand("pins")
+pin = _Operand("pin")
+pindirs = _Operand("pindirs")
+gpio = _Operand("gpio")
+null = _Operand("null")
+isr = _Operand("isr")
+osr = _Operand("osr")
+pc = _Operand("pc")
+status = _Operand("status")
+block = _Operand("block")
+noblock = _Operand("noblock")
+iffull = _Operand("iffull")
+ifempty = _Operand("ifempty")
+clear = _Operand("clear")
+x_dec = _Operand("x_dec")
+y_dec = _Operand("y_dec")
+not_x = _Operand("not_x")
+not_y = _Operand("not_y")
+x_not_y = _Operand("x_not_y")
+not_osre = _Operand("not_osre")
+
+
+def rel(index: int) -> _Operand:
+    return _Operand("rel", index)
+
+
+def invert(src: _Operand) -> _Operand:
+    return _Operand("invert", src)
+
+
+def reverse(src: _Operand) -> _Operand:
+    return _Operand("reverse", src)
+
+
+class Instruction:
+    def __init__(self, op: str, *args):
+        self.op = op
+        self.args = args
+        self.delay = 0
+        self.side_value = 0
+
+    def __getitem__(self, delay: int):
+        # MicroPython syntax for a delay: nop() [3]
+        if not 0 <= delay <= 31:
+            raise ValueError(f"Delay {delay} out of range")
+        self.delay = delay
+        return self
+
+    def side(self, value: int):
+        # MicroPython syntax for side-set: nop().side(1) [3]; the range is checked by asm_pio()
+        self.side_value = value
+        return self
+
+    def __repr__(self):
+        side = f".side({self.side_value})" if self.side_value else ""
+        delay = f" [{self.delay}]" if self.delay else ""
+        return f"{self.op}({', '.join(repr(a) for a in self.args)}){side}{delay}"
+
+
+class Program:
+    """An assembled PIO program: instructions, resolved labels and the asm_pio() options."""
+
+    def __init__(self, name: str, instructions: list, labels: dict, wrap_target: int, wrap: int, config: dict):
+        self.name = name
+        self.instructions = instructions
+        self.labels = labels
+        self.wrap_target = wrap_target
+        self.wrap = wrap
+        self.config = config
+
+    def __len__(self):
+        return len(self.instructions)
+
+
+class _Assembler:
+    def __init__(self):
+        self.instructions = []
+        self.labels = {}
+        self.wrap_target = None
+        self.wrap = None
+
+    def emit(self, op, *args):
+        ins = Instruction(op, *args)
+        self.instructions.append(ins)
+        return ins
+
+    def label(self, name):
+        if name in self.labels:
+            raise ValueError(f"Duplicate label {name}")
+        self.labels[name] = len(self.instructions)
+
+    def globals(self) -> dict:
+        emit = self.emit
+
+        def jmp(cond, target=None):
+            if target is None:
+                cond, target = None, cond
+            return emit("jmp", cond, target)
+
+        def wait(polarity, src, index):
+            return emit("wait", polarity, src, index)
+
+        def pull(*flags):
+            return emit("pull", ifempty in flags, noblock not in flags)
+
+        def push(*flags):
+            return emit("push", iffull in flags, noblock not in flags)
+
+        def irq(mode, index=None):
+            if index is None:
+                mode, index = None, mode
+            return emit("irq", mode, index)
+
+        def wrap_target():
+            self.wrap_target = len(self.instructions)
+
+        def wrap():
+            self.wrap = len(self.instructions) - 1
+
+        names = dict(
+            jmp=jmp, wait=wait, pull=pull, push=push, irq=irq, wrap_target=wrap_target, wrap=wrap,
+            label=self.label, rel=rel, invert=invert, reverse=reverse,
+            in_=lambda src, bits: emit("in", src, bits),
+            out=lambda dst, bits: emit("out", dst, bits),
+            mov=lambda dst, src: emit("mov", dst, src),
+            set=lambda dst, value: emit("set", dst, value),
+            nop=lambda: emit("mov", y, y),
+        )
+        for operand in (x, y, pins, pin, pindirs, gpio, null, isr, osr, pc, status, block, noblock, iffull, ifempty,
+                        clear, x_dec, y_dec, not_x, not_y, x_not_y, not_osre):
+            names[operand.name] = operand
+        return names
+
+
+def asm_pio(set_init=None, out_init=None, sideset_init=None, in_shiftdir=SHIFT_LEFT, out_shiftdir=SHIFT_LEFT,
+            autopush=False, autopull=False, push_thresh=32, pull_thresh=32, fifo_join=0):
+    """Assemble the decorated function into a Program, like rp2.asm_pio."""
+    config = dict(set_init=set_init, out_init=out_init, sideset_init=sideset_init, in_shiftdir=in_shiftdir,
+                  out_shiftdir=out_shiftdir, autopush=autopush, autopull=autopull, push_thresh=push_thresh,
+                  pull_thresh=pull_thresh)
+    # side-set takes its bits from the 5 the delay is encoded in
+    sideset_count = _pin_count(sideset_init) if sideset_init is not None else 0
+    delay_max = 31 >> sideset_count
+
+    def decorator(fn):
+        asm = _Assembler()
+        program_globals = dict(fn.__globals__)
+        program_globals.update(asm.globals())
+        exec(fn.__code__, program_globals)
+
+        if len(asm.instructions) > 32:
+            raise ValueError(f"{fn.__name__}: {len(asm.instructions)} instructions, PIO memory holds 32")
+        for ins in asm.instructions:
+            if ins.side_value and not sideset_count:
+                raise ValueError(f"{fn.__name__}: {ins!r} uses side-set, but asm_pio() has no sideset_init")
+            if not 0 <= ins.side_value < 1 << sideset_count:
+                raise ValueError(f"{fn.__name__}: {ins!r}: side-set value out of range for {sideset_count} pins")
+            if ins.delay > delay_max:
+                raise ValueError(f"{fn.__name__}: {ins!r}: delay out of range with {sideset_count} side-set pins")
+            if ins.op == "jmp":
+                if ins.args[1] not in asm.labels:
+                    raise ValueError(f"{fn.__name__}: unknown label {ins.args[1]}")
+                ins.args = (ins.args[0], asm.labels[ins.args[1]])
+        wrap_target = asm.wrap_target or 0
+        wrap = asm.wrap if asm.wrap is not None else len(asm.instructions) - 1
+        return Program(fn.__name__, asm.instructions, asm.labels, wrap_target, wrap, config)
+    return decorator
+
+
+class GPIO:
+    """Pin levels over time, shared by the state machines and any external signal.
+
+    A pin's level comes from, in order: an external waveform given to drive(),
+    another pin given to link() (optionally inverted, like a line driver), or
+    the last value a state machine wrote. Writes are logged in edges.
+    """
+
+    def __init__(self):
+        self.now_ns = 0
+        self._levels = {}
+        self._waveforms = {}
+        self._links = {}
+        self.edges = {}  # pin: [(t_ns, level)] for every change written by a state machine
+
+    def drive(self, pin: int, transitions, initial: int = 0):
+        """Drive pin externally: transitions is a sorted list of (t_ns, level)."""
+        times = [t for t, _ in transitions]
+        self._waveforms[pin] = (times, [level for _, level in transitions], initial)
+
+    def link(self, dst: int, src: int, invert: bool = False):
+        """dst reads whatever src is driven to, e.g. a loopback wire."""
+        self._links[dst] = (src, invert)
+
+    def level(self, pin: int, t_ns: int = None) -> int:
+        if t_ns is None:
+            t_ns = self.now_ns
+        waveform = self._waveforms.get(pin)
+        if waveform is not None:
+            times, levels, initial = waveform
+            i = bisect.bisect_right(times, t_ns)
+            return levels[i - 1] if i else initial
+        link = self._links.get(pin)
+        if link is not None:
+            return self.level(link[0], t_ns) ^ link[1]
+        return self._levels.get(pin, 0)
+
+    def write(self, pin: int, level: int, t_ns: int):
+        level &= 1
+        if self._levels.get(pin) != level:
+            self._levels[pin] = level
+            self.edges.setdefault(pin, []).append((t_ns, level))
+
+
+def frame_waveform(frame: int, start_ns: int, half_bit_ns: int = 500_000, jitter=None) -> list:
+    """GPIO.drive() transitions for an OpenTherm frame as it arrives at the RX pin.
+
+    That's the start bit, 32 Manchester-encoded bits and the stop bit. jitter,
+    if given, is called with each half-bit's index and returns an offset in ns
+    for the edge that starts it.
+    """
+    halves = [1, 0]
+    mframe = manchester_encode(frame)
+    for i in range(63, -1, -1):
+        halves.append((mframe >> i) & 1)
+    halves += [1, 0]
+
+    transitions = []
+    for i, level in enumerate(halves):
+        if not transitions or transitions[-1][1] != level:
+            transitions.append((start_ns + i * half_bit_ns + (jitter(i) if jitter else 0), level))
+    transitions.append((start_ns + len(halves) * half_bit_ns, 0))
+    return transitions
+
+
+def _pin_count(init) -> int:
+    return len(init) if isinstance(init, tuple) else 1
+
+
+def _pin_number(p):
+    if p is None or isinstance(p, int):
+        return p
+    return p.id
+
+
+class StateMachine:
+    """An emulated PIO state machine, with the rp2.StateMachine methods opentherm_rp2 uses.
+
+    Pins may be given as numbers or as objects with an id (like machine.Pin).
+    irq_flags can be shared between machines in the same PIO block.
+    """
+
+    def __init__(self, id: int, program: Program = None, freq: int = 125_000_000, in_base=None, out_base=None,
+                 set_base=None, jmp_pin=None, sideset_base=None, gpio: GPIO = None, irq_flags: list = None):
+        self.id = id
+        self.gpio = gpio or GPIO()
+        self.irq_flags = irq_flags if irq_flags is not None else [0] * 8
+        self.handler = None
+        self.is_active = False
+        self.x = 0
+        self.y = 0
+        self.tx = []
+        self.rx = []
+        self.cycles = 0  # cycles run since the machine was last activated
+        self._start_ns = 0
+        self.instructions_run = 0
+        self.stall_cycles = 0
+        self.trace = None  # set to a list to record (t_ns, pc) for every instruction executed
+        self._irq_raised = False
+        if program is not None:
+            self.init(program, freq, in_base, out_base, set_base, jmp_pin, sideset_base)
+
+    def init(self, program: Program, freq: int, in_base=None, out_base=None, set_base=None, jmp_pin=None,
+             sideset_base=None):
+        self.program = program
+        self.freq = freq
+        self.in_base = _pin_number(in_base)
+        self.out_base = _pin_number(out_base)
+        self.set_base = _pin_number(set_base)
+        self.jmp_pin = _pin_number(jmp_pin)
+        self.sideset_base = _pin_number(sideset_base)
+
+        # like MicroPython, set/out drive as many pins as set_init/out_init list (one if not a tuple)
+        config = program.config
+        self.set_count = _pin_count(config['set_init'])
+        self.out_count = _pin_count(config['out_init'])
+        self.sideset_count = _pin_count(config['sideset_init']) if config['sideset_init'] is not None else 0
+        for base, init in ((self.set_base, config['set_init']), (self.out_base, config['out_init']),
+                           (self.sideset_base, config['sideset_init'])):
+            if base is not None and init is not None:
+                for i, level in enumerate(init if isinstance(init, tuple) else (init,)):
+                    self.gpio.write(base + i, level, self.gpio.now_ns)
+        self.restart()
+
+    # rp2.StateMachine interface
+
+    def active(self, value=None):
+        if value is None:
+            return self.is_active
+        if value and not self.is_active:
+            self._start_ns = self.gpio.now_ns
+            self.cycles = 0
+        self.is_active = bool(value)
+
+    def restart(self):
+        self.pc = self.program.wrap_target
+        self.isr = 0
+        self.isr_count = 0
+        self.osr = 0
+        self.osr_count = 32  # empty
+        self._delay = 0
+
+    def put(self, value):
+        if len(self.tx) >= FIFO_DEPTH:
+            raise OverflowError("TX FIFO full")
+        self.tx.append(value & _MASK32)
+
+    def get(self):
+        return self.rx.pop(0)
+
+    def rx_fifo(self) -> int:
+        return len(self.rx)
+
+    def tx_fifo(self) -> int:
+        return len(self.tx)
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+    # emulation
+
+    def next_ns(self) -> int:
+        """Time at which this machine's next cycle starts."""
+        return self._start_ns + self.cycles * 1_000_000_000 // self.freq
+
+    def step(self):
+        """Run one clock cycle."""
+        now = self.next_ns()
+        self.gpio.now_ns = now
+        self.cycles += 1
+        if self._delay:
+            self._delay -= 1
+            return
+
+        pc = self.pc
+        ins = self.program.instructions[pc]
+        if self.sideset_count and self.sideset_base is not None:
+            # as the instruction issues, whether or not it then stalls
+            for i in range(self.sideset_count):
+                self.gpio.write(self.sideset_base + i, (ins.side_value >> i) & 1, now)
+        if not self._execute(ins, now):
+            self.stall_cycles += 1
+            return
+        self.instructions_run += 1
+        if self.trace is not None:
+            self.trace.append((now, pc))
+        self._delay = ins.delay
+        # like a soft IRQ handler on the Pico, it runs once the instruction is done
+        if self._irq_raised:
+            self._irq_raised = False
+            if self.handler is not None:
+                self.handler(self)
+
+    def _advance(self):
+        if self.pc == self.program.wrap:
+            self.pc = self.program.wrap_target
+        else:
+            self.pc += 1
+
+    def _pin(self, base, index=0) -> int:
+        return self.gpio.level(base + index)
+
+    def _read(self, src, bits=32) -> int:
+        name = src.name
+        if name == "x":
+            return self.x
+        if name == "y":
+            return self.y
+        if name == "null":
+            return 0
+        if name == "isr":
+            return self.isr
+        if name == "osr":
+            return self.osr
+        if name == "pins":
+            value = 0
+            for i in range(bits):
+                value |= self.gpio.level(self.in_base + i) << i
+            return value
+        if name == "status":
+            return _MASK32 if len(self.tx) < 1 else 0
+        if name == "invert":
+            return ~self._read(src.value, bits) & _MASK32
+        if name == "reverse":
+            value = self._read(src.value, bits)
+            return int(f"{value:032b}"[::-1], 2)
+        raise NotImplementedError(f"source {name}")
+
+    def _write(self, dst, value: int, bits: int, base, now: int):
+        name = dst.name
+        if name == "x":
+            self.x = value & _MASK32
+        elif name == "y":
+            self.y = value & _MASK32
+        elif name == "pins":
+            for i in range(bits):
+                self.gpio.write(base + i, (value >> i) & 1, now)
+        elif name == "isr":
+            self.isr = value & _MASK32
+            self.isr_count = bits
+        elif name == "osr":
+            self.osr = value & _MASK32
+            self.osr_count = 0
+        elif name == "pc":
+            self.pc = value
+            return False
+        elif name in ("null", "pindirs"):
+            pass
+        else:
+            raise NotImplementedError(f"destination {name}")
+        return True
+
+    def _execute(self, ins: Instruction, now: int) -> bool:
+        # returns False if the instruction stalled (it's retried next cycle)
+        op = ins.op
+        config = self.program.config
+
+        if op == "jmp":
+            cond, target = ins.args
+            name = cond.name if cond is not None else None
+            if name is None:
+                taken = True
+            elif name == "x_dec":
+                taken = self.x != 0
+                self.x = (self.x - 1) & _MASK32
+            elif name == "y_dec":
+                taken = self.y != 0
+                self.y = (self.y - 1) & _MASK32
+            elif name == "not_x":
+                taken = self.x == 0
+            elif name == "not_y":
+                taken = self.y == 0
+            elif name == "x_not_y":
+                taken = self.x != self.y
+            elif name == "pin":
+                taken = self._pin(self.jmp_pin) == 1
+            elif name == "not_osre":
+                taken = self.osr_count < config['pull_thresh']
+            else:
+                raise NotImplementedError(f"jmp condition {name}")
+            if taken:
+                self.pc = target
+            else:
+                self._advance()
+            return True
+
+        if op == "wait":
+            polarity, src, index = ins.args
+            if src.name == "gpio":
+                ok = self._pin(index) == polarity
+            elif src.name == "pin":
+                ok = self._pin(self.in_base, index) == polarity
+            elif src.name == "irq":
+                ok = self.irq_flags[index] == polarity
+                if ok and polarity:
+                    self.irq_flags[index] = 0
+            else:
+                raise NotImplementedError(f"wait source {src.name}")
+            if ok:
+                self._advance()
+            return ok
+
+        if op == "in":
+            src, bits = ins.args
+            if config['autopush'] and self.isr_count + bits >= config['push_thresh'] and len(self.rx) >= FIFO_DEPTH:
+                return False
+            data = self._read(src, bits) & ((1 << bits) - 1)
+            if config['in_shiftdir'] == SHIFT_LEFT:
+                self.isr = ((self.isr << bits) | data) & _MASK32
+            else:
+                self.isr = (self.isr >> bits) | (data << (32 - bits)) if bits < 32 else data
+            self.isr_count = min(self.isr_count + bits, 32)
+            if config['autopush'] and self.isr_count >= config['push_thresh']:
+                self.rx.append(self.isr)
+                self.isr = 0
+                self.isr_count = 0
+            self._advance()
+            return True
+
+        if op == "out":
+            dst, bits = ins.args
+            if config['autopull'] and self.osr_count >= config['pull_thresh']:
+                if not self.tx:
+                    return False
+                self.osr = self.tx.pop(0)
+                self.osr_count = 0
+            if config['out_shiftdir'] == SHIFT_LEFT:
+                data = self.osr >> (32 - bits)
+                self.osr = (self.osr << bits) & _MASK32
+            else:
+                data = self.osr & ((1 << bits) - 1)
+                self.osr >>= bits
+            self.osr_count = min(self.osr_count + bits, 32)
+            if self._write(dst, data, bits, self.out_base, now):
+                self._advance()
+            return True
+
+        if op == "pull":
+            if_empty, blocking = ins.args
+            if not (if_empty and self.osr_count < config['pull_thresh']):
+                if self.tx:
+                    self.osr = self.tx.pop(0)
+                elif blocking:
+                    return False
+                else:
+                    self.osr = self.x
+                self.osr_count = 0
+            self._advance()
+            return True
+
+        if op == "push":
+            if_full, blocking = ins.args
+            if not (if_full and self.isr_count < config['push_thresh']):
+                if len(self.rx) >= FIFO_DEPTH:
+                    if blocking:
+                        return False
+                else:
+                    self.rx.append(self.isr)
+                self.isr = 0
+                self.isr_count = 0
+            self._advance()
+            return True
+
+        if op == "mov":
+            dst, src = ins.args
+            # unlike out, mov leaves the ISR's shift counter empty
+            if self._write(dst, self._read(src), 0 if dst.name == "isr" else 32, self.out_base, now):
+                self._advance()
+            return True
+
+        if op == "set":
+            dst, value = ins.args
+            self._write(dst, value, self.set_count if dst.name == "pins" else 5, self.set_base, now)
+            self._advance()
+            return True
+
+        if op == "irq":
+            mode, index = ins.args
+            if isinstance(index, _Operand):
+                # rel(n): relative to this machine's number within its block
+                index = (index.value + self.id) % 4
+            if mode is not None and mode.name == "clear":
+                self.irq_flags[index] = 0
+            else:
+                self.irq_flags[index] = 1
+                self._irq_raised = True
+            self._advance()
+            return True
+
+        raise NotImplementedError(f"instruction {op}")
+
+
+def run(machines, until_ns: int, stop=None) -> int:
+    """Run the active machines in time order until until_ns, or until stop() is true after a cycle.
+
+    Returns the time reached. Machines share machines[0].gpio, whose now_ns is advanced as they run.
+    """
+    gpio = machines[0].gpio
+    while True:
+        active = [sm for sm in machines if sm.is_active]
+        if not active:
+            gpio.now_ns = max(gpio.now_ns, until_ns)
+            return gpio.now_ns
+        sm = min(active, key=StateMachine.next_ns)
+        t = sm.next_ns()
+        if t >= until_ns:
+            gpio.now_ns = until_ns
+            return until_ns
+        gpio.now_ns = t
+        sm.step()
+        if stop is not None and stop():
+            return t
@@ -0,0 +1,81 @@
+"""
+Software room thermostat (OpenTherm master), for running the gateway on the host.
+
+ThermostatSim has the interface of opentherm_rp2.ThermostatPort, so it can
+stand in for the slave-side PIO port:
+
+    thermostat = ThermostatSim([(0, 0, 0x0300), (1, 1, 40 * 256), (0, 25, 0)])
+    gateway = Gateway(thermostat, BoilerSim().opentherm_exchange)
+
+It plays its script of requests in a loop, like a thermostat's cyclic
+messages: each goes out the inter-message gap after the previous reply, or
+once the previous request has timed out unanswered. What it got back, and
+how long it took, is recorded in `conversations`.
+
+Host only: not deployed to the Pico.
+"""
+
+import asyncio
+
+from lib import ticks_ms, ticks_diff
+
+
+# a frame is 34 bits (start, 32 data, stop) at 1ms a bit
+FRAME_MS = 34
+# OT spec 4.3.1: master waits 100ms between conversations, and gives up on the slave after 800ms
+GAP_MS = 100
+TIMEOUT_MS = 800
+
+
+class ThermostatSim:
+    """A thermostat cycling through a script of (msg_type, data_id, data_value) requests.
+
+    A None in the script is a request garbled on the line, which receive()
+    raises as ValueError like the port would.
+    """
+
+    def __init__(self, script, gap_ms: int = GAP_MS, timeout_ms: int = TIMEOUT_MS):
+        self.script = list(script)
+        self.gap_ms = gap_ms
+        self.timeout_ms = timeout_ms
+        self.conversations = []  # (request, reply or None, ms from the end of the request to the reply)
+        self._next = 0
+        self._pending = None  # (request, ticks_ms at its end)
+        self._last_end = None
+
+    async def receive(self) -> tuple[int, int, int, int]:
+        if self._pending is not None:
+            # not answered: the thermostat waits out its timeout
+            request, sent_ms = self._pending
+            self._pending = None
+            self.conversations.append((request, None, None))
+            wait = self.timeout_ms - ticks_diff(ticks_ms(), sent_ms)
+            if wait > 0:
+                await asyncio.sleep(wait / 1000)
+            self._last_end = ticks_ms()
+
+        if self._last_end is not None:
+            wait = self.gap_ms - ticks_diff(ticks_ms(), self._last_end)
+            if wait > 0:
+                await asyncio.sleep(wait / 1000)
+
+        request = self.script[self._next % len(self.script)]
+        self._next += 1
+        await asyncio.sleep(FRAME_MS / 1000)
+        if request is None:
+            self._last_end = ticks_ms()
+            raise ValueError("Manchester decoding error")
+        self._pending = (request, ticks_ms())
+        return (ticks_ms(),) + tuple(request)
+
+    async def reply(self, msg_type: int, data_id: int, data_value: int):
+        request, sent_ms = self._pending
+        self._pending = None
+        latency = ticks_diff(ticks_ms(), sent_ms)
+        await asyncio.sleep(FRAME_MS / 1000)
+        self._last_end = ticks_ms()
+        if latency > self.timeout_ms:
+            # too late: the thermostat had already given up on it
+            self.conversations.append((request, None, None))
+        else:
+            self.conversations.append((request, (msg_type, data_id, data_value), latency))
@@ -0,0 +1,104 @@
+from array import array
+from lib import ticks_ms, ticks_diff
+from boiler_state import FIRST_INT, FIRST_FLAG, fields
+
+
+# non-urgent changes are batched up and published at most this often
+PUBLISH_INTERVAL_MS = 1000
+# every topic is published at least this often, changed or not, so a restarted broker or HA catches up
+HEARTBEAT_MS = 5 * 60 * 1000
+
+_ON = b'ON'
+_OFF = b'OFF'
+
+
+class StatePublisher:
+    """Publishes BoilerValues fields to their MQTT state topics when they change.
+
+    topics maps a field number to (state topic, deadband). A number is only
+    published again once it has moved at least deadband from the value last
+    published; a boolean whenever it flips. Changes are collected and sent
+    at most every interval_ms, except for fields in the urgent mask (e.g.
+    faults, or a setting HA just asked for), which go out on the next
+    publish() call. Every heartbeat_ms all topics are published regardless.
+
+    publish() is cheap when there is nothing to send, so call it every time
+    round the MQTT loop:
+
+        publisher = StatePublisher(boiler_values, {BOILER_CH_PRESSURE: ("boiler/pressure", 0.05)})
+        ...
+        await publisher.publish(mqc)
+    """
+
+    def __init__(self, values, topics: dict, urgent: int = 0, interval_ms: int = PUBLISH_INTERVAL_MS,
+                 heartbeat_ms: int = HEARTBEAT_MS):
+        self.values = values
+        self.topics = topics
+        self.urgent = urgent
+        self.interval_ms = interval_ms
+        self.heartbeat_ms = heartbeat_ms
+        self.consumer = values.consumer()
+        self.published = 0
+        self._mask = 0
+        for field in topics:
+            self._mask |= 1 << field
+        self._sent = array('f', bytes(4 * FIRST_FLAG))  # value last published, for the deadbands
+        self._unsent = self._mask  # fields to publish next time whatever their deadband
+        self._last = None
+        self._heartbeat = None
+        self._batch = []  # (topic, payload) going out in this call's publish_many()
+
+    def reset(self):
+        """Publish everything on the next call, e.g. after (re)connecting."""
+        self._heartbeat = None
+
+    def force(self, mask: int):
+        """Publish these fields on the next call, changed or not, e.g. to acknowledge a command."""
+        mask &= self._mask
+        self.values.mark(self.consumer, mask)
+        self._unsent |= mask
+
+    async def publish(self, mqc) -> int:
+        """Publish whatever is due in one publish_many(), returning how many messages that took."""
+        now = ticks_ms()
+        values = self.values
+        if self._heartbeat is None or ticks_diff(now, self._heartbeat) >= self.heartbeat_ms:
+            self._heartbeat = now
+            self.force(self._mask)
+
+        pending = values.changes(self.consumer) & self._mask
+        if not pending:
+            return 0
+        if not (pending & (self.urgent | self._unsent)) and self._last is not None and \
+                ticks_diff(now, self._last) < self.interval_ms:
+            return 0
+        values.take(self.consumer, pending)
+        self._last = now
+
+        batch = self._batch
+        for field in fields(pending):
+            topic, deadband = self.topics[field]
+            value = values.get(field)
+            bit = 1 << field
+            if deadband and not (self._unsent & bit) and abs(value - self._sent[field]) < deadband:
+                continue
+            batch.append((topic, _payload(field, value)))
+            if field < FIRST_FLAG:
+                self._sent[field] = value
+            self._unsent &= ~bit
+        if not batch:
+            return 0
+        try:
+            count = await mqc.publish_many(batch)
+        finally:
+            batch.clear()
+        self.published += count
+        return count
+
+
+def _payload(field: int, value) -> bytes:
+    if field >= FIRST_FLAG:
+        return _ON if value else _OFF
+    if field >= FIRST_INT:
+        return str(value).encode()
+    return str(round(value, 2)).encode()
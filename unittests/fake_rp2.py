@@ -0,0 +1,202 @@
+"""
+CPython stand-ins for the MicroPython rp2/machine modules and asyncio extras.
+
+Only the surface opentherm_rp2 uses is provided. Tests drive the "hardware" by
+setting FakeStateMachine.on_active, which is called whenever a state machine is
+switched on, and by calling push()/fire_irq() to emulate the PIO program.
+
+Use install() as a context manager around importing opentherm_rp2:
+
+    with fake_rp2.install():
+        import opentherm_rp2
+"""
+
+import asyncio
+import contextlib
+import sys
+import types
+
+
+class FakeStateMachine:
+    def __init__(self, id, program=None, **kwargs):
+        self.id = id
+        self.program = program
+        self.kwargs = kwargs
+        self.is_active = False
+        self.restarts = 0
+        self.tx = []  # words put() by the CPU
+        self.rx = []  # words available to get()
+        self.handler = None
+        self.on_active = None
+
+    def init(self, program, **kwargs):
+        self.program = program
+        self.kwargs = kwargs
+
+    def active(self, value=None):
+        if value is None:
+            return self.is_active
+        self.is_active = bool(value)
+        if self.is_active and self.on_active:
+            self.on_active(self)
+
+    def restart(self):
+        self.restarts += 1
+
+    def put(self, value):
+        self.tx.append(value & 0xffffffff)
+
+    def get(self, buf=None):
+        if buf is None:
+            return self.rx.pop(0)
+        # like MicroPython's, fills buf with a word per item
+        for i in range(len(buf)):
+            buf[i] = self.rx.pop(0)
+
+    def rx_fifo(self):
+        return len(self.rx)
+
+    def tx_fifo(self):
+        return len(self.tx)
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+    # test hooks emulating the PIO program
+    def push(self, *words):
+        self.rx.extend(w & 0xffffffff for w in words)
+
+    def fire_irq(self):
+        if self.handler:
+            self.handler(self)
+
+
+class FakeDMA:
+    """rp2.DMA: records each triggered transfer as the words read."""
+
+    def __init__(self):
+        self.transfers = []
+        self.is_active = False
+        self.write = None
+        self.ctrl = None
+
+    def pack_ctrl(self, **kwargs):
+        return kwargs
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        self.write = write
+        self.ctrl = ctrl
+        if trigger:
+            self.transfers.append(list(read[:count]))
+
+    def active(self, value=None):
+        if value is None:
+            return self.is_active
+        self.is_active = bool(value)
+
+    def close(self):
+        pass
+
+
+class FakePin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+
+
+class FakePIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    IN_LOW = 0
+    IN_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+    removed = []  # programs passed to remove_program(), across all blocks
+
+    def __init__(self, id):
+        self.id = id
+
+    def remove_program(self, program=None):
+        FakePIO.removed.append((self.id, program))
+
+
+def asm_pio(**kwargs):
+    def decorator(fn):
+        return (fn, kwargs)
+    return decorator
+
+
+class ThreadSafeFlag:
+    """asyncio.ThreadSafeFlag: wait() returns once set and clears the flag."""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await asyncio.wait_for(aw, timeout / 1000)
+
+
+def make_rp2(dma=False):
+    """The rp2 module, with rp2.DMA only if dma (like firmware before 1.22 otherwise)."""
+    rp2 = types.ModuleType("rp2")
+    rp2.StateMachine = FakeStateMachine
+    rp2.PIO = FakePIO
+    rp2.asm_pio = asm_pio
+    if dma:
+        rp2.DMA = FakeDMA
+    return rp2
+
+
+def make_machine():
+    machine = types.ModuleType("machine")
+    machine.Pin = FakePin
+    return machine
+
+
+@contextlib.contextmanager
+def install(rp2=None, machine=None):
+    """Install the fakes, forgetting any modules imported against them on exit."""
+    saved_modules = {k: sys.modules.get(k) for k in ("rp2", "machine", "opentherm_rp2")}
+    saved_asyncio = {k: getattr(asyncio, k, None) for k in ("ThreadSafeFlag", "sleep_ms", "wait_for_ms")}
+
+    sys.modules["rp2"] = rp2 or make_rp2()
+    sys.modules["machine"] = machine or make_machine()
+    sys.modules.pop("opentherm_rp2", None)
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    asyncio.sleep_ms = sleep_ms
+    asyncio.wait_for_ms = wait_for_ms
+    try:
+        yield sys.modules["rp2"]
+    finally:
+        for k, v in saved_modules.items():
+            if v is None:
+                sys.modules.pop(k, None)
+            else:
+                sys.modules[k] = v
+        for k, v in saved_asyncio.items():
+            if v is None:
+                if hasattr(asyncio, k):
+                    delattr(asyncio, k)
+            else:
+                setattr(asyncio, k, v)
@@ -5,7 +5,7 @@ import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
 import struct
 
-from async_mqtt_client import AsyncMQTTClient, MQTTException
+from async_mqtt_client import AsyncMQTTClient, MQTTException, TOPIC_CACHE_SIZE
 
 
 class TestAsyncMQTTClientInit(unittest.TestCase):
@@ -126,6 +126,195 @@ class TestAsyncMQTTClientPublish(unittest.IsolatedAsyncioTestCase):
         self.assertIn("Message too long", str(ctx.exception))
 
 
+class RecordingWriter:
+    """Collects what's written, packet boundaries and all, and counts drains."""
+
+    def __init__(self):
+        self.writes = []
+        self.drains = 0
+
+    def write(self, buf):
+        self.writes.append(bytes(buf))
+
+    async def drain(self):
+        self.drains += 1
+
+
+class FakeReader:
+    """Hands out the chunks it's given, one per read, as far as the buffer allows."""
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+        self.reads = 0
+
+    async def readinto(self, buf):
+        self.reads += 1
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        n = min(len(chunk), len(buf))
+        buf[:n] = chunk[:n]
+        if n < len(chunk):
+            self.chunks.insert(0, chunk[n:])
+        return n
+
+    async def readexactly(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.chunks.pop(0)
+            want = n - len(data)
+            data += chunk[:want]
+            if len(chunk) > want:
+                self.chunks.insert(0, chunk[want:])
+        return data
+
+
+def publish_packet(topic, msg, qos=0, pid=1):
+    body = struct.pack("!H", len(topic)) + topic + (struct.pack("!H", pid) if qos else b"") + msg
+    return bytes([0x30 | qos << 1]) + encode_length(len(body)) + body
+
+
+def encode_length(sz):
+    out = b""
+    while sz > 0x7f:
+        out += bytes([(sz & 0x7f) | 0x80])
+        sz >>= 7
+    return out + bytes([sz])
+
+
+class TestAsyncMQTTClientPublishMany(unittest.IsolatedAsyncioTestCase):
+    """Test batched publishing"""
+
+    MESSAGES = [("home/temp", b"23.5"), ("home/config", b"{" + b"x" * 200 + b"}"), ("h", b"")]
+
+    async def individually(self, messages, retain=False):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+        for topic, msg in messages:
+            await client.publish(topic, msg, retain)
+        return b"".join(client._writer.writes)
+
+    async def test_same_bytes_one_write(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+
+        self.assertEqual(await client.publish_many(self.MESSAGES, retain=True), 3)
+        self.assertEqual(client._writer.writes, [await self.individually(self.MESSAGES, retain=True)])
+        self.assertEqual(client._writer.drains, 1)
+        # the 202 byte payload needs a two byte remaining length
+        self.assertEqual(client._writer.writes[0][17:20], b"\x31\xd7\x01")
+
+    async def test_chunks_when_full(self):
+        client = AsyncMQTTClient("test_client", "localhost", batch_size=64)
+        client._writer = RecordingWriter()
+        messages = [(f"home/sensor{i}", b"12.5") for i in range(10)]  # 20 bytes apiece
+
+        self.assertEqual(await client.publish_many(messages), 10)
+        self.assertEqual([len(w) for w in client._writer.writes], [60, 60, 60, 20])
+        self.assertEqual(client._writer.drains, 4)
+        self.assertEqual(b"".join(client._writer.writes), await self.individually(messages))
+
+    async def test_oversize_message_on_its_own(self):
+        client = AsyncMQTTClient("test_client", "localhost", batch_size=64)
+        client._writer = RecordingWriter()
+
+        self.assertEqual(await client.publish_many(self.MESSAGES), 3)
+        self.assertEqual(b"".join(client._writer.writes), await self.individually(self.MESSAGES))
+        self.assertEqual(client._writer.drains, 3)
+
+    async def test_nothing_to_send(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+        self.assertEqual(await client.publish_many([]), 0)
+        self.assertEqual(client._writer.writes, [])
+        self.assertEqual(client._writer.drains, 0)
+
+    async def test_requires_bytes(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+        with self.assertRaises(TypeError):
+            await client.publish_many([("test/topic", "test message")])
+
+
+class TestAsyncMQTTClientPackets(unittest.IsolatedAsyncioTestCase):
+    """Test the packets built in the send buffer, byte for byte"""
+
+    def connect_packet(self, client, clean_session=True):
+        return bytes(client._sbuf[:client._pack_connect(clean_session)])
+
+    def test_connect(self):
+        client = AsyncMQTTClient("pico", "localhost", keepalive=60)
+        self.assertEqual(self.connect_packet(client),
+                         b"\x10\x10\x00\x04MQTT\x04\x02\x00\x3c\x00\x04pico")
+
+    def test_connect_with_auth_and_will(self):
+        client = AsyncMQTTClient("pico", "localhost", user="u", password="pw")
+        client.set_last_will("dead", b"x", retain=True, qos=1)
+        self.assertEqual(self.connect_packet(client, clean_session=False),
+                         b"\x10\x20\x00\x04MQTT\x04\xec\x00\x00\x00\x04pico"
+                         b"\x00\x04dead\x00\x01x\x00\x01u\x00\x02pw")
+
+    def test_connect_too_long(self):
+        client = AsyncMQTTClient("pico", "localhost", batch_size=32)
+        client.set_last_will("dead", b"x" * 32)
+        with self.assertRaises(MQTTException):
+            client._pack_connect(True)
+
+    async def test_publish_one_write(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+        await client.publish("a/b", b"on", retain=True)
+        self.assertEqual(client._writer.writes, [b"\x31\x07\x00\x03a/bon"])
+
+    async def test_publish_writes_from_send_buffer(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = MagicMock()
+        client._writer.drain = AsyncMock()
+        await client.publish("a/b", b"on")
+        await client.publish_many([("a/b", b"on"), ("c/d", b"off")])
+        # views onto the one buffer, no packet copies
+        for call in client._writer.write.call_args_list:
+            self.assertIs(call.args[0].obj, client._sbuf)
+
+    async def test_publish_payload_bigger_than_buffer(self):
+        client = AsyncMQTTClient("test_client", "localhost", batch_size=64)
+        client._writer = RecordingWriter()
+        payload = b"x" * 200
+        await client.publish("a/b", payload)
+        # the header from the send buffer, the payload as it was given
+        self.assertEqual(client._writer.writes, [b"\x30\xcd\x01\x00\x03a/b", payload])
+        self.assertEqual(client._writer.drains, 1)
+
+    async def test_topics_encoded_once(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+        await client.publish("a/b", b"1")
+        encoded = client._topics["a/b"]
+        await client.publish_many([("a/b", b"2")])
+        self.assertIs(client._topics["a/b"], encoded)
+        # packed with its length prefix, ready to copy into a packet
+        self.assertEqual(encoded, b"\x00\x03a/b")
+        self.assertEqual(client._topic(b"raw/topic"), b"\x00\x09raw/topic")
+        self.assertNotIn(b"raw/topic", client._topics)
+
+    async def test_topic_cache_bounded(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._writer = RecordingWriter()
+        for i in range(TOPIC_CACHE_SIZE + 10):
+            await client.publish(f"topic/{i}", b"")
+        self.assertEqual(len(client._topics), TOPIC_CACHE_SIZE)
+        self.assertEqual(client._writer.writes[-1], b"\x30\x0a\x00\x08topic/73")
+
+    async def test_subscribe(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client.set_callback(lambda topic, msg: None)
+        client._writer = RecordingWriter()
+        client._reader = FakeReader(b"\x90\x03\x00\x01\x01")
+
+        await client.subscribe("a/b", qos=1)
+        self.assertEqual(client._writer.writes, [b"\x82\x08\x00\x01\x00\x03a/b\x01"])
+
+
 class TestAsyncMQTTClientSubscribe(unittest.IsolatedAsyncioTestCase):
     """Test AsyncMQTTClient subscribe method"""
 
@@ -146,20 +335,24 @@ class TestAsyncMQTTClientSubscribe(unittest.IsolatedAsyncioTestCase):
         client._writer = MagicMock()
         client._writer.write = MagicMock()
         client._writer.drain = AsyncMock()
-        client._reader = AsyncMock()
-
-        # Mock _wait_msg_internal to return SUBACK
-        async def mock_wait_msg():
-            return 0x90  # SUBACK
-        client._wait_msg_internal = mock_wait_msg
-
-        # Mock readexactly for SUBACK response
-        client._reader.readexactly = AsyncMock(return_value=b"\x00\x00\x00\x00")
+        # SUBACK
+        client._reader = FakeReader(b"\x90\x03\x00\x01\x00")
 
         await client.subscribe("test/topic", qos=0)
         self.assertTrue(client._writer.write.called)
         self.assertTrue(client._writer.drain.called)
 
+    async def test_publish_before_suback_handled(self):
+        received = []
+        client = AsyncMQTTClient("test_client", "localhost")
+        client.set_callback(lambda topic, msg: received.append((bytes(topic), bytes(msg))))
+        client._writer = RecordingWriter()
+        # a retained message on the topic can beat the SUBACK
+        client._reader = FakeReader(publish_packet(b"test/topic", b"retained") + b"\x90\x03\x00\x01\x00")
+
+        await client.subscribe("test/topic")
+        self.assertEqual(received, [(b"test/topic", b"retained")])
+
 
 class TestAsyncMQTTClientCallback(unittest.IsolatedAsyncioTestCase):
     """Test MQTT callback handling"""
@@ -174,41 +367,66 @@ class TestAsyncMQTTClientCallback(unittest.IsolatedAsyncioTestCase):
 
         client.set_callback(test_callback)
 
-        # Mock reader to return PUBLISH packet
-        client._reader = AsyncMock()
         client._writer = MagicMock()
         client._writer.write = MagicMock()
         client._writer.drain = AsyncMock()
-
-        # Simulate PUBLISH packet: topic "test/topic", message b"hello"
-        topic_bytes = b"test/topic"
-        msg_bytes = b"hello"
-
-        # PUBLISH packet structure: [opcode, remaining_length, topic_len_msb, topic_len_lsb, topic, message]
-        async def mock_readexactly(n):
-            if n == 1:
-                return b"\x30"  # PUBLISH with QoS 0
-            elif n == 2:
-                return struct.pack("!H", len(topic_bytes))
-            elif n == len(topic_bytes):
-                return topic_bytes
-            elif n == len(msg_bytes):
-                return msg_bytes
-            else:
-                return b"\x00" * n
-
-        client._reader.readexactly = mock_readexactly
-
-        # Mock _recv_len to return message size
-        async def mock_recv_len():
-            return 2 + len(topic_bytes) + len(msg_bytes)
-        client._recv_len = mock_recv_len
+        client._reader = FakeReader(publish_packet(b"test/topic", b"hello"))
 
         await client.wait_msg()
 
-        # Check callback was called with decoded topic and raw message bytes
+        # Check callback was called with views of the topic and message
         self.assertEqual(len(received), 1)
-        self.assertEqual(received[0], ("test/topic", b"hello"))
+        topic, msg = received[0]
+        self.assertIsInstance(msg, memoryview)
+        self.assertEqual((str(topic, 'utf-8'), bytes(msg)), ("test/topic", b"hello"))
+
+    async def test_several_packets_one_read(self):
+        received = []
+        client = AsyncMQTTClient("test_client", "localhost")
+        client.set_callback(lambda topic, msg: received.append((str(topic, 'utf-8'), bytes(msg))))
+        client._writer = RecordingWriter()
+        client._reader = FakeReader(publish_packet(b"a", b"1") + b"\xd0\x00" + publish_packet(b"b", b"2", qos=1, pid=7))
+        client.sock = MagicMock()
+
+        self.assertEqual(await client.wait_msg(), 0x30)
+        # the rest are already in the buffer: no poll, no read
+        with patch("async_mqtt_client.select") as select_mock:
+            self.assertIsNone(await client.check_msg())
+            self.assertEqual(await client.check_msg(), 0x32)
+            select_mock.poll.assert_not_called()
+        self.assertEqual(client._reader.reads, 1)
+        self.assertEqual(received, [("a", b"1"), ("b", b"2")])
+        # QoS 1 acknowledged
+        self.assertEqual(client._writer.writes, [b"\x40\x02\x00\x07"])
+
+    async def test_packet_split_across_reads(self):
+        received = []
+        client = AsyncMQTTClient("test_client", "localhost")
+        client.set_callback(lambda topic, msg: received.append((str(topic, 'utf-8'), bytes(msg))))
+        packet = publish_packet(b"home/topic", b"x" * 200)
+        # split inside the remaining length, then the topic
+        client._reader = FakeReader(packet[:2], packet[2:8], packet[8:])
+
+        await client.wait_msg()
+        self.assertEqual(received, [("home/topic", b"x" * 200)])
+        self.assertEqual(client._reader.reads, 3)
+
+    async def test_packet_bigger_than_buffer(self):
+        received = []
+        client = AsyncMQTTClient("test_client", "localhost", recv_size=64)
+        client.set_callback(lambda topic, msg: received.append((str(topic, 'utf-8'), bytes(msg))))
+        big = publish_packet(b"big", bytes(range(256)) * 2)
+        client._reader = FakeReader(publish_packet(b"small", b"1") + big + publish_packet(b"after", b"2"))
+
+        for _ in range(3):
+            await client.wait_msg()
+        self.assertEqual(received, [("small", b"1"), ("big", bytes(range(256)) * 2), ("after", b"2")])
+
+    async def test_connection_closed(self):
+        client = AsyncMQTTClient("test_client", "localhost")
+        client._reader = FakeReader()
+        with self.assertRaises(OSError):
+            await client.wait_msg()
 
 
 class TestAsyncMQTTClientPing(unittest.IsolatedAsyncioTestCase):
@@ -228,18 +446,7 @@ class TestAsyncMQTTClientPing(unittest.IsolatedAsyncioTestCase):
 
     async def test_wait_msg_handles_pingresp(self):
         client = AsyncMQTTClient("test_client", "localhost")
-        client._reader = AsyncMock()
-
-        # Simulate PINGRESP packet
-        async def mock_readexactly(n):
-            if n == 1:
-                if not hasattr(mock_readexactly, 'called'):
-                    mock_readexactly.called = True
-                    return b"\xd0"  # PINGRESP
-                return b"\x00"
-            return b"\x00"
-
-        client._reader.readexactly = mock_readexactly
+        client._reader = FakeReader(b"\xd0\x00")
 
         result = await client.wait_msg()
         self.assertIsNone(result)
@@ -0,0 +1,157 @@
+"""Tests for main.boiler_loop's steady state: it mustn't allocate memory cycle after cycle"""
+
+import asyncio
+import gc
+import unittest
+
+import lib
+import opentherm_app
+from opentherm_bus import OpenThermBus
+from opentherm_retry import RetryPolicy
+from opentherm_stats import ExchangeStats
+from sim import host
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# steady-state cycles measured, after a warm-up
+CYCLES = 200
+# what a cycle may allocate: the coroutine objects and (msg_type, data_id, value)
+# tuples of its two conversations, and nothing else
+CYCLE_ALLOC_BYTES = 4096
+
+
+class FakeBoiler:
+    """An instant opentherm_exchange, its replies allocated up front."""
+
+    def __init__(self, status: int = 0x0a):  # CH active, flame on
+        self.replies = {
+            (opentherm_app.MSG_TYPE_READ_DATA, opentherm_app.DATA_ID_STATUS): (opentherm_app.MSG_TYPE_READ_ACK, opentherm_app.DATA_ID_STATUS, 0x0300 | status),
+            (opentherm_app.MSG_TYPE_WRITE_DATA, opentherm_app.DATA_ID_TSET): (opentherm_app.MSG_TYPE_WRITE_ACK, opentherm_app.DATA_ID_TSET, 60 * 256),
+        }
+        self.calls = 0
+
+    async def opentherm_exchange(self, msg_type, data_id, data_value, timeout_ms=1000):
+        self.calls += 1
+        return self.replies[(msg_type, data_id)]
+
+
+class TestBoilerLoopAllocation(unittest.TestCase):
+
+    def setUp(self):
+        self.boiler = FakeBoiler()
+        saved = dict(opentherm_exchange=opentherm_app.opentherm_exchange, bus=opentherm_app.bus,
+                     retry_policy=opentherm_app.retry_policy, exchange_stats=opentherm_app.exchange_stats)
+        opentherm_app.opentherm_exchange = self.boiler.opentherm_exchange
+        # no gap: nothing waits, so a cycle is just the code under test
+        opentherm_app.bus = OpenThermBus(opentherm_app._exchange, gap_ms=0)
+        opentherm_app.retry_policy = RetryPolicy()
+        opentherm_app.exchange_stats = ExchangeStats()
+        self.addCleanup(lambda: [setattr(opentherm_app, name, value) for name, value in saved.items()])
+
+        cm = host.install(host.VirtualClock())
+        self.main = cm.__enter__()
+        self.addCleanup(cm.__exit__, None, None, None)
+        self.main.boiler_values.boiler_ch_enabled = True
+        self.main.boiler_values.boiler_flow_temperature_setpoint = 60.0
+
+    async def cycles(self, n: int):
+        main = self.main
+        last_write = lib.ticks_ms()  # the periodic settings writes aren't due
+        for _ in range(n):
+            await main.boiler_loop(lib.ticks_ms(), last_write)
+
+    async def allocated(self, n: int) -> int:
+        """Bytes allocated while n cycles run, with the GC off so nothing is freed behind our back.
+
+        On MicroPython, gc.mem_alloc() then counts every allocation. CPython frees
+        by reference counting as it goes, so it's tracemalloc's peak: the most
+        the cycles held at once, garbage included.
+        """
+        gc.disable()
+        try:
+            if hasattr(gc, "mem_alloc"):
+                before = gc.mem_alloc()
+                await self.cycles(n)
+                return gc.mem_alloc() - before
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await self.cycles(n)
+            return tracemalloc.get_traced_memory()[1] - before
+        finally:
+            gc.enable()
+
+    def test_steady_state_memory_flat(self):
+        if not hasattr(gc, "mem_alloc"):
+            if tracemalloc is None:
+                self.skipTest("needs gc.mem_alloc() or tracemalloc")
+            tracemalloc.start()
+            self.addCleanup(tracemalloc.stop)
+
+        async def run():
+            # warm up: first-time allocations (the TSet encoding, stats slots, caches) happen here
+            await self.cycles(20)
+            gc.collect()
+            return await self.allocated(1), await self.allocated(CYCLES)
+
+        one, many = host.VirtualTimeLoop(host.VirtualClock()).run_until_complete(run())
+
+        self.assertEqual(self.boiler.calls, 2 * (21 + CYCLES))
+        self.assertLess(one, CYCLE_ALLOC_BYTES)
+        if hasattr(gc, "mem_alloc"):
+            # every cycle allocates the same few objects as the first
+            self.assertLessEqual(many, CYCLES * one)
+        else:
+            # however many cycles run, no more is held at once than in one: even a few
+            # bytes a cycle, kept or left for the GC, would add up to kilobytes
+            self.assertLess(many - one, 256)
+        self.assertTrue(self.main.boiler_values.boiler_flame_active)
+        self.assertTrue(self.main.boiler_values.boiler_ch_active)
+        self.assertFalse(self.main.boiler_values.boiler_fault_active)
+        self.assertEqual(self.main.boiler_values.boiler_status_flags, 0x0a)
+
+    def test_tset_encoded_on_change(self):
+        async def run():
+            await self.cycles(3)
+            self.main.boiler_values.boiler_flow_temperature_setpoint = 45.5
+            await self.cycles(1)
+
+        sent = []
+        exchange = self.boiler.opentherm_exchange
+
+        async def recording(msg_type, data_id, data_value, timeout_ms=1000):
+            if data_id == opentherm_app.DATA_ID_TSET:
+                sent.append(data_value)
+            return await exchange(msg_type, data_id, data_value, timeout_ms)
+
+        opentherm_app.opentherm_exchange = recording
+        host.VirtualTimeLoop(host.VirtualClock()).run_until_complete(run())
+        self.assertEqual(sent, [60 * 256] * 3 + [int(45.5 * 256)])
+
+    def test_fault_transition(self):
+        self.boiler.replies[(opentherm_app.MSG_TYPE_READ_DATA, opentherm_app.DATA_ID_STATUS)] = (
+            opentherm_app.MSG_TYPE_READ_ACK, opentherm_app.DATA_ID_STATUS, 0x0301)
+        self.boiler.replies[(opentherm_app.MSG_TYPE_READ_DATA, opentherm_app.DATA_ID_ASF_FAULT)] = (
+            opentherm_app.MSG_TYPE_READ_ACK, opentherm_app.DATA_ID_ASF_FAULT, 0x0400 | 0x12)
+
+        logged = []
+        saved = lib.syslog.log
+        lib.syslog.log = lambda message, *args, **kwargs: logged.append(message % args if args else message)
+        self.addCleanup(setattr, lib.syslog, "log", saved)
+
+        host.VirtualTimeLoop(host.VirtualClock()).run_until_complete(self.cycles(2))
+
+        values = self.main.boiler_values
+        self.assertTrue(values.boiler_fault_active)
+        self.assertTrue(values.boiler_fault_low_water_pressure)
+        self.assertFalse(values.boiler_fault_flame)
+        self.assertEqual(values.boiler_fault_flags, 0x0412)
+        # read and logged once, on the transition
+        self.assertEqual(logged, ["FAULT: Low water pressure detected",
+                                  "FAULT DETECTED: low water pressure, OEM code 18"])
+
+
+if __name__ == '__main__':
+    unittest.main()
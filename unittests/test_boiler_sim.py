@@ -0,0 +1,210 @@
+"""Tests for the host-side boiler simulator in sim/"""
+
+import asyncio
+import json
+import unittest
+
+from sim.boiler_sim import BoilerSim, BoilerModel, FRAME_MS
+from sim import host
+
+
+def run_virtual(coro):
+    """Run coro on a virtual-time loop, returning (result, virtual seconds taken)."""
+    loop = host.VirtualTimeLoop(host.VirtualClock())
+    try:
+        start = loop.time()
+        result = loop.run_until_complete(coro)
+        return result, loop.time() - start
+    finally:
+        loop.close()
+
+
+class TestBoilerSimResponses(unittest.TestCase):
+
+    def test_read_supported_id(self):
+        sim = BoilerSim()
+        sim.model.flow_c = 55.5
+        self.assertEqual(sim.respond(0, 25, 0), (4, 25, int(55.5 * 256)))
+
+    def test_unsupported_id(self):
+        sim = BoilerSim(unsupported=(35,))
+        self.assertEqual(sim.respond(0, 35, 0), (7, 35, 0))
+        self.assertEqual(sim.respond(0, 200, 0), (7, 200, 0))
+        # writing a read-only ID
+        self.assertEqual(sim.respond(1, 25, 0x1234), (7, 25, 0x1234))
+
+    def test_write_echoes_and_applies(self):
+        sim = BoilerSim()
+        self.assertEqual(sim.respond(1, 1, 60 * 256), (5, 1, 60 * 256))
+        self.assertEqual(sim.model.tset_c, 60)
+
+    def test_status_carries_master_flags(self):
+        sim = BoilerSim()
+        msg_type, data_id, data = sim.respond(0, 0, 0x0300)
+        self.assertEqual((msg_type, data_id, data >> 8), (4, 0, 0x03))
+        self.assertTrue(sim.model.ch_enabled)
+        self.assertTrue(sim.model.dhw_enabled)
+
+        sim.model.fault_flags = 0x04
+        self.assertEqual(sim.respond(0, 0, 0)[2] & 0x01, 0x01)
+        self.assertEqual(sim.respond(0, 5, 0)[2], 0x0400)
+
+
+class TestBoilerSimExchange(unittest.TestCase):
+
+    def test_latency_within_range(self):
+        sim = BoilerSim(latency_ms=(20, 400), seed=3)
+        for _ in range(20):
+            result, elapsed = run_virtual(sim.opentherm_exchange(0, 25, 0))
+            self.assertEqual(result[:2], (4, 25))
+            self.assertGreaterEqual(elapsed * 1000, 2 * FRAME_MS + 20 - 1)
+            self.assertLessEqual(elapsed * 1000, 2 * FRAME_MS + 400 + 1)
+
+    def test_injected_timeout(self):
+        sim = BoilerSim(timeout_rate=1.0)
+        with self.assertRaises(Exception) as cm:
+            run_virtual(sim.opentherm_exchange(0, 25, 0, timeout_ms=800))
+        self.assertIn("Timeout waiting for response", str(cm.exception))
+        self.assertEqual(sim.injected['timeout'], 1)
+
+    def test_injected_parity_error(self):
+        sim = BoilerSim(parity_rate=1.0, seed=1)
+        with self.assertRaises(ValueError) as cm:
+            run_virtual(sim.opentherm_exchange(0, 25, 0))
+        self.assertIn("Parity bit error", str(cm.exception))
+
+    def test_injected_decode_error(self):
+        sim = BoilerSim(decode_rate=1.0, seed=1)
+        with self.assertRaises(ValueError) as cm:
+            run_virtual(sim.opentherm_exchange(0, 25, 0))
+        self.assertIn("Manchester decoding error", str(cm.exception))
+
+
+class TestBoilerModel(unittest.TestCase):
+
+    def test_heats_to_setpoint(self):
+        model = BoilerModel()
+        model.ch_enabled = True
+        model.tset_c = 60
+        for _ in range(1800):
+            model.step(1)
+        self.assertAlmostEqual(model.flow_c, 60, delta=6)
+        self.assertLess(model.return_c, model.flow_c)
+
+    def test_cools_when_disabled(self):
+        model = BoilerModel()
+        model.flow_c = 60
+        for _ in range(600):
+            model.step(1)
+        self.assertFalse(model.flame)
+        self.assertLess(model.flow_c, 60)
+
+    def test_dhw_takes_priority(self):
+        model = BoilerModel()
+        model.ch_enabled = True
+        model.tset_c = 60
+        model.dhw_flow_lpm = 6
+        model.step(1)
+        self.assertTrue(model.dhw_active)
+        self.assertFalse(model.ch_active)
+        self.assertTrue(model.flame)
+
+
+class TestEndToEnd(unittest.TestCase):
+    """main.py against the simulator, in virtual time."""
+
+    def heating(self, main, sim):
+        main.boiler_values.boiler_ch_enabled = True
+        main.boiler_values.boiler_flow_temperature_setpoint = 60.0
+
+    def test_controls_boiler_and_publishes(self):
+        sim = BoilerSim(latency_ms=(20, 100), seed=1)
+        result = host.run(sim, 600, setup=self.heating)
+
+        # status/TSet every cycle, and the boiler was told what to do
+        intervals = result.status_intervals()
+        self.assertGreater(len(intervals), 500)
+        self.assertLess(sum(intervals) / len(intervals), 1000)
+        self.assertEqual(sim.model.tset_c, 60.0)
+        self.assertTrue(sim.model.ch_enabled)
+        self.assertGreater(sim.model.flow_c, 40)
+
+        # telemetry made it out over MQTT
+        flow = [msg for _, topic, msg in result.mqtt.published if topic == "homeassistant/sensor/boilerCHFlowTemperature/state"]
+        self.assertTrue(flow)
+        self.assertAlmostEqual(float(flow[-1]), sim.model.flow_c, delta=5)
+
+    def test_survives_line_errors(self):
+        sim = BoilerSim(latency_ms=(20, 100), timeout_rate=0.05, parity_rate=0.05, seed=2)
+        result = host.run(sim, 300, setup=self.heating)
+
+        report = result.report()
+        self.assertGreater(report['failures'], 0)
+        self.assertGreater(report['retries']['parity']['retries'] + report['retries']['timeout']['retries'], 0)
+        self.assertEqual(sim.model.tset_c, 60.0)
+        json.dumps(report)
+
+    def test_diagnostics_published(self):
+        sim = BoilerSim(latency_ms=(20, 100), seed=6)
+        result = host.run(sim, 130, setup=self.heating)
+
+        payloads = [msg for _, topic, msg in result.mqtt.published if topic == result.main.DIAGNOSTICS_TOPIC]
+        self.assertEqual(len(payloads), 2)
+        diagnostics = json.loads(payloads[-1])
+        self.assertIn("0", diagnostics["ids"])
+        # the detail poller's view of the bus: every polled ID, and how often it was actually read
+        polls = diagnostics["polls"]
+        self.assertLessEqual({str(data_id) for data_id in result.main.DETAIL_IDS}, set(polls))
+        flow = polls[str(result.main.opentherm_app.DATA_ID_TBOILER)]
+        self.assertGreater(flow["reads"], 0)
+        self.assertGreater(flow["per_minute"], 0)
+
+    def test_mqtt_command_reaches_boiler(self):
+        async def command():
+            await asyncio.sleep(30)
+            host.FakeMQTTClient.instances[-1].deliver("homeassistant/number/boilerCHFlowTemperatureSetpoint/command", b"45")
+
+        def setup(main, sim):
+            self.heating(main, sim)
+            asyncio.create_task(command())
+
+        sim = BoilerSim(latency_ms=(20, 100), seed=3)
+        host.run(sim, 60, setup=setup)
+        self.assertEqual(sim.model.tset_c, 45.0)
+
+    def test_discovery_once_per_connection(self):
+        sim = BoilerSim(latency_ms=(20, 100), seed=4)
+        result = host.run(sim, 300, setup=self.heating)
+
+        # on connecting, and again once boiler_setup() has read the setpoint ranges; not every cycle
+        configs = [topic for _, topic, _ in result.mqtt.published if topic.endswith("/config")]
+        self.assertEqual(len(configs), 2 * len(result.main.HASS_CONFIGS))
+        self.assertEqual(set(result.mqtt.retained), set(result.main.HASS_CONFIGS))
+        dhw = json.loads(result.mqtt.retained["homeassistant/number/boilerDHWFlowTemperatureSetpoint/config"])
+        self.assertEqual((dhw["min"], dhw["max"]), (35, 65))
+        ch = json.loads(result.mqtt.retained["homeassistant/number/boilerCHFlowTemperatureSetpoint/config"])
+        self.assertEqual((ch["min"], ch["max"]), (20, 80))
+
+    def test_discovery_when_home_assistant_restarts(self):
+        async def restart():
+            await asyncio.sleep(60)
+            host.FakeMQTTClient.instances[-1].deliver("homeassistant/status", b"online")
+
+        def setup(main, sim):
+            self.heating(main, sim)
+            asyncio.create_task(restart())
+
+        sim = BoilerSim(latency_ms=(20, 100), seed=5)
+        result = host.run(sim, 120, setup=setup)
+
+        self.assertIn("homeassistant/status", result.mqtt.subscriptions)
+        stamps = [ticks for ticks, topic, _ in result.mqtt.published if topic == "homeassistant/sensor/boilerFanSpeed/config"]
+        # connecting, the setpoint ranges, then HA's birth message
+        self.assertEqual(len(stamps), 3)
+        # the states come again too, rather than waiting for the heartbeat
+        states = [ticks for ticks, topic, _ in result.mqtt.published if topic == "homeassistant/sensor/boilerMaxCapacity/state"]
+        self.assertGreaterEqual(states[-1], stamps[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
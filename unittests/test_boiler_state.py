@@ -0,0 +1,107 @@
+"""Tests for the compact boiler state store in boiler_state.py"""
+
+import unittest
+
+from boiler_state import (
+    BoilerValues,
+    fields,
+    FIELDS,
+    ALL_FIELDS,
+    MAX_CONSUMERS,
+    BOILER_FLOW_TEMPERATURE,
+    BOILER_CH_PRESSURE,
+    BOILER_FLOW_TEMPERATURE_SETPOINT,
+    BOILER_MAX_CAPACITY,
+    BOILER_FLAME_ACTIVE,
+    BOILER_CH_ENABLED,
+    BOILER_DHW_ENABLED,
+)
+
+
+class TestBoilerValues(unittest.TestCase):
+
+    def test_defaults(self):
+        values = BoilerValues()
+        for field, (name, default) in enumerate(FIELDS):
+            self.assertEqual(getattr(values, name), default, name)
+            self.assertEqual(values.get(field), default, name)
+        self.assertIs(values.boiler_dhw_enabled, True)
+        self.assertIs(values.boiler_flame_active, False)
+        self.assertIsNone(values.rbp_dhw_setpoint)
+        self.assertIsNone(values.last_power_cycles)
+
+    def test_attributes_and_fields_agree(self):
+        values = BoilerValues()
+        values.boiler_flow_temperature = 55.5
+        values.boiler_max_capacity = 24
+        values.boiler_flame_active = True
+        self.assertEqual(values.get(BOILER_FLOW_TEMPERATURE), 55.5)
+        self.assertEqual(values.get(BOILER_MAX_CAPACITY), 24)
+        self.assertIs(values.get(BOILER_FLAME_ACTIVE), True)
+
+        values.set(BOILER_CH_ENABLED, True)
+        values.set(BOILER_DHW_ENABLED, False)
+        self.assertIs(values.boiler_ch_enabled, True)
+        self.assertIs(values.boiler_dhw_enabled, False)
+        self.assertIs(values.boiler_flame_active, True)
+
+    def test_floats_single_precision(self):
+        values = BoilerValues()
+        values.boiler_ch_pressure = 1.45
+        self.assertAlmostEqual(values.boiler_ch_pressure, 1.45, places=5)
+        # the same value again isn't a change, rounding and all
+        consumer = values.consumer()
+        values.take(consumer)
+        self.assertFalse(values.set(BOILER_CH_PRESSURE, 1.45))
+        self.assertEqual(values.changes(consumer), 0)
+
+    def test_consumer_starts_all_dirty(self):
+        values = BoilerValues()
+        consumer = values.consumer()
+        self.assertEqual(values.take(consumer), ALL_FIELDS)
+        self.assertEqual(values.take(consumer), 0)
+
+    def test_changes_tracked_per_consumer(self):
+        values = BoilerValues()
+        mqtt = values.consumer()
+        log = values.consumer()
+        values.take(mqtt)
+        values.take(log)
+
+        values.boiler_flow_temperature = 40.0
+        values.boiler_flame_active = True
+        values.boiler_dhw_enabled = True  # unchanged
+        expected = (1 << BOILER_FLOW_TEMPERATURE) | (1 << BOILER_FLAME_ACTIVE)
+        self.assertEqual(values.changes(mqtt), expected)
+        self.assertEqual(list(fields(values.take(mqtt))), [BOILER_FLOW_TEMPERATURE, BOILER_FLAME_ACTIVE])
+        self.assertEqual(values.take(mqtt), 0)
+        # the other consumer still has them
+        self.assertEqual(values.changes(log), expected)
+
+    def test_take_with_mask(self):
+        values = BoilerValues()
+        consumer = values.consumer()
+        values.take(consumer)
+        values.boiler_flow_temperature_setpoint = 50.0
+        values.boiler_flow_temperature = 41.0
+        bit = 1 << BOILER_FLOW_TEMPERATURE_SETPOINT
+        self.assertEqual(values.take(consumer, bit), bit)
+        self.assertEqual(values.changes(consumer), 1 << BOILER_FLOW_TEMPERATURE)
+
+        values.mark(consumer)
+        self.assertEqual(values.changes(consumer), ALL_FIELDS)
+
+    def test_consumer_limit(self):
+        values = BoilerValues()
+        for _ in range(MAX_CONSUMERS):
+            values.consumer()
+        with self.assertRaises(ValueError):
+            values.consumer()
+
+    def test_fields(self):
+        self.assertEqual(list(fields(0)), [])
+        self.assertEqual(list(fields(0b100101)), [0, 2, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
+import asyncio
+import random
+import socket
 import unittest
 from unittest.mock import patch, MagicMock, call
 from lib import manchester_encode, manchester_decode, frame_encode, frame_decode, s8, s16, f88, send_syslog
+from array import array
+from lib import frame_encode_manchester, frame_encode_manchester_into, decode_manchester_frame, Syslog
+from lib import frame_decode_from, decode_manchester_frame_from, frame_parity
 
 
 class TestManchester(unittest.TestCase):
@@ -31,6 +37,34 @@ class TestManchester(unittest.TestCase):
     def test_manchester_encode_decode(self):
         assert manchester_decode(manchester_encode(0xFFFFFFFF, invert=True), invert=True) == 0xFFFFFFFF
 
+    def test_manchester_decode_error_every_bit(self):
+        # a "00" or "11" symbol anywhere in the frame must be rejected
+        good = manchester_encode(0x12345678)
+        for i in range(32):
+            shift = 62 - 2 * i
+            self.assertRaises(ValueError, manchester_decode, good | (3 << shift))
+            self.assertRaises(ValueError, manchester_decode, good & ~(3 << shift))
+
+    def test_manchester_matches_bitwise_reference(self):
+        rng = random.Random(1234)
+        for _ in range(5000):
+            frame = rng.getrandbits(32)
+            for invert in (False, True):
+                mframe = manchester_encode(frame, invert=invert)
+                assert mframe == _reference_manchester_encode(frame, invert=invert)
+                assert manchester_decode(mframe, invert=invert) == frame
+
+
+def _reference_manchester_encode(frame, invert=False):
+    """The original bit-at-a-time encoder, kept to cross-check the tables."""
+    one, zero = (1, 2) if invert else (2, 1)
+    mframe = 0
+    mask = 0x80000000
+    while mask:
+        mframe = (mframe << 2) | (one if frame & mask else zero)
+        mask >>= 1
+    return mframe
+
 
 class TestFrame(unittest.TestCase):
 
@@ -45,9 +79,84 @@ class TestFrame(unittest.TestCase):
         assert frame_decode(0xf0bb4278) == (0x07, 0xbb, 0x4278)
         self.assertRaises(ValueError, frame_decode, 0x4278bb0e)
 
+    def test_parity_error_logged_lazily(self):
+        self.assertEqual(frame_parity(0x4278bb0e), 1)
+        self.assertEqual(frame_parity(0xf0bb4278), 0)
+        with patch('lib.send_syslog') as log, patch('builtins.print') as printed:
+            self.assertRaises(ValueError, frame_decode, 0x4278bb0e)
+        # formatted by the syslog task, if at all: nothing on the decode path
+        log.assert_called_once_with("ERROR: Parity bit error, frame: %04x%04x", 0x4278, 0xbb0e)
+        printed.assert_not_called()
+
     def test_frame_encode_decode(self):
         assert frame_decode(frame_encode(0x07, 0xbb, 0x4278)) == (0x07, 0xbb, 0x4278)
 
+    def test_frame_encode_manchester(self):
+        assert frame_encode_manchester(0, 0, 0) == (0x55555555, 0x55555555)
+        assert frame_encode_manchester(0x07, 0xbb, 0x4278) == (0xaa559a9a, 0x65596a95)
+        assert frame_encode_manchester(0x07, 0xbb, 0x4278, invert=True) == (0x55aa6565, 0x9aa6956a)
+
+    def test_frame_encode_manchester_into(self):
+        buf = array('I', (0, 0))
+        for frame in ((0, 0, 0), (0x07, 0xbb, 0x4278), (4, 25, 0xffff), (1, 1, 0x4000)):
+            for invert in (False, True):
+                frame_encode_manchester_into(buf, *frame, invert=invert)
+                assert tuple(buf) == frame_encode_manchester(*frame, invert=invert)
+
+    def test_decode_manchester_frame(self):
+        assert decode_manchester_frame(0x55555555, 0x55555555) == (0, 0, 0)
+        assert decode_manchester_frame(0xaa559a9a, 0x65596a95) == (0x07, 0xbb, 0x4278)
+        assert decode_manchester_frame(0x55aa6565, 0x9aa6956a, invert=True) == (0x07, 0xbb, 0x4278)
+        self.assertRaises(ValueError, decode_manchester_frame, 0xfa559a9a, 0x65596a95)
+        # flip one data bit -> parity error
+        self.assertRaises(ValueError, decode_manchester_frame, 0xaa559a9a, 0x65596a95 ^ 0x3)
+
+    def test_decode_from_buffer(self):
+        buf = array('I', (0xaa559a9a, 0x65596a95))
+        assert decode_manchester_frame_from(buf) == (0x07, 0xbb, 0x4278)
+        buf[0] = 0xfa559a9a
+        self.assertRaises(ValueError, decode_manchester_frame_from, buf)
+
+        buf = array('I', (frame_encode(4, 25, 0x3c80), frame_encode(7, 0xbb, 0x4278)))
+        assert frame_decode_from(buf) == (4, 25, 0x3c80)
+        assert frame_decode_from(buf, 1) == (7, 0xbb, 0x4278)
+        buf[1] ^= 1
+        self.assertRaises(ValueError, frame_decode_from, buf, 1)
+
+    def test_frame_fuzz_against_reference(self):
+        rng = random.Random(4321)
+        # every possible high half (parity, msg type, spare bits, data id) ...
+        lo = rng.getrandbits(16)
+        frames = [(hi << 16) | lo for hi in range(0x10000)]
+        # ... plus a large random sample of whole frames
+        frames += [rng.getrandbits(32) for _ in range(20000)]
+
+        with patch('lib.send_syslog'):
+            for frame in frames:
+                mframe = manchester_encode(frame)
+                mhi, mlo = mframe >> 32, mframe & 0xffffffff
+                if bin(frame).count("1") & 1:
+                    self.assertRaises(ValueError, frame_decode, frame)
+                    self.assertRaises(ValueError, decode_manchester_frame, mhi, mlo)
+                else:
+                    expected = ((frame >> 28) & 0x07, (frame >> 16) & 0xff, frame & 0xffff)
+                    assert frame_decode(frame) == expected
+                    assert decode_manchester_frame(mhi, mlo) == expected
+
+                msg_type, data_id, data_value = (frame >> 28) & 0x07, (frame >> 16) & 0xff, frame & 0xffff
+                reference = _reference_frame_encode(msg_type, data_id, data_value)
+                assert frame_encode(msg_type, data_id, data_value) == reference
+                mframe = manchester_encode(reference, invert=True)
+                assert frame_encode_manchester(msg_type, data_id, data_value, invert=True) == (mframe >> 32, mframe & 0xffffffff)
+
+
+def _reference_frame_encode(msg_type, data_id, data_value):
+    """The original string-counting parity encoder."""
+    frame = ((msg_type & 0x07) << 28) | ((data_id & 0xff) << 16) | (data_value & 0xffff)
+    if bin(frame).count("1") & 1:
+        frame |= 0x80000000
+    return frame
+
 
 class TestSS2(unittest.TestCase):
 
@@ -95,14 +204,21 @@ class TestF88(unittest.TestCase):
 
 class TestSendSyslog(unittest.TestCase):
 
+    def setUp(self):
+        patcher = patch('lib.syslog', Syslog())
+        self.syslog = patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch('lib.socket.socket')
     def test_send_syslog_basic(self, mock_socket):
         # Setup mocks
         mock_sock_instance = MagicMock()
         mock_socket.return_value = mock_sock_instance
 
-        # Call function
+        # Call function - nothing is sent until the buffer is drained
         send_syslog("Test message")
+        mock_socket.assert_not_called()
+        self.assertEqual(self.syslog.flush(), 1)
 
         # Verify socket creation
         mock_socket.assert_called_once_with(unittest.mock.ANY, unittest.mock.ANY)
@@ -111,11 +227,11 @@ class TestSendSyslog(unittest.TestCase):
         mock_sock_instance.setsockopt.assert_called_once()
 
         # Verify message sent - timestamp omitted since device doesn't know the time
-        expected_msg = b'<13>1 picopower main - - - Test message\r\n'
+        expected_msg = b'<13>1 picotherm main - - - Test message\r\n'
         mock_sock_instance.sendto.assert_called_once_with(expected_msg, ('255.255.255.255', 514))
 
-        # Verify socket closed
-        mock_sock_instance.close.assert_called_once()
+        # Verify socket kept open for reuse
+        mock_sock_instance.close.assert_not_called()
 
     @patch('lib.socket.socket')
     def test_send_syslog_custom_params(self, mock_socket):
@@ -125,23 +241,24 @@ class TestSendSyslog(unittest.TestCase):
 
         # Call function with custom parameters
         send_syslog("Custom message", port=1514, hostname="myhost", appname="myapp", procid="123", msgid="MSG001")
+        self.syslog.flush()
 
         # Verify message sent with custom parameters - timestamp omitted since device doesn't know the time
         expected_msg = b'<13>1 myhost myapp 123 MSG001 - Custom message\r\n'
         mock_sock_instance.sendto.assert_called_once_with(expected_msg, ('255.255.255.255', 1514))
 
     @patch('lib.socket.socket')
-    def test_send_syslog_no_timestamp(self, mock_socket):
-        # Setup mocks
+    def test_send_syslog_socket_reused(self, mock_socket):
         mock_sock_instance = MagicMock()
         mock_socket.return_value = mock_sock_instance
 
-        # Call function
-        send_syslog("Test message")
+        for i in range(5):
+            send_syslog(f"Message {i}")
+        self.assertEqual(self.syslog.flush(), 5)
 
-        # Verify timestamp is omitted since device doesn't know the time
-        expected_msg = b'<13>1 picopower main - - - Test message\r\n'
-        mock_sock_instance.sendto.assert_called_once_with(expected_msg, ('255.255.255.255', 514))
+        mock_socket.assert_called_once()
+        self.assertEqual(mock_sock_instance.sendto.call_count, 5)
+        self.assertEqual(mock_sock_instance.sendto.call_args_list[4][0][0], b'<13>1 picotherm main - - - Message 4\r\n')
 
     @patch('lib.socket.socket')
     def test_send_syslog_socket_exception(self, mock_socket):
@@ -152,14 +269,31 @@ class TestSendSyslog(unittest.TestCase):
         # Make sendto raise an exception
         mock_sock_instance.sendto.side_effect = OSError("Network error")
 
-        # Call function - should not raise exception (caught in finally)
-        try:
-            send_syslog("Test message")
-        except OSError:
-            pass  # Exception is expected but socket should still close
+        # Should not raise - the message is dropped
+        send_syslog("Test message")
+        self.syslog.flush()
 
-        # Verify socket is closed even on exception
+        # Verify broken socket is closed and recreated for the next message
         mock_sock_instance.close.assert_called_once()
+        send_syslog("Test message")
+        self.syslog.flush()
+        self.assertEqual(mock_socket.call_count, 2)
+
+    @patch('lib.socket.socket')
+    def test_send_syslog_buffer_full(self, mock_socket):
+        mock_sock_instance = MagicMock()
+        mock_socket.return_value = mock_sock_instance
+
+        for i in range(self.syslog.size + 3):
+            send_syslog(f"Message {i}")
+        self.assertEqual(self.syslog.pending(), self.syslog.size)
+        self.assertEqual(self.syslog.dropped, 3)
+
+        # batches are limited, oldest first
+        self.assertEqual(self.syslog.flush(4), 4)
+        self.assertEqual(mock_sock_instance.sendto.call_args_list[0][0][0], b'<13>1 picotherm main - - - Message 0\r\n')
+        self.assertEqual(self.syslog.flush(), self.syslog.size - 4)
+        self.assertEqual(self.syslog.pending(), 0)
 
     @patch('lib.socket.socket')
     def test_send_syslog_message_format(self, mock_socket):
@@ -169,7 +303,62 @@ class TestSendSyslog(unittest.TestCase):
 
         # Call function
         send_syslog("Multi word message with spaces")
+        self.syslog.flush()
 
         # Verify RFC5424 format with timestamp omitted (device doesn't know the time)
-        expected_msg = b'<13>1 picopower main - - - Multi word message with spaces\r\n'
+        expected_msg = b'<13>1 picotherm main - - - Multi word message with spaces\r\n'
         mock_sock_instance.sendto.assert_called_once_with(expected_msg, ('255.255.255.255', 514))
+
+    @patch('lib.socket.socket')
+    def test_send_syslog_lazy_format(self, mock_socket):
+        mock_sock_instance = MagicMock()
+        mock_socket.return_value = mock_sock_instance
+
+        class Counted:
+            formatted = 0
+
+            def __str__(self):
+                Counted.formatted += 1
+                return "boom"
+
+        send_syslog("Detail read of data ID %d failed: %s", 25, Counted())
+        # nothing is formatted until the message goes out
+        self.assertEqual(Counted.formatted, 0)
+        self.syslog.flush()
+        self.assertEqual(Counted.formatted, 1)
+        mock_sock_instance.sendto.assert_called_once_with(
+            b'<13>1 picotherm main - - - Detail read of data ID 25 failed: boom\r\n', ('255.255.255.255', 514))
+
+
+class TestSyslogDrain(unittest.IsolatedAsyncioTestCase):
+
+    async def test_drain_to_local_listener(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.setblocking(False)
+        self.addCleanup(listener.close)
+        port = listener.getsockname()[1]
+
+        syslog = Syslog(size=8, host='127.0.0.1', batch=3)
+        self.addCleanup(syslog.close)
+        for i in range(10):
+            syslog.log(f"Message {i}", port=port)
+        self.assertEqual(syslog.dropped, 2)
+
+        loop = asyncio.get_running_loop()
+
+        async def recv():
+            return await asyncio.wait_for(loop.sock_recv(listener, 1024), 2)
+
+        task = asyncio.create_task(syslog.run())
+        try:
+            received = [await recv() for _ in range(8)]
+            syslog.log("Late message", port=port)
+            received.append(await recv())
+        finally:
+            task.cancel()
+
+        self.assertEqual(received[0], b'<13>1 picotherm main - - - Message 0\r\n')
+        self.assertEqual(received[7], b'<13>1 picotherm main - - - Message 7\r\n')
+        self.assertEqual(received[8], b'<13>1 picotherm main - - - Late message\r\n')
+        self.assertEqual(syslog.pending(), 0)
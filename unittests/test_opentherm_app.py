@@ -1338,3 +1338,159 @@ class TestOpenThermApp_read_max_relative_modulation_level(unittest.TestCase):
         result = await read_max_relative_modulation_level()
         mock_opentherm_exchange.assert_called_once_with(MSG_TYPE_READ_DATA, DATA_ID_MAX_REL_MODULATION, 0)
         self.assertEqual(result, 0.0)
+
+class TestOpenThermApp_registry(unittest.TestCase):
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_read_decodes_by_codec(self, mock_opentherm_exchange):
+        mock_opentherm_exchange.return_value = (MSG_TYPE_READ_ACK, DATA_ID_TEXHAUST, 0xFFF6)
+        self.assertEqual(await read(DATA_ID_TEXHAUST), -10)
+        mock_opentherm_exchange.assert_called_once_with(MSG_TYPE_READ_DATA, DATA_ID_TEXHAUST, 0)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_write_returns_acknowledged_value(self, mock_opentherm_exchange):
+        # the boiler may ack a different value than was written (OT spec 4.4.1)
+        mock_opentherm_exchange.return_value = (MSG_TYPE_WRITE_ACK, DATA_ID_TDHWSET, 55 * 256)
+        self.assertEqual(await write(DATA_ID_TDHWSET, 60), 55.0)
+        mock_opentherm_exchange.assert_called_once_with(MSG_TYPE_WRITE_DATA, DATA_ID_TDHWSET, 60 * 256)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_write_range_checked(self, mock_opentherm_exchange):
+        mock_opentherm_exchange.return_value = (MSG_TYPE_WRITE_ACK, DATA_ID_TRSET, 0)
+        with self.assertRaises(ValueError) as cm:
+            await write(DATA_ID_TRSET, -41)
+        self.assertIn("room setpoint", str(cm.exception))
+        mock_opentherm_exchange.assert_not_called()
+
+        await write(DATA_ID_TRSET, -40)
+        mock_opentherm_exchange.assert_called_once_with(MSG_TYPE_WRITE_DATA, DATA_ID_TRSET, -40 * 256)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_direction_checked(self, mock_opentherm_exchange):
+        with self.assertRaises(ValueError):
+            await read(DATA_ID_PRIMARY_CONFIG)
+        with self.assertRaises(ValueError):
+            await write(DATA_ID_TBOILER, 50)
+        mock_opentherm_exchange.assert_not_called()
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_unknown_data_id(self, mock_opentherm_exchange):
+        with self.assertRaises(ValueError):
+            await read(200)
+        mock_opentherm_exchange.assert_not_called()
+
+    def test_codecs_roundtrip(self):
+        from opentherm_app import _encode, _decode
+        for codec, value in ((CODEC_F88, -12.5), (CODEC_RAW, 0xBEEF), (CODEC_HB, 7), (CODEC_LB, 200),
+                             (CODEC_U8_U8, (1, 2)), (CODEC_S8_S8, (-10, 90)), (CODEC_FAN_HZ, 3000)):
+            self.assertEqual(_decode(codec, _encode(codec, value) & 0xffff), value)
+
+    def test_decode_flags(self):
+        self.assertEqual(decode_flags(REMOTE_OVERRIDE_FLAGS, 0x03),
+                         {'manual_change_priority': True, 'program_change_priority': True})
+
+
+class TestOpenThermApp_read_many(unittest.TestCase):
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_read_many(self, mock_opentherm_exchange):
+        responses = {
+            DATA_ID_TBOILER: (MSG_TYPE_READ_ACK, DATA_ID_TBOILER, 0x3C80),
+            DATA_ID_TEXHAUST: (MSG_TYPE_READ_ACK, DATA_ID_TEXHAUST, 0x0040),
+            DATA_ID_POWER_CYCLES: (MSG_TYPE_READ_ACK, DATA_ID_POWER_CYCLES, 12),
+        }
+        mock_opentherm_exchange.side_effect = lambda msg_type, data_id, data_value: responses[data_id]
+
+        result = await read_many([DATA_ID_TBOILER, DATA_ID_TEXHAUST, DATA_ID_POWER_CYCLES])
+        self.assertEqual(result, {DATA_ID_TBOILER: 60.5, DATA_ID_TEXHAUST: 64, DATA_ID_POWER_CYCLES: 12})
+        self.assertEqual([c.args[1] for c in mock_opentherm_exchange.call_args_list],
+                         [DATA_ID_TBOILER, DATA_ID_TEXHAUST, DATA_ID_POWER_CYCLES])
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_read_many_partial_success(self, mock_opentherm_exchange):
+        responses = {
+            DATA_ID_TBOILER: (MSG_TYPE_READ_ACK, DATA_ID_TBOILER, 0x3C80),
+            DATA_ID_BOILER_FAN_SPEED: (MSG_TYPE_UNKNOWN_DATA_ID, DATA_ID_BOILER_FAN_SPEED, 0),
+            DATA_ID_TDHW: Exception("Timeout waiting for response"),
+            DATA_ID_TRET: (MSG_TYPE_READ_ACK, DATA_ID_TRET, 0x2800),
+        }
+
+        async def exchange(msg_type, data_id, data_value):
+            response = responses[data_id]
+            if isinstance(response, Exception):
+                raise response
+            return response
+        mock_opentherm_exchange.side_effect = exchange
+
+        result = await read_many([DATA_ID_TBOILER, DATA_ID_BOILER_FAN_SPEED, DATA_ID_TDHW, DATA_ID_TRET])
+        self.assertEqual(result[DATA_ID_TBOILER], 60.5)
+        self.assertIsInstance(result[DATA_ID_BOILER_FAN_SPEED], UnknownDataIdError)
+        self.assertIsInstance(result[DATA_ID_TDHW], Exception)
+        # IDs after a failure are still read
+        self.assertEqual(result[DATA_ID_TRET], 40.0)
+
+
+class TestOpenThermApp_capabilities(unittest.TestCase):
+    def setUp(self):
+        import opentherm_app
+        from opentherm_caps import CapabilityCache
+
+        self.caps = CapabilityCache(path='/nonexistent/otcaps.json')
+        self.caps.save = lambda: None
+        patcher = patch.object(opentherm_app, 'capabilities', self.caps)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_unsupported_id_skipped(self, mock_opentherm_exchange):
+        mock_opentherm_exchange.return_value = (MSG_TYPE_UNKNOWN_DATA_ID, DATA_ID_BOILER_FAN_SPEED, 0)
+        with self.assertRaises(UnknownDataIdError):
+            await read_fan_speed()
+        with self.assertRaises(UnknownDataIdError):
+            await read_fan_speed()
+        mock_opentherm_exchange.assert_called_once_with(MSG_TYPE_READ_DATA, DATA_ID_BOILER_FAN_SPEED, 0)
+        self.assertEqual(self.caps.lookup(DATA_ID_BOILER_FAN_SPEED), MSG_TYPE_UNKNOWN_DATA_ID)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_data_invalid_read_skipped(self, mock_opentherm_exchange):
+        mock_opentherm_exchange.return_value = (MSG_TYPE_DATA_INVALID, DATA_ID_TOUTSIDE, 0)
+        with self.assertRaises(DataInvalidError):
+            await read_outside_temperature()
+        with self.assertRaises(DataInvalidError):
+            await read_outside_temperature()
+        self.assertEqual(mock_opentherm_exchange.call_count, 1)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_data_invalid_write_not_cached(self, mock_opentherm_exchange):
+        # DATA-INVALID in reply to a write rejects the value, not the data ID
+        mock_opentherm_exchange.return_value = (MSG_TYPE_DATA_INVALID, DATA_ID_TDHWSET, 0)
+        with self.assertRaises(DataInvalidError):
+            await control_dhw_setpoint(60)
+        self.assertEqual(self.caps.lookup(DATA_ID_TDHWSET), 0)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_status_never_skipped(self, mock_opentherm_exchange):
+        mock_opentherm_exchange.return_value = (MSG_TYPE_DATA_INVALID, DATA_ID_STATUS, 0)
+        for _ in range(2):
+            with self.assertRaises(DataInvalidError):
+                await status_exchange()
+        self.assertEqual(mock_opentherm_exchange.call_count, 2)
+
+    @patch('opentherm_app.opentherm_exchange_retry', new_callable=AsyncMock)
+    @async_test
+    async def test_success_forgets(self, mock_opentherm_exchange):
+        self.caps.record(DATA_ID_BOILER_FAN_SPEED, MSG_TYPE_UNKNOWN_DATA_ID)
+        self.caps._entries[DATA_ID_BOILER_FAN_SPEED][1] = 0  # TTL ran out: due a re-probe
+
+        mock_opentherm_exchange.return_value = (MSG_TYPE_READ_ACK, DATA_ID_BOILER_FAN_SPEED, 50)
+        self.assertEqual(await read_fan_speed(), 3000)
+        self.assertEqual(self.caps.inspect(), {})
@@ -0,0 +1,291 @@
+"""Tests for the OpenTherm bus scheduler in opentherm_bus.py"""
+
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from lib import ticks_ms, ticks_diff, ticks_add
+from opentherm_bus import OpenThermBus, PRIORITY_MANDATORY, PRIORITY_COMMAND, PRIORITY_BACKGROUND
+from sim.host import VirtualClock, VirtualTimeLoop
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+class FakeExchange:
+    """Stands in for opentherm_exchange, recording when each conversation ran.
+
+    latency_ms is either a fixed conversation time or a dict of them per data ID.
+    """
+
+    def __init__(self, latency_ms=10, errors=()):
+        self.latency_ms = latency_ms
+        self.errors = set(errors)
+        self.log = []  # (data_id, start, end) in ms since creation
+        self.t0 = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self.t0) * 1000
+
+    async def __call__(self, msg_type, data_id, data_value, timeout_ms):
+        start = self.now()
+        latency_ms = self.latency_ms[data_id] if isinstance(self.latency_ms, dict) else self.latency_ms
+        await asyncio.sleep(latency_ms / 1000)
+        self.log.append((data_id, start, self.now()))
+        if data_id in self.errors:
+            raise Exception("Timeout waiting for response")
+        return 4, data_id, data_value
+
+
+class VirtualTime:
+    """Runs coroutines on a virtual clock, which FakeExchange and ticks_ms() read too."""
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        for name in ("monotonic", "monotonic_ns"):
+            patcher = patch.object(time, name, getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.loop = VirtualTimeLoop(self.clock)
+        self.addCleanup(self.loop.close)
+
+    def run_virtual(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+@patch('asyncio.sleep_ms', sleep_ms, create=True)
+class TestOpenThermBus(unittest.IsolatedAsyncioTestCase):
+
+    GAP_MS = 50
+
+    def assertGaps(self, log):
+        for (_, _, prev_end), (_, start, _) in zip(log, log[1:]):
+            self.assertGreaterEqual(start - prev_end, self.GAP_MS - 1)
+
+    async def test_single_exchange_no_trailing_sleep(self):
+        fake = FakeExchange(latency_ms=10)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        start = fake.now()
+        self.assertEqual(await bus.exchange(0, 25, 7), (4, 25, 7))
+        # the caller gets its result without waiting out the gap
+        self.assertLess(fake.now() - start, 10 + self.GAP_MS / 2)
+
+    async def test_sequential_exchanges_honour_gap(self):
+        fake = FakeExchange(latency_ms=5)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        for data_id in range(4):
+            await bus.exchange(0, data_id, 0)
+        self.assertEqual([entry[0] for entry in fake.log], [0, 1, 2, 3])
+        self.assertGaps(fake.log)
+
+    async def test_gap_counts_from_end_of_conversation(self):
+        fake = FakeExchange(latency_ms=5)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        await bus.exchange(0, 1, 0)
+        # time spent elsewhere counts towards the gap
+        await asyncio.sleep(self.GAP_MS / 1000)
+        start = fake.now()
+        await bus.exchange(0, 2, 0)
+        self.assertLess(fake.now() - start, 5 + self.GAP_MS / 2)
+
+    async def test_concurrent_requests_run_back_to_back(self):
+        fake = FakeExchange(latency_ms=10)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        results = await asyncio.gather(*[bus.exchange(0, data_id, data_id) for data_id in range(6)])
+
+        self.assertEqual(results, [(4, i, i) for i in range(6)])
+        self.assertEqual([entry[0] for entry in fake.log], list(range(6)))
+        self.assertGaps(fake.log)
+        # the line is never left idle for longer than the gap
+        for (_, _, prev_end), (_, start, _) in zip(fake.log, fake.log[1:]):
+            self.assertLess(start - prev_end, self.GAP_MS * 1.5)
+
+    async def test_callers_only_wait_for_their_own_result(self):
+        fake = FakeExchange(latency_ms=10)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+        done = {}
+
+        async def request(data_id):
+            await bus.exchange(0, data_id, 0)
+            done[data_id] = fake.now()
+
+        await asyncio.gather(request(1), request(2), request(3))
+        ends = {data_id: end for data_id, _, end in fake.log}
+        for data_id in (1, 2, 3):
+            self.assertLess(done[data_id] - ends[data_id], self.GAP_MS / 2)
+
+    async def test_error_releases_bus(self):
+        fake = FakeExchange(latency_ms=5, errors=[1])
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        results = await asyncio.gather(bus.exchange(0, 1, 0), bus.exchange(0, 2, 0), return_exceptions=True)
+        self.assertIsInstance(results[0], Exception)
+        self.assertEqual(results[1], (4, 2, 0))
+        # a failed conversation still counts for the gap
+        self.assertGaps(fake.log)
+
+    async def test_cancelled_waiter_does_not_stall_bus(self):
+        fake = FakeExchange(latency_ms=10)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        first = asyncio.create_task(bus.exchange(0, 1, 0))
+        second = asyncio.create_task(bus.exchange(0, 2, 0))
+        third = asyncio.create_task(bus.exchange(0, 3, 0))
+        await asyncio.sleep(0)
+        self.assertEqual(bus.pending(), 2)
+        second.cancel()
+
+        await first
+        await third
+        self.assertEqual([entry[0] for entry in fake.log], [1, 3])
+        self.assertEqual(bus.pending(), 0)
+
+
+@patch('asyncio.sleep_ms', sleep_ms, create=True)
+class TestOpenThermBusPriorities(unittest.IsolatedAsyncioTestCase):
+
+    GAP_MS = 20
+
+    async def test_most_urgent_class_first(self):
+        fake = FakeExchange(latency_ms=5)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        tasks = [asyncio.create_task(bus.exchange(0, 1, 0, priority=PRIORITY_BACKGROUND))]
+        await asyncio.sleep(0)
+        for data_id, priority in ((2, PRIORITY_BACKGROUND), (3, PRIORITY_BACKGROUND), (4, PRIORITY_COMMAND),
+                                  (5, PRIORITY_MANDATORY), (6, PRIORITY_COMMAND)):
+            tasks.append(asyncio.create_task(bus.exchange(0, data_id, 0, priority=priority)))
+        await asyncio.gather(*tasks)
+
+        # ID 1 already had the line; then mandatory, commands and background, each in arrival order
+        self.assertEqual([entry[0] for entry in fake.log], [1, 5, 4, 6, 2, 3])
+
+    async def test_mandatory_preempts_background_waiting_out_gap(self):
+        fake = FakeExchange(latency_ms=5)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        await bus.exchange(0, 1, 0)
+        # background request takes the line and starts waiting out the gap...
+        background = asyncio.create_task(bus.exchange(0, 2, 0, priority=PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.005)
+        # ...when a mandatory one turns up
+        await bus.exchange(0, 0, 0, priority=PRIORITY_MANDATORY)
+        await background
+
+        self.assertEqual([entry[0] for entry in fake.log], [1, 0, 2])
+        self.assertEqual(bus.pending(), 0)
+
+    async def test_background_stays_clear_of_reservation(self):
+        fake = FakeExchange(latency_ms={2: 30, 0: 5})
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS, conversation_ms=30)
+
+        # the mandatory slot starts in 40ms: a 30ms conversation plus the gap won't fit
+        bus.reserve(ticks_ms() + 40, 10)
+        background = asyncio.create_task(bus.exchange(0, 2, 0))
+        await asyncio.sleep(0.04)
+        await bus.exchange(0, 0, 0, priority=PRIORITY_MANDATORY)
+        await background
+
+        self.assertEqual([entry[0] for entry in fake.log], [0, 2])
+
+    async def test_background_fits_before_reservation(self):
+        fake = FakeExchange(latency_ms={2: 5, 0: 5})
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS, conversation_ms=10)
+
+        bus.reserve(ticks_ms() + 60, 10)
+        await bus.exchange(0, 2, 0)
+        self.assertEqual([entry[0] for entry in fake.log], [2])
+
+
+
+@patch('asyncio.sleep_ms', sleep_ms, create=True)
+class TestOpenThermBusReservations(VirtualTime, unittest.TestCase):
+
+    GAP_MS = 50
+
+    def test_stale_reservation_ignored(self):
+        fake = FakeExchange(latency_ms=5)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS)
+
+        async def exchange():
+            bus.reserve(ticks_ms() - 100, 10)
+            start = fake.now()
+            await bus.exchange(0, 2, 0)
+            return fake.now() - start
+
+        # only the conversation itself: no wait for the gap or the reservation
+        self.assertAlmostEqual(self.run_virtual(exchange()), 5, delta=1)
+
+
+@patch('asyncio.sleep_ms', sleep_ms, create=True)
+class TestOpenThermBusCadence(VirtualTime, unittest.TestCase):
+    """Status/TSet cadence against heavy background telemetry, in virtual time.
+
+    Time is scaled down 10x: a 10ms gap stands for the spec's 100ms, conversations
+    take 90-400ms (response latency plus both frames), and the status exchange must
+    start at least every 100ms (1s).
+    """
+
+    GAP_MS = 10
+    PERIOD_MS = 85
+    MAX_INTERVAL_MS = 100
+    LATENCIES = {0: 9, 1: 9, 5: 10, 17: 10, 18: 10, 19: 10, 25: 9, 26: 10, 28: 9, 33: 12, 35: 40, 97: 12, 116: 14, 120: 14}
+    TELEMETRY_IDS = [5, 17, 18, 19, 25, 26, 28, 33, 35, 97, 116, 120]
+
+    async def run_workload(self, prioritised, duration_ms=2000):
+        fake = FakeExchange(latency_ms=self.LATENCIES)
+        bus = OpenThermBus(fake, gap_ms=self.GAP_MS, conversation_ms=50)
+        mandatory = PRIORITY_MANDATORY if prioritised else PRIORITY_BACKGROUND
+
+        async def status_cycle():
+            next_cycle = ticks_ms()
+            while True:
+                start = ticks_ms()
+                await bus.exchange(0, 0, 0x0300, priority=mandatory)
+                await bus.exchange(1, 1, 0x4000, priority=mandatory)
+                next_cycle = ticks_add(next_cycle, self.PERIOD_MS)
+                if prioritised:
+                    bus.reserve(next_cycle, ticks_diff(ticks_ms(), start))
+                await asyncio.sleep(max(ticks_diff(next_cycle, ticks_ms()), 0) / 1000)
+
+        async def telemetry():
+            while True:
+                for data_id in self.TELEMETRY_IDS:
+                    await bus.exchange(0, data_id, 0, priority=PRIORITY_BACKGROUND)
+
+        tasks = [asyncio.create_task(status_cycle())] + [asyncio.create_task(telemetry()) for _ in range(4)]
+        await asyncio.sleep(duration_ms / 1000)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        status_starts = [start for data_id, start, _ in fake.log if data_id == 0]
+        intervals = [b - a for a, b in zip(status_starts, status_starts[1:])]
+        telemetry_count = sum(1 for data_id, _, _ in fake.log if data_id not in (0, 1))
+        return intervals, telemetry_count, fake.log
+
+    def test_status_cadence_with_priorities(self):
+        intervals, telemetry_count, log = self.run_virtual(self.run_workload(prioritised=True))
+
+        self.assertGreaterEqual(len(intervals), 10)
+        self.assertLessEqual(max(intervals), self.MAX_INTERVAL_MS, intervals)
+        # TSet goes out in every cycle too (the last one may have been cut short)
+        status_count = sum(1 for entry in log if entry[0] == 0)
+        self.assertGreaterEqual(sum(1 for entry in log if entry[0] == 1), status_count - 1)
+        # telemetry still gets the rest of the bus, slow and not-yet-seen IDs included
+        self.assertGreater(telemetry_count, len(intervals))
+        self.assertIn(35, {entry[0] for entry in log})
+
+    def test_status_cadence_slips_without_priorities(self):
+        intervals, _, _ = self.run_virtual(self.run_workload(prioritised=False))
+        self.assertGreater(max(intervals), self.MAX_INTERVAL_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Tests for the unsupported data ID cache in opentherm_caps.py"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import opentherm_caps
+from opentherm_caps import CapabilityCache, REJECT_TTL_S, MAX_TTL_S
+
+UNKNOWN_DATA_ID = 7
+DATA_INVALID = 6
+
+
+class TestCapabilityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch.object(opentherm_caps.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.unlink(self.path)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+        self.caps = CapabilityCache(self.path)
+
+    def test_unknown_id_exchanged(self):
+        self.assertEqual(self.caps.lookup(35), 0)
+
+    def test_rejected_id_skipped_until_ttl(self):
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        self.assertEqual(self.caps.lookup(35), UNKNOWN_DATA_ID)
+        self.now += REJECT_TTL_S[UNKNOWN_DATA_ID] - 1
+        self.assertEqual(self.caps.lookup(35), UNKNOWN_DATA_ID)
+        self.now += 1
+        self.assertEqual(self.caps.lookup(35), 0)
+
+    def test_data_invalid_shorter_ttl(self):
+        self.caps.record(27, DATA_INVALID)
+        self.assertEqual(self.caps.lookup(27), DATA_INVALID)
+        self.now += REJECT_TTL_S[DATA_INVALID]
+        self.assertEqual(self.caps.lookup(27), 0)
+
+    def test_data_invalid_ttl_not_doubled(self):
+        for _ in range(5):
+            self.caps.record(27, DATA_INVALID)
+            self.assertEqual(self.caps.inspect()[27]['ttl_s'], REJECT_TTL_S[DATA_INVALID])
+            self.now += REJECT_TTL_S[DATA_INVALID]
+
+    def test_failed_reprobe_doubles_ttl(self):
+        ttl = REJECT_TTL_S[UNKNOWN_DATA_ID]
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        for _ in range(5):
+            self.now += ttl
+            self.caps.record(35, UNKNOWN_DATA_ID)
+            ttl = min(ttl * 2, MAX_TTL_S)
+            self.assertEqual(self.caps.inspect()[35]['ttl_s'], ttl)
+        self.assertEqual(ttl, MAX_TTL_S)
+
+    def test_successful_reprobe_forgets(self):
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        self.caps.supported(35)
+        self.assertEqual(self.caps.lookup(35), 0)
+        self.assertEqual(self.caps.inspect(), {})
+
+    def test_inspect(self):
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        self.now += 100
+        self.assertEqual(self.caps.inspect(), {
+            35: dict(msg_type=UNKNOWN_DATA_ID, probe_in_s=REJECT_TTL_S[UNKNOWN_DATA_ID] - 100,
+                     ttl_s=REJECT_TTL_S[UNKNOWN_DATA_ID]),
+        })
+
+    def test_clear(self):
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        self.caps.record(97, UNKNOWN_DATA_ID)
+        self.caps.clear(35)
+        self.assertEqual(list(self.caps.inspect()), [97])
+        self.caps.clear()
+        self.assertEqual(self.caps.inspect(), {})
+
+        reloaded = CapabilityCache(self.path)
+        reloaded.load()
+        self.assertEqual(reloaded.inspect(), {})
+
+    def test_persisted_across_reboot(self):
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        self.now += 3600
+        self.caps.record(36, UNKNOWN_DATA_ID)
+        self.caps.record(97, DATA_INVALID)
+
+        # the clock restarts on boot: remaining time is kept, not the absolute expiry
+        self.now = 5.0
+        reloaded = CapabilityCache(self.path)
+        reloaded.load()
+        self.assertEqual(reloaded.lookup(35), UNKNOWN_DATA_ID)
+        self.assertEqual(reloaded.inspect()[35]['probe_in_s'], REJECT_TTL_S[UNKNOWN_DATA_ID] - 3600)
+        # a DATA-INVALID may be transient: it doesn't survive a reboot
+        self.assertEqual(reloaded.lookup(97), 0)
+
+    def test_data_invalid_not_saved(self):
+        self.caps.record(97, DATA_INVALID)
+        self.caps.supported(97)
+        self.assertFalse(os.path.exists(self.path))
+
+        # replacing a saved UNKNOWN-DATAID with a DATA-INVALID drops it from the file
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        self.caps.record(35, DATA_INVALID)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {})
+
+    def test_data_invalid_in_old_file_ignored(self):
+        with open(self.path, 'w') as f:
+            json.dump({"35": [UNKNOWN_DATA_ID, 60, 60], "97": [DATA_INVALID, 86400, 86400]}, f)
+        self.caps.load()
+        self.assertEqual(list(self.caps.inspect()), [35])
+
+    def test_saved_only_on_change(self):
+        self.caps.supported(25)
+        self.caps.lookup(25)
+        self.assertFalse(os.path.exists(self.path))
+
+        self.caps.record(35, UNKNOWN_DATA_ID)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {"35": [UNKNOWN_DATA_ID, REJECT_TTL_S[UNKNOWN_DATA_ID], REJECT_TTL_S[UNKNOWN_DATA_ID]]})
+
+    def test_missing_or_corrupt_file(self):
+        self.caps.load()
+        self.assertEqual(self.caps.inspect(), {})
+
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.caps.load()
+        self.assertEqual(self.caps.inspect(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 import unittest
 import asyncio
 from unittest.mock import patch, AsyncMock
+import opentherm_app
+from lib import ticks_ms
+from opentherm_bus import OpenThermBus, PRIORITY_MANDATORY
+from opentherm_retry import RetryPolicy
 from opentherm_app import (
     _check_response_type,
     opentherm_exchange_retry,
@@ -169,6 +173,132 @@ class TestOpenThermExchangeRetry(unittest.TestCase):
         self.assertEqual(mock_exchange.call_count, 2)
 
 
+async def real_sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+class TestOpenThermExchangeRetryPolicy(unittest.TestCase):
+    """Per-class budgets, deadlines and stats in opentherm_exchange_retry()"""
+
+    def setUp(self):
+        self.policy = RetryPolicy()
+        patcher = patch('opentherm_app.retry_policy', self.policy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_class_budget_caps_retries(self, mock_exchange, mock_sleep):
+        """Timeouts get their own budget, however many retries max_retries allows"""
+        mock_exchange.side_effect = Exception("Timeout waiting for response")
+
+        with self.assertRaises(Exception):
+            await opentherm_exchange_retry(0, 25, 0, max_retries=10)
+
+        self.assertEqual(mock_exchange.call_count, self.policy.budgets[0] + 1)
+        self.assertEqual(self.policy.stats()["timeout"], dict(retries=self.policy.budgets[0], give_ups=1))
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_budgets_are_per_class(self, mock_exchange, mock_sleep):
+        """Different failure classes each draw on their own budget"""
+        mock_exchange.side_effect = [
+            ValueError("Parity bit error"),
+            Exception("Timeout waiting for response"),
+            ValueError("Manchester decoding error"),
+            ValueError("Parity bit error"),
+            (MSG_TYPE_READ_ACK, 25, 0x1234),
+        ]
+        self.policy.budgets = (1, 1, 2, 1, 1)
+
+        result = await opentherm_exchange_retry(0, 25, 0)
+        self.assertEqual(result, (MSG_TYPE_READ_ACK, 25, 0x1234))
+        stats = self.policy.stats()
+        self.assertEqual(stats["parity"]["retries"], 2)
+        self.assertEqual(stats["timeout"]["retries"], 1)
+        self.assertEqual(stats["decode"]["retries"], 1)
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_backoff_between_retries(self, mock_exchange, mock_sleep):
+        """Retries back off for at least the class's base delay"""
+        mock_exchange.side_effect = [
+            Exception("Timeout waiting for response"),
+            (MSG_TYPE_READ_ACK, 25, 0),
+        ]
+
+        await opentherm_exchange_retry(0, 25, 0)
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertTrue(any(delay >= self.policy.backoff_ms[0] for delay in delays), delays)
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_mismatched_response_retried(self, mock_exchange, mock_sleep):
+        """A reply to a different data ID is retried as a protocol failure"""
+        mock_exchange.side_effect = [
+            (MSG_TYPE_READ_ACK, 26, 0),
+            (MSG_TYPE_READ_ACK, 25, 0x1234),
+        ]
+
+        result = await opentherm_exchange_retry(0, 25, 0)
+        self.assertEqual(result, (MSG_TYPE_READ_ACK, 25, 0x1234))
+        self.assertEqual(self.policy.stats()["protocol"], dict(retries=1, give_ups=0))
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_persistent_mismatch_returned(self, mock_exchange, mock_sleep):
+        """Once the protocol budget is spent, the last response goes back for the caller to reject"""
+        mock_exchange.return_value = (MSG_TYPE_WRITE_ACK, 25, 0)
+
+        result = await opentherm_exchange_retry(0, 25, 0)
+        self.assertEqual(result, (MSG_TYPE_WRITE_ACK, 25, 0))
+        self.assertEqual(mock_exchange.call_count, self.policy.budgets[3] + 1)
+        self.assertEqual(self.policy.stats()["protocol"]["give_ups"], 1)
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_deadline_gives_up_early(self, mock_exchange, mock_sleep):
+        """No retry is started that wouldn't finish within the deadline"""
+        async def slow_timeout(*args):
+            await asyncio.sleep(0.03)
+            raise Exception("Timeout waiting for response")
+        mock_exchange.side_effect = slow_timeout
+
+        with self.assertRaises(Exception):
+            await opentherm_exchange_retry(0, 25, 0, deadline_ms=60)
+
+        self.assertEqual(mock_exchange.call_count, 1)
+        self.assertEqual(self.policy.stats()["timeout"], dict(retries=0, give_ups=1))
+
+    @patch('asyncio.sleep_ms', real_sleep_ms, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_background_gives_up_before_reserved_slot(self, mock_exchange):
+        """A background retry that would run into the mandatory slot isn't attempted"""
+        async def slow_timeout(*args):
+            await asyncio.sleep(0.03)
+            raise Exception("Timeout waiting for response")
+        mock_exchange.side_effect = slow_timeout
+
+        bus = OpenThermBus(opentherm_app._exchange, gap_ms=5, conversation_ms=5)
+        with patch('opentherm_app.bus', bus):
+            bus.reserve(ticks_ms() + 60, 100)
+            with self.assertRaises(Exception):
+                await opentherm_exchange_retry(0, 25, 0)
+            self.assertEqual(mock_exchange.call_count, 1)
+
+            # the mandatory exchange itself keeps retrying
+            mock_exchange.reset_mock()
+            mock_exchange.side_effect = [Exception("Timeout waiting for response"), (MSG_TYPE_READ_ACK, 0, 0)]
+            self.assertEqual(await opentherm_exchange_retry(0, 0, 0, priority=PRIORITY_MANDATORY), (MSG_TYPE_READ_ACK, 0, 0))
+
+
 class TestExceptionTypes(unittest.TestCase):
     """Test that the custom exception types are proper Exception subclasses"""
 
@@ -0,0 +1,176 @@
+"""Tests for the gateway engine in opentherm_gateway.py, between simulated thermostat and boiler"""
+
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from opentherm_gateway import Gateway, RESPONSE_WINDOW_MS, REFRESH_TIMEOUT_MS
+from sim import host
+from sim.boiler_sim import BoilerSim
+from sim.thermostat_sim import ThermostatSim
+
+
+def run_virtual(gateway, seconds, during=None):
+    """Run the gateway for seconds of virtual time; during, if given, is a coroutine run alongside."""
+    clock = host.VirtualClock()
+    loop = host.VirtualTimeLoop(clock)
+
+    async def runner():
+        tasks = [asyncio.create_task(gateway.run())]
+        if during is not None:
+            tasks.append(asyncio.create_task(during))
+        await asyncio.sleep(seconds)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        with patch('time.monotonic_ns', clock.monotonic_ns), patch('opentherm_gateway.send_syslog'):
+            loop.run_until_complete(runner())
+    finally:
+        loop.close()
+
+
+def replies(thermostat, data_id):
+    return [(reply, latency) for request, reply, latency in thermostat.conversations if request[1] == data_id]
+
+
+class TestGatewayForwarding(unittest.TestCase):
+
+    def test_forwards_within_window(self):
+        boiler = BoilerSim(latency_ms=(20, 200), seed=1)
+        thermostat = ThermostatSim([(0, 0, 0x0300), (1, 1, 40 * 256), (0, 25, 0), (0, 35, 0)])
+        gateway = Gateway(thermostat, boiler.opentherm_exchange)
+        run_virtual(gateway, 20)
+
+        self.assertGreater(len(thermostat.conversations), 40)
+        for request, reply, latency in thermostat.conversations:
+            self.assertIsNotNone(reply, request)
+            self.assertLessEqual(latency, RESPONSE_WINDOW_MS)
+            # forwarding adds little beyond the boiler's own latency and frame
+            self.assertLessEqual(latency, 200 + 2 * 34 + 20 + 5)
+        self.assertEqual(boiler.model.tset_c, 40)
+        self.assertTrue(boiler.model.ch_enabled)
+        flow = replies(thermostat, 25)[-1][0]
+        self.assertEqual(flow[:2], (4, 25))
+        # UNKNOWN-DATAID passed through as is
+        self.assertEqual(replies(thermostat, 35)[-1][0][0], 7)
+        self.assertEqual(gateway.stats['no_reply'], 0)
+
+    def test_overrides(self):
+        boiler = BoilerSim(latency_ms=(20, 100), seed=2)
+        thermostat = ThermostatSim([(0, 0, 0x0300), (1, 1, 40 * 256), (1, 56, 50 * 256)])
+        gateway = Gateway(thermostat, boiler.opentherm_exchange)
+        gateway.overrides[1] = 60 * 256
+        gateway.overrides[56] = 45 * 256
+        # DHW off at the boiler, whatever the thermostat says
+        gateway.overrides[0] = 0x0100
+        run_virtual(gateway, 10)
+
+        self.assertEqual(boiler.model.tset_c, 60)
+        self.assertEqual(boiler.model.dhw_setpoint_c, 45)
+        self.assertFalse(boiler.model.dhw_enabled)
+        # the thermostat sees its own values acknowledged
+        self.assertEqual(replies(thermostat, 1)[-1][0], (5, 1, 40 * 256))
+        self.assertEqual(replies(thermostat, 56)[-1][0], (5, 56, 50 * 256))
+        self.assertEqual(replies(thermostat, 0)[-1][0][2] >> 8, 0x03)
+        self.assertGreater(gateway.stats['overridden'], 0)
+
+    def test_boiler_not_answering(self):
+        boiler = BoilerSim(timeout_rate=1.0)
+        thermostat = ThermostatSim([(1, 1, 40 * 256)])
+        gateway = Gateway(thermostat, boiler.opentherm_exchange)
+        run_virtual(gateway, 5)
+
+        # nothing made up: the thermostat times out, as it would without the gateway
+        self.assertTrue(thermostat.conversations)
+        self.assertTrue(all(reply is None for _, reply, _ in thermostat.conversations))
+        self.assertEqual(gateway.stats['forwarded'], 0)
+        self.assertGreater(gateway.stats['no_reply'], 0)
+
+    def test_bad_frames_skipped(self):
+        boiler = BoilerSim(latency_ms=(20, 100), seed=3)
+        thermostat = ThermostatSim([(0, 0, 0x0300), None, (0, 25, 0)])
+        gateway = Gateway(thermostat, boiler.opentherm_exchange)
+        run_virtual(gateway, 5)
+
+        self.assertGreater(gateway.stats['bad_frames'], 0)
+        self.assertTrue(all(reply is not None for _, reply, _ in thermostat.conversations))
+
+
+class TestGatewayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.boiler = BoilerSim(latency_ms=(20, 100), seed=4)
+        # the boiler takes longer than the window on ID 26 (DHW temperature)
+        self.slow = BoilerSim(latency_ms=(450, 450), seed=5)
+        self.slow.model = self.boiler.model
+
+    async def exchange(self, msg_type, data_id, data_value, timeout_ms=1000):
+        sim = self.slow if data_id == 26 else self.boiler
+        return await sim.opentherm_exchange(msg_type, data_id, data_value, timeout_ms)
+
+    def test_slow_id_answered_from_cache(self):
+        thermostat = ThermostatSim([(0, 0, 0x0300), (0, 26, 0)])
+        gateway = Gateway(thermostat, self.exchange, refresh_ms=30 * 1000)
+        run_virtual(gateway, 20)
+
+        dhw = replies(thermostat, 26)
+        # the first one can't be answered in time; the refresh after it fills the cache
+        self.assertIsNone(dhw[0][0])
+        self.assertGreater(len(dhw), 5)
+        for reply, latency in dhw[1:]:
+            self.assertEqual(reply[:2], (4, 26))
+            self.assertLess(latency, 20)
+        self.assertEqual(gateway.slow, {26})
+        self.assertEqual(gateway.stats['refreshes'], 1)
+        # the others are still forwarded
+        self.assertTrue(all(reply is not None for reply, _ in replies(thermostat, 0)))
+
+    def test_slow_id_forwarded_again_once_quick(self):
+        thermostat = ThermostatSim([(0, 0, 0x0300), (0, 26, 0)])
+        gateway = Gateway(thermostat, self.exchange, refresh_ms=2000)
+
+        async def speed_up():
+            await asyncio.sleep(5)
+            self.slow.latency_ms = (20, 50)
+
+        run_virtual(gateway, 15, during=speed_up())
+        self.assertEqual(gateway.slow, set())
+        self.assertGreater(gateway.stats['forwarded'], gateway.stats['from_cache'])
+
+    def test_requests_served_during_refresh(self):
+        thermostat = ThermostatSim([(0, 26, 0)])
+        gateway = Gateway(thermostat, self.exchange, refresh_ms=1000)
+        during = []  # thermostat conversations completed while each refresh was out at the boiler
+
+        async def exchange(msg_type, data_id, data_value, timeout_ms=1000):
+            if timeout_ms != REFRESH_TIMEOUT_MS:
+                return await self.exchange(msg_type, data_id, data_value, timeout_ms)
+            before = len(thermostat.conversations)
+            try:
+                return await self.exchange(msg_type, data_id, data_value, timeout_ms)
+            finally:
+                during.append(len(thermostat.conversations) - before)
+
+        gateway.exchange = exchange
+        run_virtual(gateway, 10)
+
+        self.assertGreater(gateway.stats['refreshes'], 3)
+        # the refresh takes 450ms at the boiler: the thermostat is answered from the cache meanwhile
+        self.assertTrue(all(n >= 2 for n in during[1:]), during)
+        self.assertTrue(all(reply is not None for reply, _ in replies(thermostat, 26)[1:]))
+
+    def test_stale_cache_not_used(self):
+        thermostat = ThermostatSim([(0, 26, 0)])
+        gateway = Gateway(thermostat, self.exchange, refresh_ms=60 * 1000, cache_max_age_ms=3000)
+        run_virtual(gateway, 10)
+
+        # answered from the cache only while it was fresh; then refreshed and answered again
+        dhw = replies(thermostat, 26)
+        self.assertTrue(any(reply is None for reply, _ in dhw[1:]))
+        self.assertGreater(gateway.stats['refreshes'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests for the passive-monitor frame ring in opentherm_monitor.py"""
+
+import asyncio
+import unittest
+
+from opentherm_monitor import FrameRing, FLAG_DECODE, FLAG_PARITY, FLAG_OVERRUN
+
+
+class TestFrameRing(unittest.TestCase):
+
+    def test_fifo_order_across_wrap(self):
+        ring = FrameRing(4)
+        for i in range(3):
+            ring.append(i, 0x1000 + i)
+        self.assertEqual(ring.pop(), (0, 0x1000, 0))
+        for i in range(3, 6):
+            ring.append(i, 0x1000 + i, FLAG_PARITY if i == 5 else 0)
+        self.assertEqual(len(ring), 5 - 1)
+        self.assertEqual([ring.pop() for _ in range(4)], [(1, 0x1001, 0), (2, 0x1002, 0), (3, 0x1003, 0), (4, 0x1004, 0)])
+        self.assertIsNone(ring.pop())
+
+    def test_full_ring_drops_and_flags_the_gap(self):
+        ring = FrameRing(2)
+        for i in range(5):
+            ring.append(i, 0xc0000000 + i)
+        self.assertEqual(ring.dropped, 3)
+        self.assertEqual(ring.pop(), (0, 0xc0000000, 0))
+        ring.append(9, 0xc0000009, FLAG_DECODE)
+        self.assertEqual(ring.pop(), (1, 0xc0000001, 0))
+        self.assertEqual(ring.pop(), (9, 0xc0000009, FLAG_DECODE | FLAG_OVERRUN))
+        # only the first frame after the gap
+        ring.append(10, 0)
+        self.assertEqual(ring.pop(), (10, 0, 0))
+
+    def test_ticks_wrap_like_micropython(self):
+        ring = FrameRing(2)
+        ring.append((1 << 40) + 123, 0xffffffff)
+        self.assertEqual(ring.pop(), (123, 0xffffffff, 0))
+
+    def test_clear(self):
+        ring = FrameRing(2)
+        ring.append(1, 1)
+        ring.clear()
+        self.assertEqual(len(ring), 0)
+        self.assertIsNone(ring.pop())
+
+
+class TestFrameRingIterator(unittest.IsolatedAsyncioTestCase):
+
+    async def test_async_for_waits_for_frames(self):
+        ring = FrameRing(8)
+        ring.append(1, 0x10)
+
+        async def capture():
+            for i in range(2, 5):
+                await asyncio.sleep(0.01)
+                ring.append(i, 0x10 + i)
+
+        task = asyncio.create_task(capture())
+        received = []
+        async for entry in ring:
+            received.append(entry)
+            if len(received) == 4:
+                break
+        await task
+        self.assertEqual([t for t, _, _ in received], [1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests for the adaptive per-ID poll scheduler in opentherm_poll.py"""
+
+import unittest
+from unittest.mock import patch
+
+import opentherm_poll
+from opentherm_poll import PollScheduler, FLAME_MAX_DIVISOR
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch.object(opentherm_poll, 'ticks_ms', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.poller = PollScheduler()
+
+    def poll(self, data_id, value):
+        self.assertIn(data_id, self.poller.due())
+        self.poller.update(data_id, value)
+        return self.poller.stats()[data_id]['interval_ms']
+
+    def test_new_ids_due_immediately(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        self.poller.add(18, 10000, 120000, 0.05)
+        self.assertEqual(sorted(self.poller.due()), [18, 25])
+        self.assertEqual(self.poller.next_due_ms(), 0)
+
+    def test_nothing_scheduled(self):
+        self.assertEqual(self.poller.due(), [])
+        self.assertEqual(self.poller.next_due_ms(), -1)
+
+    def test_steady_value_backs_off_to_max(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        intervals = []
+        for _ in range(12):
+            intervals.append(self.poll(25, 60.0))
+            self.clock.now += intervals[-1]
+        self.assertEqual(intervals[0], 2000)
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(intervals[-1], 30000)
+
+    def test_moving_value_polled_faster(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        interval = 0
+        for _ in range(12):
+            interval = self.poll(25, 40.0)
+            self.clock.now += interval
+        self.assertEqual(interval, 30000)
+
+        # 2 degrees moved in one interval: aim for half a degree per poll
+        self.assertEqual(self.poll(25, 42.0), 30000 // 4)
+
+    def test_interval_clamped_to_min(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        self.poll(25, 20.0)
+        self.clock.now += 2000
+        self.assertEqual(self.poll(25, 80.0), 2000)
+
+    def test_zero_deadband_resets_on_any_change(self):
+        self.poller.add(5, 10000, 60000, 0)
+        self.poll(5, 0)
+        for _ in range(3):
+            self.clock.now += self.poller.stats()[5]['interval_ms']
+            self.poll(5, 0)
+        self.clock.now += self.poller.stats()[5]['interval_ms']
+        self.assertEqual(self.poll(5, 0x0400), 10000)
+
+    def test_due_after_interval(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        self.poll(25, 60.0)
+        self.assertEqual(self.poller.due(), [])
+        self.assertEqual(self.poller.next_due_ms(), 2000)
+        self.clock.now += 1999
+        self.assertEqual(self.poller.due(), [])
+        self.clock.now += 1
+        self.assertEqual(self.poller.due(), [25])
+
+    def test_most_overdue_first(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        self.poller.add(18, 2000, 120000, 0.05)
+        self.poll(18, 1.5)
+        self.clock.now += 1000
+        self.poll(25, 60.0)
+        self.clock.now += 10000
+        self.assertEqual(self.poller.due(), [18, 25])
+
+    def test_failure_backs_off(self):
+        self.poller.add(35, 2000, 60000, 60)
+        self.poller.failed(35)
+        self.poller.failed(35)
+        stats = self.poller.stats()[35]
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual(stats['reads'], 0)
+        self.assertEqual(stats['interval_ms'], 2000 * 3 // 2 * 3 // 2)
+
+    def test_flame_caps_interval_and_pulls_polls_in(self):
+        self.poller.add(25, 2000, 40000, 0.5)
+        interval = 0
+        for _ in range(12):
+            interval = self.poll(25, 60.0)
+            self.clock.now += interval
+        self.assertEqual(interval, 40000)
+        self.clock.now -= interval - 100
+
+        # flame comes on: the next poll is brought forward to the min interval...
+        self.poller.set_flame(True)
+        self.assertEqual(self.poller.next_due_ms(), 2000)
+
+        # ...and steady values only back off to max / FLAME_MAX_DIVISOR
+        for _ in range(12):
+            self.clock.now += self.poller.next_due_ms()
+            interval = self.poll(25, 60.0)
+        self.assertEqual(interval, 40000 // FLAME_MAX_DIVISOR)
+
+        self.poller.set_flame(False)
+        for _ in range(12):
+            self.clock.now += self.poller.next_due_ms()
+            interval = self.poll(25, 60.0)
+        self.assertEqual(interval, 40000)
+
+    def test_stats_rate(self):
+        self.poller.add(25, 2000, 2000, 0.5)
+        for _ in range(30):
+            self.poll(25, 60.0)
+            self.clock.now += 2000
+        stats = self.poller.stats()[25]
+        self.assertEqual(stats['reads'], 30)
+        self.assertAlmostEqual(stats['per_minute'], 30.0)
+
+    def test_remove(self):
+        self.poller.add(25, 2000, 30000, 0.5)
+        self.poller.remove(25)
+        self.assertEqual(self.poller.due(), [])
+        self.assertNotIn(25, self.poller.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests for the retry policy in opentherm_retry.py"""
+
+import unittest
+
+from opentherm_retry import (
+    RetryPolicy,
+    FAIL_TIMEOUT,
+    FAIL_DECODE,
+    FAIL_PARITY,
+    FAIL_PROTOCOL,
+    FAIL_OTHER,
+)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_classify(self):
+        policy = RetryPolicy()
+        self.assertEqual(policy.classify(Exception("Timeout waiting for response")), FAIL_TIMEOUT)
+        self.assertEqual(policy.classify(Exception("Timeout waiting for transmit")), FAIL_TIMEOUT)
+        self.assertEqual(policy.classify(ValueError("Manchester decoding error")), FAIL_DECODE)
+        self.assertEqual(policy.classify(ValueError("Parity bit error")), FAIL_PARITY)
+        self.assertEqual(policy.classify(ValueError("Expected data_id 0, got 1")), FAIL_PROTOCOL)
+        self.assertEqual(policy.classify(OSError(5)), FAIL_OTHER)
+
+    def test_budget_per_class(self):
+        policy = RetryPolicy(budgets=(2, 1, 1, 1, 1))
+        self.assertGreaterEqual(policy.delay_ms(FAIL_TIMEOUT, 0), 0)
+        self.assertGreaterEqual(policy.delay_ms(FAIL_TIMEOUT, 1), 0)
+        self.assertEqual(policy.delay_ms(FAIL_TIMEOUT, 2), -1)
+        self.assertEqual(policy.delay_ms(FAIL_PARITY, 1), -1)
+
+    def test_backoff_doubles_with_jitter(self):
+        policy = RetryPolicy(backoff_ms=(10, 10, 10, 10, 10), max_backoff_ms=35)
+        for attempt, base in ((0, 10), (1, 20), (2, 35), (3, 35)):
+            delays = {policy.delay_ms(FAIL_OTHER, attempt) for _ in range(50)}
+            self.assertGreaterEqual(min(delays), base)
+            self.assertLess(max(delays), base + 10)
+            # jittered, so concurrent retries spread out
+            self.assertGreater(len(delays), 1)
+
+    def test_zero_backoff(self):
+        policy = RetryPolicy(backoff_ms=(0, 0, 0, 0, 0))
+        self.assertEqual(policy.delay_ms(FAIL_DECODE, 0), 0)
+
+    def test_stats(self):
+        policy = RetryPolicy()
+        policy.retried(FAIL_PARITY)
+        policy.retried(FAIL_PARITY)
+        policy.gave_up(FAIL_TIMEOUT)
+
+        stats = policy.stats()
+        self.assertEqual(stats["parity"], dict(retries=2, give_ups=0))
+        self.assertEqual(stats["timeout"], dict(retries=0, give_ups=1))
+        self.assertEqual(set(stats), {"timeout", "decode", "parity", "protocol", "other"})
+
+        policy.reset()
+        self.assertEqual(policy.stats()["parity"], dict(retries=0, give_ups=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,332 @@
+"""Tests for opentherm_rp2.py against the fake rp2 StateMachine/IRQ surface"""
+
+import asyncio
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+from lib import frame_encode_manchester, frame_encode
+from sim.host import VirtualClock, VirtualTimeLoop
+from unittests import fake_rp2
+
+
+TX_MS = 34  # start bit + 32 bits + stop bit at 1ms per bit
+
+
+class RP2Fixture:
+    dma = False  # whether the firmware has rp2.DMA
+
+    def setUp(self):
+        cm = fake_rp2.install(fake_rp2.make_rp2(dma=self.dma))
+        cm.__enter__()
+        self.addCleanup(cm.__exit__, None, None, None)
+
+        import opentherm_rp2
+        self.ot = opentherm_rp2
+        self.sm_tx = opentherm_rp2.sm_opentherm_tx
+        self.sm_rx = opentherm_rp2.sm_opentherm_rx
+
+    def script_boiler(self, response, latency_ms, tx_ms=TX_MS):
+        """Make the fake PIO transmit in tx_ms and answer latency_ms after the request ends."""
+        loop = asyncio.get_running_loop()
+        tx_end = []
+
+        def tx_active(sm):
+            def done():
+                tx_end.append(loop.time())
+                sm.fire_irq()
+            loop.call_later(tx_ms / 1000, done)
+
+        def rx_active(sm):
+            if response is None:
+                return
+
+            def done():
+                sm.push(*response)
+                sm.fire_irq()
+            delay = tx_end[0] + latency_ms / 1000 + TX_MS / 1000 - loop.time()
+            loop.call_later(max(delay, 0), done)
+
+        self.sm_tx.on_active = tx_active
+        self.sm_rx.on_active = rx_active
+
+
+class OpenThermRP2TestCase(RP2Fixture, unittest.IsolatedAsyncioTestCase):
+    pass
+
+
+class TestOpenThermExchangeTiming(RP2Fixture, unittest.TestCase):
+    """Exchange timing, in virtual time so that a busy machine can't skew it"""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = VirtualClock()
+        patcher = patch.object(time, "monotonic_ns", self.clock.monotonic_ns)  # lib.ticks_ms()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loop = VirtualTimeLoop(self.clock)
+        self.addCleanup(self.loop.close)
+
+    def test_exchange_resumes_when_frame_lands(self):
+        # the response lands 120ms after the request, plus its own transmission time
+        latency_ms = 120
+
+        async def exchange():
+            self.script_boiler(frame_encode_manchester(4, 0, 0x0a), latency_ms=latency_ms)
+            start = self.loop.time()
+            await self.ot.opentherm_exchange(0, 0, 0)
+            return (self.loop.time() - start) * 1000
+
+        elapsed_ms = self.loop.run_until_complete(exchange())
+
+        # woken by the IRQ as the frame lands: sleep-polling the FIFO would add up to 10ms
+        self.assertAlmostEqual(elapsed_ms, TX_MS + latency_ms + TX_MS, delta=1)
+
+    def test_exchange_timing(self):
+        async def exchange(response, latency_ms, **kwargs):
+            self.script_boiler(response, latency_ms=latency_ms)
+            await self.ot.opentherm_exchange(0, 0, 0, **kwargs)
+
+        self.loop.run_until_complete(exchange(frame_encode_manchester(4, 0, 0x0a), 120))
+        self.assertAlmostEqual(self.ot.timing[self.ot.TIMING_TX], TX_MS, delta=1)
+        self.assertAlmostEqual(self.ot.timing[self.ot.TIMING_LATENCY], 120, delta=1)
+
+        # a timeout has no latency
+        with self.assertRaises(Exception):
+            self.loop.run_until_complete(exchange(None, 0, timeout_ms=50))
+        self.assertAlmostEqual(self.ot.timing[self.ot.TIMING_TX], TX_MS, delta=1)
+        self.assertEqual(self.ot.timing[self.ot.TIMING_LATENCY], -1)
+
+
+class TestOpenThermExchange(OpenThermRP2TestCase):
+
+    async def test_exchange_roundtrip(self):
+        self.script_boiler(frame_encode_manchester(4, 25, 0x3c80), latency_ms=30)
+
+        result = await self.ot.opentherm_exchange(0, 25, 0)
+
+        self.assertEqual(result, (4, 25, 0x3c80))
+        self.assertEqual(self.sm_tx.tx, list(frame_encode_manchester(0, 25, 0, invert=True)))
+        self.assertEqual(self.sm_rx.tx, [self.ot.PIO_RX_BITS - 1])
+        self.assertFalse(self.sm_tx.active())
+        self.assertFalse(self.sm_rx.active())
+
+    async def test_exchange_timeout(self):
+        self.script_boiler(None, latency_ms=0)
+
+        start = time.monotonic()
+        with self.assertRaises(Exception) as ctx:
+            await self.ot.opentherm_exchange(0, 0, 0, timeout_ms=50)
+        elapsed_ms = (time.monotonic() - start) * 1000
+
+        self.assertIn("Timeout waiting for response", str(ctx.exception))
+        self.assertGreaterEqual(elapsed_ms, TX_MS + 20 + 50 - 1)
+        self.assertFalse(self.sm_rx.active())
+
+    async def test_exchange_tx_timeout(self):
+        self.sm_tx.on_active = lambda sm: None
+
+        with self.assertRaises(Exception) as ctx:
+            await self.ot.opentherm_exchange(0, 0, 0)
+        self.assertIn("Timeout waiting for transmit", str(ctx.exception))
+        self.assertFalse(self.sm_tx.active())
+
+    def test_fifo_fallback_without_dma(self):
+        self.assertIsNone(self.ot.tx_dma)
+
+    async def test_exchange_manchester_error(self):
+        hi, lo = frame_encode_manchester(4, 0, 0)
+        self.script_boiler((hi | 0xc0000000, lo), latency_ms=20)
+
+        with self.assertRaises(ValueError):
+            await self.ot.opentherm_exchange(0, 0, 0)
+
+    async def test_stale_rx_words_discarded(self):
+        self.sm_rx.push(0xdeadbeef, 0xdeadbeef)
+        self.script_boiler(frame_encode_manchester(5, 1, 0x4000), latency_ms=20)
+
+        self.assertEqual(await self.ot.opentherm_exchange(1, 1, 0x4000), (5, 1, 0x4000))
+
+
+class TestOpenThermExchangeDMA(OpenThermRP2TestCase):
+    """With rp2.DMA, the request is DMAed to the TX FIFO from tx_buf."""
+    dma = True
+
+    async def test_exchange_roundtrip(self):
+        self.script_boiler(frame_encode_manchester(4, 25, 0x3c80), latency_ms=30)
+
+        self.assertEqual(await self.ot.opentherm_exchange(0, 25, 0), (4, 25, 0x3c80))
+        dma = self.ot.tx_dma
+        self.assertEqual(dma.transfers, [list(frame_encode_manchester(0, 25, 0, invert=True))])
+        self.assertEqual(dma.write, self.ot.PIO0_TXF0)
+        self.assertEqual(dma.ctrl, dict(size=2, inc_write=False, treq_sel=self.ot.DREQ_PIO0_TX0))
+        # the CPU never put() to the FIFO
+        self.assertEqual(self.sm_tx.tx, [])
+
+    async def test_buffer_reused(self):
+        self.script_boiler(frame_encode_manchester(4, 0, 0x0a), latency_ms=20)
+        buf = self.ot.tx_buf
+        await self.ot.opentherm_exchange(0, 0, 0x0300)
+        await self.ot.opentherm_exchange(1, 1, 0x4000)
+
+        self.assertIs(self.ot.tx_buf, buf)
+        self.assertEqual(self.ot.tx_dma.transfers[1], list(frame_encode_manchester(1, 1, 0x4000, invert=True)))
+
+    async def test_tx_timeout_aborts_dma(self):
+        self.sm_tx.on_active = lambda sm: None
+        self.ot.tx_dma.active(1)
+
+        with self.assertRaises(Exception) as ctx:
+            await self.ot.opentherm_exchange(0, 0, 0)
+        self.assertIn("Timeout waiting for transmit", str(ctx.exception))
+        self.assertFalse(self.ot.tx_dma.active())
+
+
+class TestOpenThermExchangeDecodeMode(OpenThermRP2TestCase):
+    """RX_DECODE: the PIO pushes the decoded frame."""
+
+    def setUp(self):
+        super().setUp()
+        self.ot.init_rx(self.ot.RX_DECODE)
+
+    def test_init_swaps_program(self):
+        self.assertEqual(self.sm_rx.program, self.ot.opentherm_rx_decode)
+        self.assertIn((1, self.ot.opentherm_rx), sys.modules['rp2'].PIO.removed)
+        self.ot.init_rx(self.ot.RX_RAW)
+        self.assertEqual(self.sm_rx.program, self.ot.opentherm_rx)
+
+    async def test_exchange_roundtrip(self):
+        self.script_boiler((frame_encode(4, 25, 0x3c80),), latency_ms=30)
+
+        self.assertEqual(await self.ot.opentherm_exchange(0, 25, 0), (4, 25, 0x3c80))
+        self.assertEqual(self.sm_rx.tx, [self.ot.PIO_RX_FRAME_BITS - 1])
+
+    async def test_exchange_violation(self):
+        self.script_boiler((0x3, self.ot.PIO_RX_VIOLATION), latency_ms=20)
+
+        with self.assertRaises(ValueError) as ctx:
+            await self.ot.opentherm_exchange(0, 0, 0)
+        self.assertIn("Manchester decoding error", str(ctx.exception))
+
+    async def test_exchange_parity_error(self):
+        self.script_boiler((frame_encode(4, 25, 0x3c80) ^ 1,), latency_ms=20)
+
+        with self.assertRaises(ValueError) as ctx:
+            await self.ot.opentherm_exchange(0, 25, 0)
+        self.assertIn("Parity bit error", str(ctx.exception))
+
+    async def test_exchange_timeout(self):
+        self.script_boiler(None, latency_ms=0)
+
+        with self.assertRaises(Exception) as ctx:
+            await self.ot.opentherm_exchange(0, 0, 0, timeout_ms=50)
+        self.assertIn("Timeout waiting for response", str(ctx.exception))
+
+
+class TestMonitor(OpenThermRP2TestCase):
+    """Passive monitor mode: RX runs continuously, every frame goes into a FrameRing."""
+
+    def setUp(self):
+        super().setUp()
+        from opentherm_monitor import FrameRing
+        self.ring = FrameRing(8)
+        self.ot.monitor_start(self.ring)
+        self.addCleanup(self.ot.monitor_stop)
+
+    def test_start(self):
+        self.assertEqual(self.sm_rx.program, self.ot.opentherm_rx_decode)
+        self.assertTrue(self.sm_rx.active())
+        self.assertEqual(self.sm_rx.tx, [self.ot.PIO_RX_FRAME_BITS - 1])
+
+    def test_records_frames_and_rearms(self):
+        from opentherm_monitor import FLAG_DECODE, FLAG_PARITY
+        frames = [frame_encode(0, 0, 0x0300), frame_encode(4, 0, 0x000a)]
+        for frame in frames:
+            self.sm_rx.push(frame)
+            self.sm_rx.fire_irq()
+        self.sm_rx.push(0x3, self.ot.PIO_RX_VIOLATION)
+        self.sm_rx.fire_irq()
+        self.sm_rx.push(frames[0] ^ 1)
+        self.sm_rx.fire_irq()
+
+        entries = [self.ring.pop() for _ in range(4)]
+        self.assertEqual([(frame, flags) for _, frame, flags in entries],
+                         [(frames[0], 0), (frames[1], 0), (0x3, FLAG_DECODE), (frames[0] ^ 1, FLAG_PARITY)])
+        self.assertEqual(self.sm_rx.rx, [])
+        ticks = [t for t, _, _ in entries]
+        self.assertEqual(ticks, sorted(ticks))
+        # restarted and given the bit count again after every frame
+        self.assertEqual(self.sm_rx.tx, [self.ot.PIO_RX_FRAME_BITS - 1] * 5)
+
+    async def test_exchange_after_stop(self):
+        self.ot.monitor_stop()
+        self.script_boiler((frame_encode(4, 25, 0x3c80),), latency_ms=20)
+        self.assertEqual(await self.ot.opentherm_exchange(0, 25, 0), (4, 25, 0x3c80))
+        self.assertEqual(len(self.ring), 0)
+
+
+class TestThermostatPort(OpenThermRP2TestCase):
+    """The gateway's slave side, on SMs 1 and 5."""
+
+    def setUp(self):
+        super().setUp()
+        self.port = self.ot.ThermostatPort()
+
+    def test_state_machines(self):
+        self.assertEqual((self.port.sm_tx.id, self.port.sm_rx.id), (1, 5))
+        # the RX program is shared with sm_opentherm_rx, which has to be running the same one
+        self.assertEqual(self.port.sm_rx.program, self.ot.opentherm_rx_decode)
+        self.assertEqual(self.sm_rx.program, self.ot.opentherm_rx_decode)
+        self.assertTrue(self.port.sm_rx.active())
+
+    def test_rx_mode_held_while_open(self):
+        # swapping RX_DECODE out of PIO1 would leave SM 5 running whatever took its place
+        with self.assertRaises(RuntimeError):
+            self.ot.init_rx(self.ot.RX_RAW)
+        self.assertEqual(self.sm_rx.program, self.ot.opentherm_rx_decode)
+        self.assertTrue(self.port.sm_rx.active())
+        # staying in RX_DECODE is fine, and leaves the program loaded
+        removed = len(sys.modules['rp2'].PIO.removed)
+        self.ot.init_rx(self.ot.RX_DECODE)
+        self.assertEqual(len(sys.modules['rp2'].PIO.removed), removed)
+        with self.assertRaises(RuntimeError):
+            self.ot.ThermostatPort()
+
+        self.port.close()
+        self.assertFalse(self.port.sm_rx.active())
+        self.ot.init_rx(self.ot.RX_RAW)
+        self.assertEqual(self.sm_rx.program, self.ot.opentherm_rx)
+
+    async def test_receive(self):
+        self.port.sm_rx.push(frame_encode(1, 1, 40 * 256))
+        self.port.sm_rx.fire_irq()
+        self.port.sm_rx.push(0x1, self.ot.PIO_RX_VIOLATION)
+        self.port.sm_rx.fire_irq()
+
+        received_ms, *request = await self.port.receive()
+        self.assertEqual(request, [1, 1, 40 * 256])
+        with self.assertRaises(ValueError):
+            await self.port.receive()
+
+    async def test_receive_across_ticks_wrap(self):
+        # MicroPython's ticks wrap at 2**30: 5ms after the wrap, for a frame that ended 20ms ago
+        period = 1 << 30
+        with patch.multiple(self.ot, ticks_ms=lambda: 5, ticks_us=lambda: 5000,
+                            ticks_diff=lambda a, b: ((a - b + period // 2) % period) - period // 2,
+                            ticks_add=lambda a, b: (a + b) % period):
+            self.port.ring.append(period - 15000, frame_encode(0, 0, 0x0300), 0)
+            received_ms, *request = await self.port.receive()
+        self.assertEqual(received_ms, period - 15)
+        self.assertEqual(request, [0, 0, 0x0300])
+
+    async def test_reply(self):
+        self.port.sm_tx.on_active = lambda sm: asyncio.get_running_loop().call_later(TX_MS / 1000, sm.fire_irq)
+
+        await self.port.reply(5, 1, 40 * 256)
+        self.assertEqual(self.port.sm_tx.tx, list(frame_encode_manchester(5, 1, 40 * 256, invert=True)))
+        self.assertFalse(self.port.sm_tx.active())
+
+
+if __name__ == '__main__':
+    unittest.main()
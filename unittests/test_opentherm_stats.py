@@ -0,0 +1,176 @@
+"""Tests for the exchange timing histograms in opentherm_stats.py"""
+
+import json
+import unittest
+import asyncio
+from unittest.mock import patch, AsyncMock
+
+import opentherm_app
+from opentherm_retry import RetryPolicy, FAIL_TIMEOUT, FAIL_DECODE, FAIL_PARITY, FAIL_PROTOCOL
+from opentherm_stats import (
+    ExchangeStats,
+    bucket,
+    BUCKETS_MS,
+    N_BUCKETS,
+    HIST_TX,
+    HIST_LATENCY,
+    HIST_TOTAL,
+    COUNT_RETRIES,
+)
+
+
+def async_test(coro):
+    """Decorator to run async test methods"""
+    def wrapper(*args, **kwargs):
+        return asyncio.run(coro(*args, **kwargs))
+    return wrapper
+
+
+class TestBucket(unittest.TestCase):
+
+    def test_bounds_are_inclusive(self):
+        self.assertEqual(bucket(0), 0)
+        self.assertEqual(bucket(BUCKETS_MS[0]), 0)
+        self.assertEqual(bucket(BUCKETS_MS[0] + 1), 1)
+        self.assertEqual(bucket(400), BUCKETS_MS.index(400))
+
+    def test_overflow(self):
+        self.assertEqual(bucket(BUCKETS_MS[-1] + 1), N_BUCKETS - 1)
+        self.assertEqual(bucket(100000), N_BUCKETS - 1)
+
+
+class TestExchangeStats(unittest.TestCase):
+
+    def test_record(self):
+        stats = ExchangeStats()
+        stats.record(0, 34, 85, 160)
+        stats.record(0, 34, 390, 460)
+        tx = stats.histogram(0, HIST_TX)
+        self.assertEqual(tx[bucket(34)], 2)
+        self.assertEqual(sum(tx), 2)
+        latency = stats.histogram(0, HIST_LATENCY)
+        self.assertEqual(latency[bucket(85)], 1)
+        self.assertEqual(latency[bucket(390)], 1)
+        self.assertEqual(stats.histogram(0, HIST_TOTAL)[bucket(460)], 1)
+        # another ID is kept apart
+        self.assertEqual(sum(stats.histogram(1, HIST_TX)), 0)
+
+    def test_unmeasured_timings_skipped(self):
+        stats = ExchangeStats()
+        stats.record(3, -1, -1, 120)
+        self.assertEqual(sum(stats.histogram(3, HIST_TX)), 0)
+        self.assertEqual(sum(stats.histogram(3, HIST_LATENCY)), 0)
+        self.assertEqual(sum(stats.histogram(3, HIST_TOTAL)), 1)
+
+    def test_counters(self):
+        stats = ExchangeStats()
+        stats.failed(25, FAIL_TIMEOUT)
+        stats.failed(25, FAIL_TIMEOUT)
+        stats.failed(25, FAIL_PARITY)
+        stats.retried(25)
+        self.assertEqual(stats.count(25, FAIL_TIMEOUT), 2)
+        self.assertEqual(stats.count(25, FAIL_PARITY), 1)
+        self.assertEqual(stats.count(25, FAIL_DECODE), 0)
+        self.assertEqual(stats.count(25, COUNT_RETRIES), 1)
+
+    def test_ids_past_max_share_a_slot(self):
+        stats = ExchangeStats(max_ids=2)
+        stats.record(0, 34, 50, 100)
+        stats.record(1, 34, 50, 100)
+        stats.record(5, 34, 50, 100)
+        stats.record(6, 34, 50, 100)
+        snapshot = stats.snapshot()
+        self.assertEqual(sorted(snapshot), ["0", "1", "other"])
+        self.assertEqual(sum(snapshot["other"]["total"]), 2)
+
+    def test_snapshot(self):
+        stats = ExchangeStats()
+        stats.record(17, 34, 50, 100)
+        stats.failed(17, FAIL_DECODE)
+        snapshot = stats.snapshot()
+        self.assertEqual(list(snapshot), ["17"])
+        self.assertEqual(len(snapshot["17"]["latency"]), N_BUCKETS)
+        self.assertEqual(snapshot["17"]["decode"], 1)
+        self.assertEqual(snapshot["17"]["retries"], 0)
+        json.dumps(snapshot)
+
+    def test_reset(self):
+        stats = ExchangeStats()
+        stats.record(0, 34, 50, 100)
+        stats.failed(0, FAIL_TIMEOUT)
+        stats.reset()
+        self.assertEqual(sum(stats.histogram(0, HIST_TOTAL)), 0)
+        self.assertEqual(stats.count(0, FAIL_TIMEOUT), 0)
+
+
+class TestDiagnostics(unittest.TestCase):
+    """opentherm_app records every exchange the bus makes"""
+
+    def setUp(self):
+        patcher = patch.multiple(opentherm_app, exchange_stats=ExchangeStats(), retry_policy=RetryPolicy())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_exchanges_recorded(self, mock_exchange, mock_sleep):
+        mock_exchange.side_effect = [
+            Exception("Timeout waiting for response"),
+            ValueError("Parity bit error"),
+            (opentherm_app.MSG_TYPE_READ_ACK, 25, 0x3000),
+        ]
+        await opentherm_app.opentherm_exchange_retry(0, 25, 0, max_retries=5, deadline_ms=10000)
+
+        stats = opentherm_app.exchange_stats
+        self.assertEqual(stats.count(25, FAIL_TIMEOUT), 1)
+        self.assertEqual(stats.count(25, FAIL_PARITY), 1)
+        self.assertEqual(stats.count(25, COUNT_RETRIES), 2)
+        # only the conversation that completed is timed; there are no PIO timings on the host
+        self.assertEqual(sum(stats.histogram(25, HIST_TOTAL)), 1)
+        self.assertEqual(sum(stats.histogram(25, HIST_TX)), 0)
+
+    @patch('asyncio.sleep_ms', new_callable=AsyncMock, create=True)
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_protocol_mismatch_counted(self, mock_exchange, mock_sleep):
+        # the boiler answers for the wrong data ID, then gets it right
+        mock_exchange.side_effect = [
+            (opentherm_app.MSG_TYPE_READ_ACK, 26, 0x3000),
+            (opentherm_app.MSG_TYPE_READ_ACK, 25, 0x3000),
+        ]
+        await opentherm_app.opentherm_exchange_retry(0, 25, 0, max_retries=5, deadline_ms=10000)
+
+        stats = opentherm_app.exchange_stats
+        self.assertEqual(stats.count(25, FAIL_PROTOCOL), 1)
+        self.assertEqual(stats.count(25, COUNT_RETRIES), 1)
+        self.assertEqual(stats.count(26, FAIL_PROTOCOL), 0)
+        # both conversations completed, so both are timed
+        self.assertEqual(sum(stats.histogram(25, HIST_TOTAL)), 2)
+
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_timings_from_pio(self, mock_exchange):
+        mock_exchange.return_value = (opentherm_app.MSG_TYPE_READ_ACK, 0, 0)
+        with patch.object(opentherm_app, "exchange_timing", [34, 120], create=True), \
+                patch.multiple(opentherm_app, TIMING_TX=0, TIMING_LATENCY=1, create=True):
+            await opentherm_app._exchange(0, 0, 0, 400)
+
+        stats = opentherm_app.exchange_stats
+        self.assertEqual(stats.histogram(0, HIST_TX)[bucket(34)], 1)
+        self.assertEqual(stats.histogram(0, HIST_LATENCY)[bucket(120)], 1)
+
+    @patch('opentherm_app.opentherm_exchange', new_callable=AsyncMock)
+    @async_test
+    async def test_diagnostics_json(self, mock_exchange):
+        mock_exchange.return_value = (opentherm_app.MSG_TYPE_READ_ACK, 0, 0)
+        await opentherm_app._exchange(0, 0, 0, 400)
+
+        diagnostics = json.loads(json.dumps(opentherm_app.diagnostics()))
+        self.assertEqual(diagnostics["buckets_ms"], list(BUCKETS_MS))
+        self.assertEqual(sum(diagnostics["ids"]["0"]["total"]), 1)
+        self.assertIn("timeout", diagnostics["retries"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,398 @@
+"""Tests for the PIO emulator in sim/pio.py, and opentherm_rp2's PIO programs run on it"""
+
+import unittest
+
+from lib import frame_encode_manchester, decode_manchester_frame, manchester_encode, frame_encode, frame_decode
+from sim import pio
+from unittests import fake_rp2
+
+
+def load_programs():
+    rp2 = fake_rp2.make_rp2()
+    rp2.asm_pio = pio.asm_pio
+    with fake_rp2.install(rp2):
+        import opentherm_rp2
+    return opentherm_rp2
+
+
+MS = 1_000_000  # ns
+
+
+class TestAssembler(unittest.TestCase):
+
+    def test_labels_delays_and_wrap(self):
+        @pio.asm_pio(set_init=pio.OUT_LOW)
+        def prog():
+            set(x, 3)
+            wrap_target()
+            label("loop")
+            set(pins, 1) [2]
+            jmp(x_dec, "loop")
+            nop()
+            wrap()
+            label("halt")
+            jmp("halt")
+
+        self.assertEqual(len(prog), 5)
+        self.assertEqual(prog.labels, dict(loop=1, halt=4))
+        self.assertEqual(prog.instructions[1].delay, 2)
+        self.assertEqual(prog.instructions[2].args[1], 1)
+        self.assertEqual((prog.wrap_target, prog.wrap), (1, 3))
+
+    def test_unknown_label(self):
+        with self.assertRaises(ValueError):
+            @pio.asm_pio()
+            def prog():
+                jmp("nowhere")
+
+    def test_too_long(self):
+        with self.assertRaises(ValueError):
+            @pio.asm_pio()
+            def prog():
+                for _ in range(33):
+                    nop()
+
+    def test_side_set_checked(self):
+        with self.assertRaises(ValueError):
+            @pio.asm_pio()
+            def no_sideset_init():
+                nop().side(1)
+        with self.assertRaises(ValueError):
+            @pio.asm_pio(sideset_init=pio.OUT_LOW)
+            def value_too_big():
+                nop().side(2)
+        # one side-set pin leaves 4 bits of delay
+        with self.assertRaises(ValueError):
+            @pio.asm_pio(sideset_init=pio.OUT_LOW)
+            def delay_too_long():
+                nop().side(1) [16]
+
+        @pio.asm_pio(sideset_init=(pio.OUT_LOW, pio.OUT_LOW))
+        def prog():
+            nop().side(3) [7]
+        self.assertEqual((prog.instructions[0].side_value, prog.instructions[0].delay), (3, 7))
+
+    def test_opentherm_programs_fit(self):
+        ot = load_programs()
+        # TX and RX live in separate PIO blocks, but each must fit its 32 instructions
+        self.assertLessEqual(len(ot.opentherm_tx), 32)
+        self.assertLessEqual(len(ot.opentherm_rx), 32)
+        self.assertTrue(ot.opentherm_tx.config['autopull'])
+        self.assertTrue(ot.opentherm_rx.config['autopush'])
+        self.assertLessEqual(len(ot.opentherm_rx_decode), 32)
+
+
+class TestInterpreter(unittest.TestCase):
+
+    def test_delay_timing(self):
+        @pio.asm_pio(set_init=pio.OUT_LOW)
+        def square():
+            set(pins, 1) [3]
+            set(pins, 0) [1]
+
+        sm = pio.StateMachine(0, square, freq=1000, set_base=5)
+        sm.active(1)
+        pio.run([sm], 13 * MS)
+        # 4 cycles high, 2 low, at 1ms a cycle
+        self.assertEqual(sm.gpio.edges[5], [(0, 0), (0, 1), (4 * MS, 0), (6 * MS, 1), (10 * MS, 0), (12 * MS, 1)])
+
+    def test_x_dec_loop(self):
+        @pio.asm_pio()
+        def count():
+            set(x, 3)
+            label("loop")
+            jmp(x_dec, "loop")
+            irq(0)
+            label("halt")
+            jmp("halt")
+
+        sm = pio.StateMachine(0, count, freq=1000)
+        fired = []
+        sm.irq(lambda s: fired.append(s.cycles))
+        sm.active(1)
+        pio.run([sm], 20 * MS, stop=lambda: fired)
+        # set, 4 jmps (x = 3, 2, 1, 0), irq
+        self.assertEqual(fired, [6])
+        self.assertEqual(sm.x, 0xffffffff)
+
+    def test_autopull_out_msb_first(self):
+        @pio.asm_pio(out_init=pio.OUT_LOW, autopull=True, out_shiftdir=pio.SHIFT_LEFT)
+        def shift_out():
+            out(pins, 1)
+
+        sm = pio.StateMachine(0, shift_out, freq=1000, out_base=2)
+        sm.put(0xA0000000)
+        sm.active(1)
+        pio.run([sm], 40 * MS)
+        self.assertEqual([level for _, level in sm.gpio.edges[2]], [0, 1, 0, 1, 0])
+        # stalled on the empty FIFO once the word was shifted out
+        self.assertGreater(sm.stall_cycles, 0)
+
+    def test_autopush_in(self):
+        @pio.asm_pio(autopush=True, push_thresh=8, in_shiftdir=pio.SHIFT_LEFT)
+        def shift_in():
+            in_(pins, 1)
+
+        gpio = pio.GPIO()
+        gpio.drive(3, [(0, 1), (2 * MS, 0), (3 * MS, 1), (8 * MS, 0)])
+        sm = pio.StateMachine(0, shift_in, freq=1000, in_base=3, gpio=gpio)
+        sm.active(1)
+        pio.run([sm], 16 * MS)
+        self.assertEqual(sm.rx, [0b11011111, 0])
+
+    def test_wait_stalls(self):
+        @pio.asm_pio()
+        def waiter():
+            wait(1, pin, 0)
+            irq(0)
+            label("halt")
+            jmp("halt")
+
+        gpio = pio.GPIO()
+        gpio.drive(4, [(7 * MS, 1)])
+        sm = pio.StateMachine(0, waiter, freq=1000, in_base=4, gpio=gpio)
+        fired = []
+        sm.irq(lambda s: fired.append(gpio.now_ns))
+        sm.active(1)
+        pio.run([sm], 20 * MS, stop=lambda: fired)
+        self.assertEqual(fired, [8 * MS])
+
+
+    def test_side_set(self):
+        @pio.asm_pio(sideset_init=pio.OUT_LOW)
+        def strobe():
+            wait(1, pin, 0).side(1)
+            nop().side(0) [2]
+            nop()
+
+        gpio = pio.GPIO()
+        gpio.drive(4, [(3 * MS, 1)])
+        sm = pio.StateMachine(0, strobe, freq=1000, in_base=4, sideset_base=6, gpio=gpio)
+        sm.active(1)
+        pio.run([sm], 6 * MS)
+        # high as the wait issues and all the while it stalls, low for the next three
+        # cycles, then low again without .side(): the pin stays put
+        self.assertEqual(gpio.edges[6], [(0, 0), (0, 1), (4 * MS, 0)])
+
+
+class TestOpenThermPrograms(unittest.TestCase):
+    """opentherm_tx/opentherm_rx from opentherm_rp2, bit for bit at their real clocks."""
+
+    def setUp(self):
+        self.ot = load_programs()
+        self.gpio = pio.GPIO()
+        self.done = []
+
+    def make_tx(self):
+        sm = pio.StateMachine(0, self.ot.opentherm_tx, freq=self.ot.PIO_TX_FREQ, set_base=0, out_base=0, gpio=self.gpio)
+        sm.irq(lambda s: self.done.append(('tx', self.gpio.now_ns)))
+        return sm
+
+    def make_rx(self):
+        sm = pio.StateMachine(4, self.ot.opentherm_rx, freq=self.ot.PIO_RX_FREQ, in_base=1, jmp_pin=1, gpio=self.gpio)
+        sm.irq(lambda s: self.done.append(('rx', self.gpio.now_ns)))
+        sm.put(self.ot.PIO_RX_BITS - 1)
+        return sm
+
+    def test_tx_waveform(self):
+        tx = self.make_tx()
+        for word in frame_encode_manchester(4, 25, 0x1234, invert=True):
+            tx.put(word)
+        tx.active(1)
+        pio.run([tx], 100 * MS, stop=lambda: self.done)
+
+        edges = self.gpio.edges[0][1:]  # after the initial OUT_HIGH
+        start = edges[0][0]
+        # every edge falls on a 500us half-bit boundary of the 4kHz clock
+        for t, _ in edges:
+            self.assertEqual((t - start) % 500_000, 0)
+        # start bit + 32 bits + stop bit = 34ms, after which the line is left idle and the IRQ raised
+        self.assertEqual(edges[-1], (start + 33500 * 1000, 1))
+        self.assertEqual(self.done, [('tx', start + 34 * MS)])
+
+        # sampled mid half-bit and un-inverted (the line driver inverts), it's the Manchester frame
+        def level(t):
+            value = 1
+            for edge_t, edge_level in self.gpio.edges[0]:
+                if edge_t <= t:
+                    value = edge_level
+            return value ^ 1
+        halves = [level(start + i * 500_000 + 250_000) for i in range(68)]
+        mframe = manchester_encode(frame_encode(4, 25, 0x1234))
+        self.assertEqual(halves[:2], [1, 0])
+        self.assertEqual(halves[2:66], [(mframe >> i) & 1 for i in range(63, -1, -1)])
+        self.assertEqual(halves[66:], [1, 0])
+
+    def test_rx_decodes_ideal_frame(self):
+        rx = self.make_rx()
+        self.gpio.drive(1, pio.frame_waveform(frame_encode(4, 25, 0x1234), 2 * MS))
+        rx.active(1)
+        pio.run([rx], 100 * MS, stop=lambda: self.done)
+
+        self.assertEqual(self.done[0][0], 'rx')
+        self.assertEqual(decode_manchester_frame(rx.rx[0], rx.rx[1]), (4, 25, 0x1234))
+
+    def test_rx_tolerates_jitter(self):
+        # OT spec 4.2.1: transitions may be up to 10% of a bit (100us) off
+        for seed in range(5):
+            self.setUp()
+            offsets = [((i * 7919 + seed * 104729) % 201) * 1000 - 100_000 for i in range(68)]
+            rx = self.make_rx()
+            self.gpio.drive(1, pio.frame_waveform(frame_encode(4, 17, 0x4d80), 2 * MS, jitter=lambda i: offsets[i] if i else 0))
+            rx.active(1)
+            pio.run([rx], 100 * MS, stop=lambda: self.done)
+            self.assertEqual(decode_manchester_frame(rx.rx[0], rx.rx[1]), (4, 17, 0x4d80))
+
+    def test_rx_bit_timeout_between_half_and_whole_bit(self):
+        # a bit with no mid-bit edge is read once the timeout expires: that must come after
+        # a half bit (500us) would have had an edge, and before a whole bit (1ms)
+        rx = self.make_rx()
+        rx.trace = []
+        self.gpio.drive(1, [(1 * MS, 1), (int(1.5 * MS), 0)])  # a start bit, then nothing
+        rx.active(1)
+        pio.run([rx], 200 * MS, stop=lambda: self.done)
+
+        in_pc = next(i for i, ins in enumerate(self.ot.opentherm_rx.instructions) if ins.op == "in")
+        samples = [t for t, pc in rx.trace if pc == in_pc]
+        self.assertEqual(len(samples), self.ot.PIO_RX_BITS)
+        gaps = [b - a for a, b in zip(samples, samples[1:])]
+        self.assertGreater(min(gaps), 500_000)
+        self.assertLess(max(gaps), 1 * MS)
+
+        # a dead line after the start bit reads as all zeros, which isn't valid Manchester
+        with self.assertRaises(ValueError):
+            decode_manchester_frame(rx.rx[0], rx.rx[1])
+
+    def test_loopback_across_clocks(self):
+        tx = self.make_tx()
+        rx = self.make_rx()
+        # the RX pin sees the line through the interface, which inverts the TX pin
+        self.gpio.link(1, 0, invert=True)
+        for frame in ((0, 0, 0x0300), (1, 1, 0x4000), (4, 25, 0xffff), (7, 200, 0x8001)):
+            self.done.clear()
+            rx.restart()
+            rx.rx.clear()
+            rx.put(self.ot.PIO_RX_BITS - 1)
+            rx.active(1)
+            tx.restart()
+            for word in frame_encode_manchester(*frame, invert=True):
+                tx.put(word)
+            tx.active(1)
+            pio.run([tx, rx], self.gpio.now_ns + 100 * MS, stop=lambda: len(self.done) == 2)
+            tx.active(0)
+            rx.active(0)
+
+            self.assertEqual(sorted(name for name, _ in self.done), ['rx', 'tx'])
+            self.assertEqual(decode_manchester_frame(rx.rx[0], rx.rx[1]), frame)
+
+
+class TestOpenThermDecodeProgram(unittest.TestCase):
+    """opentherm_rx_decode: Manchester decoding in the state machine."""
+
+    def setUp(self):
+        self.ot = load_programs()
+        self.gpio = pio.GPIO()
+        self.done = []
+
+    def make_rx(self):
+        sm = pio.StateMachine(4, self.ot.opentherm_rx_decode, freq=self.ot.PIO_RX_FREQ, in_base=1, jmp_pin=1, gpio=self.gpio)
+        sm.irq(lambda s: self.done.append(self.gpio.now_ns))
+        sm.put(self.ot.PIO_RX_FRAME_BITS - 1)
+        return sm
+
+    def receive(self, transitions):
+        rx = self.make_rx()
+        self.gpio.drive(1, transitions)
+        rx.active(1)
+        pio.run([rx], 100 * MS, stop=lambda: self.done)
+        return rx
+
+    def test_decodes_ideal_frame(self):
+        for frame in ((4, 25, 0x1234), (0, 0, 0), (7, 255, 0xffff), (5, 1, 0x4000)):
+            self.setUp()
+            rx = self.receive(pio.frame_waveform(frame_encode(*frame), 2 * MS))
+            self.assertEqual(len(self.done), 1)
+            self.assertEqual(len(rx.rx), 1)
+            self.assertEqual(frame_decode(rx.rx[0]), frame)
+
+    def test_tolerates_jitter(self):
+        # resyncing on every mid-bit transition copes with more than the spec's 100us
+        for seed in range(10):
+            self.setUp()
+            offsets = [((i * 7919 + seed * 104729) % 301) * 1000 - 150_000 for i in range(68)]
+            rx = self.receive(pio.frame_waveform(frame_encode(4, 17, 0x4d80), 2 * MS, jitter=lambda i: offsets[i] if i else 0))
+            self.assertEqual(rx.rx, [frame_encode(4, 17, 0x4d80)])
+
+    def test_violation_pushes_marker(self):
+        # no transitions during the 5th bit: the line stays high through it, with no mid-bit fall
+        transitions = pio.frame_waveform(frame_encode(4, 25, 0x1234), 2 * MS)
+        bit_start = 2 * MS + 1 * MS + 4 * MS
+        transitions = [(t, level) for t, level in transitions if not bit_start <= t < bit_start + 1 * MS]
+        rx = self.receive(transitions)
+
+        self.assertEqual(len(self.done), 1)
+        # the 4 bits before it, plus the one that broke, sampled as a 1
+        self.assertEqual(rx.rx, [(frame_encode(4, 25, 0x1234) >> 27) | 1, self.ot.PIO_RX_VIOLATION])
+
+    def test_dead_line_after_start_bit(self):
+        rx = self.receive([(1 * MS, 1), (int(1.5 * MS), 0)])
+        self.assertEqual(len(self.done), 1)
+        self.assertEqual(rx.rx[-1], self.ot.PIO_RX_VIOLATION)
+        # given up within a bit or so, not left waiting for the rest of the frame
+        self.assertLess(self.done[0], 4 * MS)
+
+    def test_continuous_monitor(self):
+        # frames back to back at OT timings, captured by opentherm_rp2's monitor IRQ handler
+        from opentherm_monitor import FrameRing
+        ring = FrameRing(8)
+        self.ot.monitor_ring = ring
+        frames = [frame_encode(0, 0, 0x0300), frame_encode(4, 0, 0x000a), frame_encode(1, 1, 0x3c00), frame_encode(5, 1, 0x3c00)]
+        transitions = []
+        start = 2 * MS
+        for i, frame in enumerate(frames):
+            transitions += pio.frame_waveform(frame, start)
+            # the slave answers 20ms after a request; the master waits 100ms after a response
+            start += 34 * MS + (20 if i % 2 == 0 else 100) * MS
+        rx = self.make_rx()
+        rx.irq(self.ot._monitor_irq)
+        self.gpio.drive(1, transitions)
+        rx.active(1)
+        pio.run([rx], start)
+
+        self.assertEqual(ring.dropped, 0)
+        entries = [ring.pop() for _ in range(len(ring))]
+        self.assertEqual([(frame, flags) for _, frame, flags in entries], [(frame, 0) for frame in frames])
+
+    def test_monitor_recovers_after_violation(self):
+        from opentherm_monitor import FrameRing, FLAG_DECODE
+        ring = FrameRing(8)
+        self.ot.monitor_ring = ring
+        bad = pio.frame_waveform(frame_encode(4, 25, 0x1234), 2 * MS)
+        # the line stuck high from the 5th bit to the end of the frame
+        bad = [(t, level) for t, level in bad if t < 7 * MS] + [(7 * MS, 1), (37 * MS, 0)]
+        good = frame_encode(4, 0, 0x000a)
+        rx = self.make_rx()
+        rx.irq(self.ot._monitor_irq)
+        self.gpio.drive(1, bad + pio.frame_waveform(good, 60 * MS))
+        rx.active(1)
+        pio.run([rx], 100 * MS)
+
+        entries = [ring.pop() for _ in range(len(ring))]
+        self.assertEqual(entries[0][2], FLAG_DECODE)
+        self.assertEqual(entries[-1][1:], (good, 0))
+
+    def test_loopback(self):
+        tx = pio.StateMachine(0, self.ot.opentherm_tx, freq=self.ot.PIO_TX_FREQ, set_base=0, out_base=0, gpio=self.gpio)
+        tx.irq(lambda s: None)
+        rx = self.make_rx()
+        self.gpio.link(1, 0, invert=True)
+        for word in frame_encode_manchester(4, 25, 0xffff, invert=True):
+            tx.put(word)
+        tx.active(1)
+        rx.active(1)
+        pio.run([tx, rx], 100 * MS, stop=lambda: self.done)
+        self.assertEqual(frame_decode(rx.rx[0]), (4, 25, 0xffff))
+
+
+if __name__ == '__main__':
+    unittest.main()
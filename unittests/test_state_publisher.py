@@ -0,0 +1,119 @@
+"""Tests for change-driven MQTT state publishing in state_publisher.py"""
+
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from boiler_state import (
+    BoilerValues,
+    BOILER_CH_PRESSURE,
+    BOILER_FLOW_TEMPERATURE,
+    BOILER_FAN_SPEED,
+    BOILER_FLAME_ACTIVE,
+    BOILER_FAULT_ACTIVE,
+)
+from state_publisher import StatePublisher
+from sim.host import VirtualClock
+
+
+TOPICS = {
+    BOILER_FLOW_TEMPERATURE: ("flow", 0.1),
+    BOILER_CH_PRESSURE: ("pressure", 0.05),
+    BOILER_FAN_SPEED: ("fan", 60),
+    BOILER_FLAME_ACTIVE: ("flame", 0),
+    BOILER_FAULT_ACTIVE: ("fault", 0),
+}
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+        self.batches = 0
+
+    async def publish_many(self, messages, retain=False):
+        self.batches += 1
+        self.published.extend(messages)
+        return len(messages)
+
+
+class TestStatePublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        patcher = patch.object(time, "monotonic_ns", self.clock.monotonic_ns)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.values = BoilerValues()
+        self.publisher = StatePublisher(self.values, TOPICS, urgent=1 << BOILER_FAULT_ACTIVE,
+                                        interval_ms=1000, heartbeat_ms=60000)
+        self.mqc = FakeClient()
+
+    def publish(self, after_ms: int = 0) -> list:
+        self.clock.advance(after_ms / 1000)
+        self.mqc.published = []
+        asyncio.run(self.publisher.publish(self.mqc))
+        return self.mqc.published
+
+    def test_everything_published_first(self):
+        self.values.boiler_flow_temperature = 55.25
+        self.values.boiler_fan_speed = 1200
+        self.assertEqual(sorted(self.publish()), [
+            ("fan", b"1200"), ("fault", b"OFF"), ("flame", b"OFF"), ("flow", b"55.25"), ("pressure", b"0.0")])
+        # nothing changed: nothing sent
+        self.assertEqual(self.publish(5000), [])
+
+    def test_deadband(self):
+        self.values.boiler_ch_pressure = 1.5
+        self.publish()
+        self.values.boiler_ch_pressure = 1.52
+        self.assertEqual(self.publish(1000), [])
+        # measured from the value last published, so creeping changes add up
+        self.values.boiler_ch_pressure = 1.56
+        self.assertEqual(self.publish(1000), [("pressure", b"1.56")])
+
+    def test_booleans_on_change(self):
+        self.publish()
+        self.values.boiler_flame_active = True
+        self.assertEqual(self.publish(1000), [("flame", b"ON")])
+        self.values.boiler_flame_active = True
+        self.assertEqual(self.publish(1000), [])
+
+    def test_changes_batched_to_interval(self):
+        self.publish()
+        self.values.boiler_flow_temperature = 40.0
+        self.assertEqual(self.publish(100), [])
+        self.values.boiler_flow_temperature = 41.0
+        self.assertEqual(self.publish(900), [("flow", b"41.0")])
+
+    def test_urgent_straight_away(self):
+        self.publish()
+        self.values.boiler_flow_temperature = 40.0
+        self.values.boiler_fault_active = True
+        # everything pending goes with it, in the same batch
+        self.mqc.batches = 0
+        self.assertEqual(sorted(self.publish(10)), [("fault", b"ON"), ("flow", b"40.0")])
+        self.assertEqual(self.mqc.batches, 1)
+
+    def test_heartbeat(self):
+        self.publish()
+        self.values.boiler_ch_pressure = 0.01  # within the deadband
+        self.publish(1000)
+        self.assertEqual(len(self.publish(60000)), len(TOPICS))
+        self.assertIn(("pressure", b"0.01"), self.mqc.published)
+
+    def test_force(self):
+        self.publish()
+        self.publisher.force(1 << BOILER_FLAME_ACTIVE)
+        self.assertEqual(self.publish(10), [("flame", b"OFF")])
+
+    def test_reset(self):
+        self.publish()
+        self.publisher.reset()
+        self.assertEqual(len(self.publish(10)), len(TOPICS))
+        self.assertEqual(self.publisher.published, 2 * len(TOPICS))
+
+
+if __name__ == '__main__':
+    unittest.main()